@@ -0,0 +1,91 @@
+"""Startup time of the package: `import cryoswitch_manager` and time to the first command.
+
+Every measurement runs in a fresh interpreter. The first command is sent to a simulated
+controller ('sim://' port, see cryoswitch_manager/simulator.py) working on a temporary
+copy of the state files, so no hardware is needed. The script exits with status 1 when a
+median exceeds its budget or when heavy modules are imported eagerly again.
+
+    python benchmarks/startup.py --runs 7 --import-budget 0.3 --first-command-budget 0.6
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.join(ROOT, 'cryoswitch_manager')
+
+# must not be imported by `import cryoswitch_manager`
+LAZY_MODULES = ('matplotlib', 'subprocess', 'serial.tools.list_ports', 'concurrent.futures.process', 'PyQt5',
+                'cryoswitch_manager.daemon')
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import cryoswitch_manager
+t1 = time.perf_counter()
+eager = [name for name in {lazy!r} if name in sys.modules]
+result = {{'import_s': t1 - t0, 'eager': eager}}
+if {first_command!r}:
+    from cryoswitch_manager import Cryoswitch
+    cs = Cryoswitch(COM_port='sim://BENCH0001', override_abspath={workdir!r})
+    cs.get_power_status()
+    result['first_command_s'] = time.perf_counter() - t0
+print(json.dumps(result))
+"""
+
+
+def probe(workdir, first_command):
+    code = PROBE.format(lazy=LAZY_MODULES, first_command=first_command, workdir=workdir)
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CryoSwitch startup benchmark')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--import-budget', type=float, default=0.3, help='median import time budget in s')
+    parser.add_argument('--first-command-budget', type=float, default=0.6,
+                        help='median time from interpreter start of the import to the first reply in s')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cryoswitch_bench_')
+    try:
+        for name in ('states.json', 'constants.json', 'history.json'):
+            shutil.copy(os.path.join(PACKAGE, name), workdir)
+        probe(workdir, False)  # warm the bytecode cache
+        import_times = []
+        first_command_times = []
+        eager = set()
+        for _ in range(args.runs):
+            result = probe(workdir, False)
+            import_times.append(result['import_s'])
+            eager.update(result['eager'])
+            first_command_times.append(probe(workdir, True)['first_command_s'])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = False
+    for label, times, budget in (
+        ('import cryoswitch_manager', import_times, args.import_budget),
+        ('time to first command', first_command_times, args.first_command_budget),
+    ):
+        median = statistics.median(times)
+        status = 'OK' if median <= budget else 'OVER BUDGET'
+        failed |= median > budget
+        print(f'{label:<26} median {median * 1000:7.1f}ms  min {min(times) * 1000:7.1f}ms  '
+              f'budget {budget * 1000:7.1f}ms  {status}')
+    if eager:
+        failed = True
+        print(f'Eagerly imported: {", ".join(sorted(eager))}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,95 @@
 import time
-import matplotlib.pyplot as plt
+import threading
 from .libphox import Labphox
+from .pulse_analytics import analyze_archive, trend_table, print_trend_table
+from .retention import RetentionPolicy, shared_compactor, pulse_log_lock, waveform_path, ANOMALOUS_SUFFIX
+from .journal import JournalLocked, StateJournal
+from .event_store import EventStore
+from .pulse_capture import PulseCapture
+from .verification import PulseSignature, RetryPolicy
+from .waveform_index import WaveformIndex
+from .state_table import StateTable
 import numpy as np
 import json
 import os
 
-class Cryoswitch:
+# settle times of the supplies after they are switched on or set, also applied when a reset board is restored
+NEGATIVE_SUPPLY_SETTLE_S = 1
+CONVERTER_SETTLE_S = 2
 
-    def __init__(self, debug=False, COM_port='', IP=None, SN=None, override_abspath=False):
+class Cryoswitch:
+    def __init__(self, debug=False, COM_port='', IP=None, SN=None, override_abspath=False, TCP=False):
         self.debug = debug
         self.port = COM_port
         self.IP = IP
         self.verbose = True
+        # held by switch operations so that operations from several threads don't interleave
+        self.lock = threading.RLock()
 
-        self.labphox = Labphox(self.port, debug=self.debug, IP=self.IP, SN=SN)
+        self.labphox = Labphox(self.port, debug=self.debug, IP=self.IP, SN=SN, TCP=TCP)
+        self.labphox.reconnect_hooks.append(self.resume_session)
         self.ports_enabled = self.labphox.N_channel
         self.SN = self.labphox.board_SN
         self.HW_rev = self.get_HW_revision()
         self.HW_rev_N = int(self.get_HW_revision()[-1])
 
         self.wait_time = 0.5
+        self.started = False
+        self.ADC_started = False
         self.pulse_duration_ms = 15
         self.converter_voltage = 5
         self.MEASURED_converter_voltage = 0
+        self.OCP_mA = None
         self.current_switch_model = ''
         self.tolerance = 0.15
 
         if override_abspath:
-            self.abs_path = override_abspath + '\\'
+            self.abs_path = override_abspath
         else:
-            self.abs_path = os.path.dirname(__file__) + '\\'
+            self.abs_path = os.path.dirname(__file__)
 
         self.decimals = 2
         self.plot = False
         self.log_wav = True
-        self.log_wav_dir = self.abs_path + r'data'
+        self.log_wav_dir = os.path.join(self.abs_path, 'data')
+        self.waveform_index = None
+        self.heat_scheduler = None  # HeatBudgetScheduler pacing every pulse, see CryoSwitchManager.set_heat_budget
         self.align_edges = True
         self.plot_polarization = True
 
         self.pulse_logging = True
-        self.pulse_logging_filename = self.abs_path + r'pulse_logging.txt'
+        self.pulse_logging_filename = os.path.join(self.abs_path, 'pulse_logging.txt')
+        self.pulse_logging_lock = pulse_log_lock(self.pulse_logging_filename)
         self.log_pulses_to_display = 5
         self.warning_threshold_current = 60
 
         self.track_states = True
-        self.track_states_file = self.abs_path + r'states.json'
-
-        self.constants_file_name = self.abs_path + r'constants.json'
+        self.track_states_file = os.path.join(self.abs_path, 'states.json')
+        # states shared with the other processes, states.json is exported from it
+        self.state_table_file = os.path.join(self.abs_path, 'states.table')
+        self.state_table = None
+        self.journal_states = True
+        self.journal_replay_pending = True
+        self.journal_max_records = 1000
+        self.journal = None
+        self.pending_actuations = []
+
+        # retention deletes and decimates logged data, it is enabled with enable_log_retention()
+        self.log_retention = None
+        self.log_compactor = None
+
+        self.event_store_file = os.path.join(self.abs_path, 'events.sqlite')
+        self.event_store = None
+        self.event_store_waveforms = True
+
+        # connect()/disconnect() check the captured current and retry failed actuations, see verified_pulse()
+        self.verify_actuation = False
+        self.pulse_signature = PulseSignature()
+        self.actuation_retry = RetryPolicy()
+
+        self.calibrate_ADC = False
+        self._measured_adc_ref = None
+        self.constants_file_name = os.path.join(self.abs_path, 'constants.json')
         self.__constants()
 
         if self.track_states:
@@ -59,13 +102,62 @@ class Cryoswitch:
             self.log_wav_init()
 
     def tracking_init(self):
-        file = open(self.track_states_file)
-        states = json.load(file)
-        file.close()
-        if self.SN not in states.keys():
-            states[self.SN] = states['SN']
-            with open(self.track_states_file, 'w') as outfile:
-                json.dump(states, outfile, indent=4, sort_keys=True)
+        self.state_table = StateTable.open(self.state_table_file, seed_file=self.track_states_file)
+        if self.SN not in self.state_table:
+            self.state_table.add(self.SN)
+            self.state_table.export(self.track_states_file)
+
+        if self.journal_states:
+            self.journal_init()
+
+    def journal_init(self):
+        try:
+            self.journal = StateJournal(os.path.join(self.abs_path, f'state_journal_{self.SN}.jsonl'))
+        except JournalLocked as error:
+            print(f'WARNING: {error}, actuations of this process are not journaled')
+            return
+        committed, pending = self.journal.recover()
+
+        if committed:
+            for (port, contact), polarity in committed.items():
+                self.state_table.set_state(self.SN, port, contact, polarity)
+            self.state_table.export(self.track_states_file)
+
+        pending_seqs = [record['seq'] for record in pending]
+        for record in self.journal.pending:
+            if record['seq'] not in pending_seqs:
+                self.journal.commit(record['seq'], False)  # superseded by a later actuation of the same contact
+        self.journal.checkpoint()
+
+        self.pending_actuations = pending
+        if pending:
+            print(f'WARNING: {len(pending)} interrupted actuation(s) found in the state journal, '
+                  f'they will be replayed on start()')
+
+    def replay_pending_actuations(self):
+        # interrupted actuations are replayed with the switch model, voltage and pulse duration they were
+        # sent with, the settings of the session are restored afterwards
+        model, voltage, duration = self.current_switch_model, self.converter_voltage, self.pulse_duration_ms
+        try:
+            for record in self.pending_actuations:
+                print(f"Replaying interrupted actuation Port:{record['port']}-{record['contact']}, polarity {record['polarity']}")
+                if record.get('model') and record['model'] != self.current_switch_model:
+                    self.select_switch_model(record['model'])
+                if record.get('voltage') is not None and record['voltage'] != self.converter_voltage:
+                    self.set_output_voltage(record['voltage'])
+                if record.get('pulse_duration_ms') is not None and record['pulse_duration_ms'] != self.pulse_duration_ms:
+                    self.set_pulse_duration_ms(record['pulse_duration_ms'])
+                current_profile = self.select_and_pulse(record['port'], record['contact'], record['polarity'])
+                self.journal.commit(record['seq'], len(current_profile) > 0)
+        finally:
+            if model and model != self.current_switch_model:
+                self.select_switch_model(model)
+            if voltage != self.converter_voltage:
+                self.set_output_voltage(voltage)
+            if duration != self.pulse_duration_ms:
+                self.set_pulse_duration_ms(duration)
+        self.pending_actuations = []
+        self.journal.checkpoint()
 
     def pulse_logging_init(self):
         if not os.path.isfile(self.pulse_logging_filename):
@@ -75,6 +167,66 @@ class Cryoswitch:
     def log_wav_init(self):
         if not os.path.isdir(self.log_wav_dir):
             os.mkdir(self.log_wav_dir)
+        self.waveform_index = WaveformIndex(self.log_wav_dir, self.SN)
+
+    def retention_init(self):
+        self.log_compactor = shared_compactor(
+            self.log_wav_dir if self.log_wav else None,
+            self.pulse_logging_filename if self.pulse_logging else None,
+            self.log_retention
+        )
+
+    def enable_log_retention(self, policy=None):
+        """Apply a retention policy to the waveform and pulse logs, in the background.
+
+        Old waveforms are decimated or deleted and the pulse log is trimmed for good, see `RetentionPolicy`.
+        Controllers logging to the same directory share one compactor. Enable it in one process only when
+        several processes log to the same directory, see `retention`.
+
+        Args:
+            policy (RetentionPolicy, optional): limits to apply. Defaults to RetentionPolicy().
+        """
+        self.log_retention = policy or RetentionPolicy()
+        if self.log_wav or self.pulse_logging:
+            self.retention_init()
+
+    def disable_log_retention(self):
+        """Stop the compaction of the logs, also for the other controllers sharing them."""
+        if self.log_compactor:
+            self.log_compactor.stop()
+        self.log_retention = None
+        self.log_compactor = None
+
+    def enable_event_store(self, filename=None):
+        if filename:
+            self.event_store_file = filename
+        if not self.event_store:
+            self.event_store = EventStore(self.event_store_file)
+        return self.event_store
+
+    def disable_event_store(self):
+        if self.event_store:
+            self.event_store.close()
+            self.event_store = None
+
+    def close(self):
+        """Flush and close the event store, release the state journal and write `states.json`, once the pulse in
+        progress, if any, is done."""
+        with self.lock:
+            self.disable_event_store()
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+            if self.state_table is not None:
+                self.state_table.export_pending()
+
+    def record_housekeeping(self, quantity, value):
+        if self.event_store:
+            self.event_store.record_housekeeping(self.SN, quantity, value)
+
+    def record_fault(self, kind, detail=''):
+        if self.event_store:
+            self.event_store.record_fault(self.SN, kind, detail)
 
     def __constants(self):
         file = open(self.constants_file_name)
@@ -116,24 +268,36 @@ class Cryoswitch:
 
             self.sampling_freq = 28000
 
-            if constants['calibrate_ADC']:
-                self.labphox.ADC3_cmd('start')
-                time.sleep(0.1)
-                ref_values = []
-                for it in range(5):
-                    ref_values.append(self.get_V_ref())
-                measured_ref = sum(ref_values) / len(ref_values)
-
-                if 3.1 < measured_ref < 3.5:
-                    self.measured_adc_ref = measured_ref
-                else:
-                    print(f'Measured ADC ref {measured_ref}V outside of range')
-                    self.measured_adc_ref = self.labphox.adc_ref
-            else:
-                self.measured_adc_ref = self.labphox.adc_ref
+            # the ADC reference is measured on first use, see `measured_adc_ref`
+            self.calibrate_ADC = constants['calibrate_ADC']
         else:
             print(f'Failed to load constants, HW revision {self.HW_rev} not int {constants.keys()}')
 
+    def calibrate_ADC_ref(self):
+        if not self.calibrate_ADC:
+            return self.labphox.adc_ref
+        self.labphox.ADC3_cmd('start')
+        time.sleep(0.1)
+        ref_values = []
+        for it in range(5):
+            ref_values.append(self.get_V_ref())
+        measured_ref = sum(ref_values) / len(ref_values)
+
+        if 3.1 < measured_ref < 3.5:
+            return measured_ref
+        print(f'Measured ADC ref {measured_ref}V outside of range')
+        return self.labphox.adc_ref
+
+    @property
+    def measured_adc_ref(self):
+        if self._measured_adc_ref is None:
+            self._measured_adc_ref = self.calibrate_ADC_ref()
+        return self._measured_adc_ref
+
+    @measured_adc_ref.setter
+    def measured_adc_ref(self, value):
+        self._measured_adc_ref = value
+
     def set_FW_upgrade_mode(self):
         self.labphox.reset_cmd('boot')
 
@@ -158,7 +322,27 @@ class Cryoswitch:
         time.sleep(3)
 
     def reconnect(self):
-        self.labphox.connect()
+        self.labphox.reconnect()
+
+    def get_link_statistics(self):
+        return self.labphox.link_statistics()
+
+    def resume_session(self):
+        """Bring the board back to the configuration of the session after its link was reopened.
+
+        Called by the Labphox once the board answers again. If the output stage is still powered
+        the board kept its configuration and nothing is written, so a glitch of the link costs a
+        single PWR_STATUS query. Otherwise the board was reset and the configuration registers
+        written during the session are restored from the Labphox shadow.
+        """
+        if not self.started or self.get_power_status():
+            return
+        # the supplies are given the settle time of their setters before the next pulse
+        restored = self.labphox.restore_shadow(settle_s={'1:C': NEGATIVE_SUPPLY_SETTLE_S, '1:F': CONVERTER_SETTLE_S})
+        self.ADC_started = '4:T' in self.labphox.shadow
+        self.record_fault('reset', f'{restored} configuration registers restored after reconnection')
+        if self.verbose:
+            print(f'Board reset while disconnected, {restored} configuration registers restored')
 
     def enable_5V(self):
         self.labphox.gpio_cmd('EN_5V', 1)
@@ -183,7 +367,13 @@ class Cryoswitch:
         error = abs((measured - set) / set)
         return error
 
+    def start_ADC(self):
+        self.labphox.ADC_cmd('start')
+        self.ADC_started = True
+
     def measure_ADC(self, channel):
+        if not self.ADC_started:
+            self.start_ADC()
         self.labphox.ADC_cmd('select', channel)
         time.sleep(self.wait_time)
         return self.labphox.ADC_cmd('get')
@@ -193,15 +383,17 @@ class Cryoswitch:
         code = self.measure_ADC(self.converter_ADC)
         converter_voltage = round(code * converter_gain, self.decimals)
         self.MEASURED_converter_voltage = converter_voltage
+        self.record_housekeeping('converter_voltage', converter_voltage)
         return converter_voltage
 
     def get_bias_voltage(self):
         bias_gain = self.measured_adc_ref * ((self.bv_R2 + self.bv_R1) / self.bv_R1) / self.ADC_12B_res
         bias_offset = self.measured_adc_ref*self.bv_R2/self.bv_R1
         code = self.measure_ADC(self.bv_ADC)
-        bias_voltage = code * bias_gain-bias_offset
+        bias_voltage = round(code * bias_gain-bias_offset, self.decimals)
+        self.record_housekeeping('bias_voltage', bias_voltage)
 
-        return round(bias_voltage, self.decimals)
+        return bias_voltage
 
     def check_voltage(self, measured_voltage, target_voltage, tolerance=0.1, pre_str=''):
         error = self.calculate_error(measured_voltage, target_voltage)
@@ -223,6 +415,7 @@ class Cryoswitch:
         V25 = 0.76
         Avg_Slope = 0.0025
         temp = ((VSENSE - V25) / Avg_Slope) + 25
+        self.record_housekeeping('internal_temperature', temp)
         return temp
 
     def get_V_ref(self):
@@ -239,7 +432,7 @@ class Cryoswitch:
 
     def enable_negative_supply(self):
         self.labphox.gpio_cmd('EN_CHGP', 1)
-        time.sleep(1)
+        time.sleep(NEGATIVE_SUPPLY_SETTLE_S)
         bias_voltage = self.get_bias_voltage()
         if self.verbose:
             self.check_voltage(bias_voltage, -5, tolerance=self.tolerance, pre_str='BIAS STATUS:')
@@ -274,7 +467,7 @@ class Cryoswitch:
                 self.labphox.DAC_cmd('set', DAC=1, value=code)
                 # if Vout < self.converter_voltage:
                 #     self.discharge()
-                time.sleep(2)
+                time.sleep(CONVERTER_SETTLE_S)
                 self.converter_voltage = Vout
                 measured_voltage = self.get_converter_voltage()
 
@@ -353,12 +546,17 @@ class Cryoswitch:
             DAC_reg = self.calculate_OCP_code(OCP_value)
             if DAC_reg:
                 self.labphox.DAC_cmd('set', DAC=2, value=DAC_reg)
+                self.OCP_mA = OCP_value
                 return OCP_value
         print(f'Over current protection outside of range {self.OCP_range[0]}-{self.OCP_range[1]}mA')
         return None
 
     def get_OCP_status(self):
-        return self.labphox.gpio_cmd('OCP_OUT_STATUS')
+        status = self.labphox.gpio_cmd('OCP_OUT_STATUS')
+        self.record_housekeeping('OCP_status', status)
+        if status:
+            self.record_fault('OCP', f'OCP_OUT_STATUS={status}')
+        return status
 
     def enable_chopping(self):
         self.labphox.gpio_cmd('CHOPPING_EN', 1)
@@ -415,11 +613,13 @@ class Cryoswitch:
     def send_pulse(self):
         if not self.get_power_status():
             print('WARNING: Timing protection triggered, resetting...')
+            self.record_fault('timing_protection', 'PWR_STATUS=0 before pulse')
             self.reset_output_supervisor()
 
         current_data = self.labphox.application_cmd('pulse', 1)
+        metadata = {'time': time.time(), 'SN': self.SN, 'voltage': self.MEASURED_converter_voltage}
 
-        return current_data * self.get_current_gain()
+        return PulseCapture(current_data, self.get_current_gain(), self.sampling_freq, metadata=metadata)
 
     def select_switch_model(self, model='R583423141'):
         if model.upper() == 'R583423141'.upper():
@@ -476,6 +676,8 @@ class Cryoswitch:
             return None
 
     def plotting_function(self, current_profile, port, contact, polarity):
+        import matplotlib.pyplot as plt
+
         if polarity:
             polarity_str = 'Connect'
         else:
@@ -515,40 +717,131 @@ class Cryoswitch:
             polarity = 1
         else:
             polarity = 0
+        # every pulse waits for the heat budget, retries and replays included, before its channel is selected
+        if self.heat_scheduler:
+            estimate = self.heat_scheduler.before_pulse(self)
+        if self.journal:
+            settings = {'model': self.current_switch_model, 'voltage': self.converter_voltage,
+                        'pulse_duration_ms': self.pulse_duration_ms}
+            seq = self.journal.begin(self.SN, port, contact, polarity, settings)
         selection_result = self.select_output_channel(port, contact, polarity)
         if selection_result:
             current_profile = self.send_pulse()
+            current_profile.metadata.update({'port': port, 'contact': contact, 'polarity': polarity})
             self.disable_output_channels()
+            if self.heat_scheduler:
+                self.heat_scheduler.after_pulse(self, estimate, current_profile)
+            if self.journal:
+                self.journal.commit(seq, True)
             if self.plot:
                 self.plotting_function(current_profile=current_profile, port=port, contact=contact, polarity=polarity)
             if self.track_states:
                 self.save_switch_state(port, contact, polarity)
+                if self.journal and self.journal.n_records > self.journal_max_records:
+                    self.journal.checkpoint()
             if self.pulse_logging:
                 self.log_pulse(port, contact, polarity, current_profile.max())
             if self.log_wav:
                 self.log_waveform(port, contact, polarity, current_profile)
+            if self.event_store:
+                self.record_pulse(port, contact, polarity, current_profile)
             return current_profile
         else:
+            if self.heat_scheduler:
+                self.heat_scheduler.after_pulse(self, estimate, [])
+            if self.journal:
+                self.journal.commit(seq, False)
             return []
 
+    def verify_pulse(self, current_profile, expect_motion=True):
+        ok, reason = self.pulse_signature.check(
+            current_profile, self.calculate_polarization_current_mA(), expect_motion=expect_motion
+        )
+        current_profile.metadata.update({'verified': ok, 'reason': reason})
+        return ok
+
+    def verified_pulse(self, port, contact, polarity):
+        """Pulse a contact and check the captured current against the expected signature.
+
+        A pulse failing the check is retried with the escalating pulse duration and output voltage of
+        `actuation_retry`, the original settings are restored afterwards. When the retries run out the
+        tracked state of the contact is set to unknown.
+
+        Returns:
+            PulseCapture: the capture of the last attempt, with 'verified', 'reason' and 'attempts' in its
+                metadata, or an empty list if the output channel couldn't be selected.
+        """
+        expect_motion = False
+        if self.track_states:
+            port_states = self.get_port_states(port)
+            if port_states is not None:
+                previous_state = port_states.get('contact_' + str(contact))
+                expect_motion = previous_state is not None and previous_state != polarity
+
+        pulse_duration_ms, converter_voltage = self.pulse_duration_ms, self.converter_voltage
+        current_profile = []
+        try:
+            for attempt in range(self.actuation_retry.max_retries + 1):
+                if attempt:
+                    duration, voltage = self.actuation_retry.settings(
+                        attempt, pulse_duration_ms, converter_voltage,
+                        self.pulse_duration_range, self.converter_output_voltage_range
+                    )
+                    print(f'WARNING: Port:{port}-{contact} actuation not verified ({current_profile.metadata["reason"]}), '
+                          f'retrying with {duration}ms, {voltage}V')
+                    if duration != self.pulse_duration_ms:
+                        self.set_pulse_duration_ms(duration)
+                    if voltage != self.converter_voltage:
+                        self.set_output_voltage(voltage)
+
+                current_profile = self.select_and_pulse(port, contact, polarity)
+                if not len(current_profile):
+                    return current_profile
+                current_profile.metadata['attempts'] = attempt + 1
+                if self.verify_pulse(current_profile, expect_motion=expect_motion):
+                    return current_profile
+                self.record_fault('unverified_actuation', f'Port:{port}-{contact}, {current_profile.metadata["reason"]}')
+        finally:
+            if self.pulse_duration_ms != pulse_duration_ms:
+                self.set_pulse_duration_ms(pulse_duration_ms)
+            if self.converter_voltage != converter_voltage:
+                self.set_output_voltage(converter_voltage)
+
+        print(f'WARNING: Port:{port}-{contact} actuation failed after {self.actuation_retry.max_retries} retries')
+        if self.track_states:
+            self.save_switch_state(port, contact, None)
+            # the pulses were journaled as sent, a replay after a crash must not restore their state either
+            if self.journal:
+                self.journal.mark_unknown(self.SN, port, contact)
+        return current_profile
+
+    def record_pulse(self, port, contact, polarity, current_profile):
+        self.event_store.record_pulse(
+            self.SN, port, contact, polarity, self.MEASURED_converter_voltage, current_profile, self.sampling_freq,
+            store_waveform=self.event_store_waveforms
+        )
+        if self.track_states:
+            self.event_store.record_state(self.SN, port, contact, polarity)
+        if current_profile.max() < self.warning_threshold_current:
+            self.record_fault('low_current', f'Port:{port}-{contact}, CurrentMax:{round(current_profile.max())}')
+
     def save_switch_state(self, port, contact, polarity):
-        file = open(self.track_states_file)
-        states = json.load(file)
-        file.close()
+        if self.state_table.set_state(self.SN, str(port), contact, polarity) is not None:
+            self.state_table.schedule_export(self.track_states_file)
 
-        SN = self.SN
-        port = 'port_' + str(port)
-        contact = 'contact_' + str(contact)
-        if SN in states.keys():
-            states[SN][port][contact] = polarity
+    def get_port_states(self, port):
+        if self.state_table is None:
+            return None
+        return self.state_table.port_states(self.SN, str(port))
 
-            with open(self.track_states_file, 'w') as outfile:
-                json.dump(states, outfile, indent=4, sort_keys=True)
+    def has_pending_actuation(self, port, contact=None):
+        for record in self.pending_actuations:
+            if record['port'] == port and (contact is None or record['contact'] == contact):
+                return True
+        return False
 
     def get_switches_state(self, port=None):
-        file = open(self.track_states_file)
-        states = json.load(file)
-        file.close()
+        states = self.state_table.states(self.SN) if self.state_table else None
         ports = []
         if self.ports_enabled == 1:
             ports = ['A']
@@ -559,9 +852,9 @@ class Cryoswitch:
         elif self.ports_enabled == 4:
             ports = ['A', 'B', 'C', 'D']
 
-        if self.SN in states.keys():
+        if states is not None:
             if port in ports:
-                current_state = states[self.SN]
+                current_state = states
                 print('Port ' + port + ' state')
                 for switch in range(1, 7):
                     state = current_state['port_' + port]['contact_' + str(switch)]
@@ -575,16 +868,24 @@ class Cryoswitch:
                 print('      ' + chr(0x2514) + '- COM')
                 print('')
 
-            return states[self.SN]
+            return states
         else:
             return None
 
     def log_waveform(self, port, contact, polarity, current_profile):
-        name = self.log_wav_dir + '\\' + str(int(time.time())) + '_' + str(
-            self.MEASURED_converter_voltage) + 'V_' + str(port) + str(contact) + '_' + str(polarity) + '.json'
-        waveform = {'time':time.time(), 'voltage': self.MEASURED_converter_voltage, 'port': port, 'contact': contact, 'polarity':polarity, 'SF': self.sampling_freq,'data':list(current_profile)}
-        with open(name, 'w') as outfile:
-            json.dump(waveform, outfile, indent=4, sort_keys=True)
+        timestamp = time.time()
+        name = str(int(timestamp)) + '_' + str(
+            self.MEASURED_converter_voltage) + 'V_' + str(port) + str(contact) + '_' + str(polarity)
+        if current_profile.max() < self.warning_threshold_current:
+            name += ANOMALOUS_SUFFIX
+        path = waveform_path(self.log_wav_dir, self.SN, timestamp, name + '.json')
+        waveform = {'time':timestamp, 'SN': self.SN, 'voltage': self.MEASURED_converter_voltage, 'port': port, 'contact': contact, 'polarity':polarity, 'SF': self.sampling_freq,'data':current_profile.tolist()}
+        with open(path, 'w') as outfile:
+            json.dump(waveform, outfile, sort_keys=True)
+        self.waveform_index.append(timestamp, port, contact, polarity, self.MEASURED_converter_voltage, path)
+
+        if self.log_compactor:
+            self.log_compactor.notify()
 
     def log_pulse(self, port, contact, polarity, max_current):
         if polarity:
@@ -599,8 +900,12 @@ class Cryoswitch:
         else:
             warning_string = ''
 
-        with open(self.pulse_logging_filename, 'a') as logging_file:
-            logging_file.write(pulse_string + warning_string + '\n')
+        with self.pulse_logging_lock:
+            with open(self.pulse_logging_filename, 'a') as logging_file:
+                logging_file.write(pulse_string + warning_string + '\n')
+
+        if self.log_compactor:
+            self.log_compactor.notify()
 
     def get_pulse_history(self, port=None, pulse_number=None):
         if not pulse_number:
@@ -635,6 +940,13 @@ class Cryoswitch:
 
             print(raw_data[0] + ', ' + time.strftime("%a %b-%m %H:%M:%S%p", pulse_time) + ' ' + extra_text)
 
+    def get_switch_health(self, processes=None, window=20, display=True):
+        records = analyze_archive(self.log_wav_dir, processes=processes)
+        rows = trend_table(records, window=window)
+        if display:
+            print_trend_table(rows)
+        return rows
+
     def validate_port_contact(self, port, contact):
         if port == 'A' and self.ports_enabled >= 1:
             send_pulse = True
@@ -660,6 +972,8 @@ class Cryoswitch:
             if self.debug:
                 print(f'Connecting Port:{port}, Contact {contact}')
 
+            if self.verify_actuation:
+                return self.verified_pulse(port, contact, 1)
             current_profile = self.select_and_pulse(port, contact, 1)
             return current_profile
         else:
@@ -673,6 +987,8 @@ class Cryoswitch:
             if self.debug:
                 print(f'Connecting Port:{port}, Contact {contact}')
 
+            if self.verify_actuation:
+                return self.verified_pulse(port, contact, 0)
             current_profile = self.select_and_pulse(port, contact, 0)
             return current_profile
         else:
@@ -680,10 +996,13 @@ class Cryoswitch:
             return None
 
     def disconnect_all(self, port):
+        current_profiles = []
         for contact in range(1, 7):
-            self.disconnect(port, contact)
+            current_profiles.append(self.disconnect(port, contact))
         if self.plot:
+            import matplotlib.pyplot as plt
             plt.legend([1, 2, 3, 4, 5, 6])
+        return current_profiles
 
     def smart_connect(self, port, contact, force=False):
         states = self.get_switches_state()
@@ -723,6 +1042,7 @@ class Cryoswitch:
             expected_current = ((voltage - 2.2) / 10000 + (voltage - 3) / 4700 + voltage / 480) * 1000
             test_current = self.discharge()
             if self.plot:
+                import matplotlib.pyplot as plt
                 plt.plot(test_current)
                 plt.hlines(expected_current, 0, len(test_current), colors='red', linestyles='dashed')
                 plt.xlabel('Sample')
@@ -734,7 +1054,9 @@ class Cryoswitch:
             return None
 
     def get_power_status(self):
-        return self.labphox.gpio_cmd('PWR_STATUS')
+        status = self.labphox.gpio_cmd('PWR_STATUS')
+        self.record_housekeeping('PWR_STATUS', status)
+        return status
 
     def set_ip(self, add='192.168.1.101'):
         self.labphox.ETHERNET_cmd('set_ip_str', add)
@@ -755,7 +1077,7 @@ class Cryoswitch:
     def start(self):
         if self.verbose:
             print('Initialization...')
-        self.labphox.ADC_cmd('start')
+        self.start_ADC()
 
         self.enable_3V3()
         self.enable_5V()
@@ -773,6 +1095,9 @@ class Cryoswitch:
         else:
             if self.verbose:
                 print('POWER STATUS: Ready')
+            if self.pending_actuations and self.journal_replay_pending:
+                self.replay_pending_actuations()
+        self.started = True
 
 
 if __name__ == "__main__":
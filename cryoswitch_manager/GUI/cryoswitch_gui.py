@@ -1,14 +1,24 @@
-_VERSION = "v1.1"  # nopep8
+_VERSION = "v1.5"  # nopep8
 
 # Changelog
 # 1.1: Removed numpy dependency
+# 1.2: Hardware calls run in a worker thread with a command queue, progress indicator
+# 1.3: Bounded waveform cache, NumPy time axes and min/max decimation of long captures
+# 1.4: Live telemetry panel polled in the background behind switching commands
+# 1.5: Waveform history browser with overlays, waveforms are logged again
 
 import hashlib
+import itertools
 import json
 import os
+import queue
 import sys
+import threading
+import time
+from collections import OrderedDict
 
 import __main__
+import numpy as np
 import pyqtgraph as pg
 from CryoSwitchController import Cryoswitch
 from PyQt5 import QtCore, QtWidgets
@@ -20,7 +30,9 @@ from PyQt5.QtWidgets import (
     QGridLayout,
     QLabel,
     QLineEdit,
+    QProgressBar,
     QPushButton,
+    QTableView,
     QShortcut,
     QWidget,
 )
@@ -61,17 +73,108 @@ def generate_checksum(string):
     return checksum
 
 
-def python_arange(start, stop, step):
-    num = start
-    result = []
-    while num < stop:
-        result.append(num)
-        num += step
-    return result
+PLOT_MAX_POINTS = 4000
+TELEMETRY_FRAME_RATE_HZ = 10
+TELEMETRY_CHANNELS = (
+    "internal_temperature",
+    "converter_voltage",
+    "bias_voltage",
+    "PWR_STATUS",
+    "OCP_status",
+)
+
+
+def decimate_min_max(x, y, max_points=PLOT_MAX_POINTS):
+    """Keep the minimum and maximum of every bin of samples so that short spikes survive the decimation."""
+    if len(y) <= max_points:
+        return x, y
+    bin_size = -(-len(y) // (max_points // 2))
+    n_bins = len(y) // bin_size
+    bins = y[: n_bins * bin_size].reshape(n_bins, bin_size)
+    decimated_y = np.empty(2 * n_bins, dtype=y.dtype)
+    decimated_y[0::2] = bins.min(axis=1)
+    decimated_y[1::2] = bins.max(axis=1)
+    decimated_x = np.repeat(x[: n_bins * bin_size : bin_size], 2)
+    return decimated_x, decimated_y
+
+
+class WaveformCache:
+    """Captured pulses of the last `size` measurement IDs, the least recently used ones are dropped first."""
+
+    def __init__(self, size):
+        self.size = size
+        self._captures = OrderedDict()
+        self._time_axes = {}
+
+    def __contains__(self, measurement_ID):
+        return measurement_ID in self._captures
+
+    def __len__(self):
+        return len(self._captures)
+
+    def put(self, measurement_ID, current_profile, OCP_mA):
+        self._captures[measurement_ID] = (current_profile, OCP_mA)
+        self._captures.move_to_end(measurement_ID)
+        while len(self._captures) > self.size:
+            self._captures.popitem(last=False)
+
+    def get(self, measurement_ID):
+        """Raw capture and current limit in mA of a measurement ID.
 
+        Raises:
+            KeyError: Error is raised when the measurement ID is not cached.
+        """
+        self._captures.move_to_end(measurement_ID)
+        return self._captures[measurement_ID]
 
-def python_ones(length):
-    return [1.0] * length
+    def time_axis(self, length, sampling_freq):
+        # one axis per sampling frequency, grown when needed, captures get a view of its start
+        time_axis = self._time_axes.get(sampling_freq)
+        if time_axis is None or len(time_axis) < length:
+            time_axis = self._time_axes[sampling_freq] = np.arange(length) / sampling_freq
+        return time_axis[:length]
+
+
+class TelemetryBuffer:
+    """Last `capacity` telemetry samples of every channel, in fixed-size ring buffers.
+
+    Every sample is written twice, `capacity` apart, so that the samples in time order are always a
+    contiguous view of the buffer and plotting them needs no copy.
+    """
+
+    def __init__(self, capacity, channels=TELEMETRY_CHANNELS):
+        self.capacity = capacity
+        self.channels = channels
+        self._time = np.zeros(2 * capacity)
+        self._values = {channel: np.full(2 * capacity, np.nan) for channel in channels}
+        self._next = 0
+        self.count = 0
+        self.updated = False
+
+    def append(self, timestamp, values):
+        for index in (self._next, self._next + self.capacity):
+            self._time[index] = timestamp
+            for channel in self.channels:
+                self._values[channel][index] = values.get(channel, np.nan)
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.updated = True
+
+    def _window(self):
+        start = self._next + self.capacity - self.count
+        return slice(start, start + self.count)
+
+    def time(self):
+        return self._time[self._window()]
+
+    def values(self, channel):
+        return self._values[channel][self._window()]
+
+    def latest(self):
+        if not self.count:
+            return {}
+        index = self._next + self.capacity - 1
+        return {channel: self._values[channel][index] for channel in self.channels}
 
 
 script_filename = os.path.abspath(sys.executable)
@@ -92,6 +195,10 @@ default_settings = {
     "default_pulse_current_limit_mA": 80,
     "default_pulse_duration_ms": 15,
     "default_pulse_current_chopping": True,
+    "plot_cache_size": 64,
+    "log_waveforms": True,
+    "telemetry_interval_s": 2.0,
+    "telemetry_history": 900,
     "IP": "192.168.1.101",
 }
 default_types = {
@@ -109,6 +216,10 @@ default_types = {
     "default_pulse_current_limit_mA": (int, float),
     "default_pulse_duration_ms": (int, float),
     "default_pulse_current_chopping": bool,
+    "plot_cache_size": int,
+    "log_waveforms": bool,
+    "telemetry_interval_s": (int, float),
+    "telemetry_history": int,
     "IP": str,
 }
 
@@ -183,6 +294,275 @@ def load_settings():
 settings = load_settings()
 
 
+class WaveformHistoryModel(QtCore.QAbstractTableModel):
+    """Table of waveform index entries, newest first. Cells are only formatted when the view shows them."""
+
+    COLUMNS = ("Date", "Port", "Contact", "Operation", "Voltage")
+
+    def __init__(self, parent=None):
+        super(WaveformHistoryModel, self).__init__(parent)
+        self.entries = []
+
+    def set_entries(self, entries):
+        self.beginResetModel()
+        self.entries = entries[::-1]
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        entry = self.entries[index.row()]
+        column = self.COLUMNS[index.column()]
+        if column == "Date":
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["time"]))
+        if column == "Port":
+            return entry["port"]
+        if column == "Contact":
+            return str(entry["contact"])
+        if column == "Operation":
+            return "connection" if entry["polarity"] else "disconnection"
+        return "" if entry["voltage"] is None else f"{entry['voltage']}V"
+
+
+class HistoryBrowser(QtWidgets.QDialog):
+    """Past actuations from the waveform log, any selection of them overlaid in one plot.
+
+    The list only reads the waveform index, captures are loaded from their file when selected and only the
+    selected ones are kept in memory. Traces are coloured from oldest (grey) to newest.
+    """
+
+    MAX_OVERLAY = 50
+
+    def __init__(self, waveform_index, port=None, contact=None, colors=None, parent=None):
+        super(HistoryBrowser, self).__init__(parent)
+        self.waveform_index = waveform_index
+        self.colors = colors or {
+            "old": (190, 190, 190),
+            "new": (0, 119, 187),
+            "background": (230, 230, 230),
+        }
+        self.captures = {}
+        self.setWindowTitle(f"Waveform history {waveform_index.SN}")
+
+        self.port_combobox = QtWidgets.QComboBox(self)
+        self.port_combobox.addItems(["All ports", "A", "B", "C", "D"])
+        self.port_combobox.setCurrentText(port or "All ports")
+        self.contact_combobox = QtWidgets.QComboBox(self)
+        self.contact_combobox.addItems(["All contacts"] + [str(contact) for contact in range(1, 7)])
+        self.contact_combobox.setCurrentText(str(contact) if contact else "All contacts")
+        self.align_checkbox = QCheckBox("Align edges", self)
+        self.align_checkbox.setChecked(True)
+        self.count_label = QLabel("", self)
+
+        self.model = WaveformHistoryModel(self)
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        self.plot_widget = PlotWidget(self)
+        self.plot_widget.getPlotItem().getViewBox().setBackgroundColor(self.colors["background"])
+        self.plot_widget.setLabel("left", "Current", units="A")
+        self.plot_widget.setLabel("bottom", "Time", units="s")
+
+        filters = QtWidgets.QHBoxLayout()
+        for widget in (self.port_combobox, self.contact_combobox, self.align_checkbox, self.count_label):
+            filters.addWidget(widget)
+        filters.addStretch()
+        splitter = QtWidgets.QSplitter(Qt.Horizontal, self)
+        splitter.addWidget(self.table)
+        splitter.addWidget(self.plot_widget)
+        splitter.setSizes([350, 650])
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(filters)
+        layout.addWidget(splitter)
+        self.resize(1100, 500)
+
+        self.port_combobox.currentIndexChanged.connect(self.refresh)
+        self.contact_combobox.currentIndexChanged.connect(self.refresh)
+        self.align_checkbox.toggled.connect(self.update_overlay)
+        self.table.selectionModel().selectionChanged.connect(self.update_overlay)
+        self.refresh()
+
+    def refresh(self):
+        port = self.port_combobox.currentText()
+        contact = self.contact_combobox.currentText()
+        entries = self.waveform_index.entries(
+            port=None if port == "All ports" else port,
+            contact=None if contact == "All contacts" else int(contact),
+        )
+        self.model.set_entries(entries)
+        self.count_label.setText(f"{len(entries)} actuations")
+        if entries:
+            self.table.selectRow(0)
+        else:
+            self.update_overlay()
+
+    def selected_entries(self):
+        rows = sorted(index.row() for index in self.table.selectionModel().selectedRows())
+        return [self.model.entries[row] for row in rows[: self.MAX_OVERLAY]]
+
+    def update_overlay(self):
+        entries = self.selected_entries()
+        # drop the captures that are no longer shown, load the new ones
+        captures = {}
+        for entry in entries:
+            capture = self.captures.get(entry["path"])
+            if capture is None:
+                capture = self.waveform_index.load(entry)
+            if capture is not None:
+                captures[entry["path"]] = capture
+        self.captures = captures
+
+        self.plot_widget.clear()
+        if not entries:
+            return
+        times = [entry["time"] for entry in entries]
+        oldest, span = min(times), (max(times) - min(times)) or 1
+        # oldest first, so the newest traces are drawn on top
+        for entry in sorted(entries, key=lambda entry: entry["time"]):
+            capture = self.captures.get(entry["path"])
+            if capture is None:
+                continue
+            current_mA, sampling_freq = capture
+            samples = np.arange(len(current_mA))
+            if self.align_checkbox.isChecked() and (current_mA > 0).any():
+                samples = samples - np.argmax(current_mA > 0)
+            fraction = (entry["time"] - oldest) / span
+            color = [
+                old + (new - old) * fraction
+                for old, new in zip(self.colors["old"], self.colors["new"])
+            ]
+            self.plot_widget.plot(
+                *decimate_min_max(samples / sampling_freq, current_mA / 1000),
+                pen=pg.mkPen(color=color, width=1.5),
+            )
+
+
+class HardwareWorker(QtCore.QObject):
+    """Executes the hardware calls of the GUI on its own thread, in the order they were queued.
+
+    Clicks are queued as commands while previous ones are still running, so the window never waits for
+    the controller. Results come back to the GUI thread through signals. Telemetry reads have the lowest
+    priority, they only run when no switching command is waiting, and don't count in the progress.
+    """
+
+    PRIORITY_STOP = 0
+    PRIORITY_STARTUP = 1
+    PRIORITY_PULSE = 2
+    PRIORITY_TELEMETRY = 3
+
+    pulse_done = QtCore.pyqtSignal(str, object, float)  # measurement ID, current profile, current limit in mA
+    progress = QtCore.pyqtSignal(int, int)  # commands done, commands submitted since the queue was last empty
+    failed = QtCore.pyqtSignal(str)
+    telemetry = QtCore.pyqtSignal(float, object)  # timestamp, values keyed by TELEMETRY_CHANNELS
+
+    def __init__(self, cs):
+        super(HardwareWorker, self).__init__()
+        self.cs = cs
+        self.commands = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.done = 0
+        self._telemetry_pending = threading.Event()
+
+    def submit(self, priority, function, *args):
+        with self._lock:
+            self.submitted += 1
+            done, submitted = self.done, self.submitted
+        self.commands.put((priority, next(self._order), function, args, True))
+        self.progress.emit(done, submitted)
+
+    def request_telemetry(self):
+        # at most one read waiting, a slow controller doesn't pile them up
+        if not self._telemetry_pending.is_set():
+            self._telemetry_pending.set()
+            self.commands.put(
+                (self.PRIORITY_TELEMETRY, next(self._order), self.read_telemetry, (), False)
+            )
+
+    def submit_pulse(self, measurement_ID, port, contact, button, parameters):
+        self.submit(
+            self.PRIORITY_PULSE, self.pulse, measurement_ID, port, contact, button, parameters
+        )
+
+    def stop(self):
+        # skips the commands still queued
+        self.commands.put((self.PRIORITY_STOP, next(self._order), None, (), False))
+
+    def run(self):
+        while True:
+            _, _, function, args, counted = self.commands.get()
+            if function is None:
+                break
+            try:
+                function(*args)
+            except Exception as error:
+                self.failed.emit(f"{type(error).__name__}: {error}")
+            if not counted:
+                continue
+            with self._lock:
+                self.done += 1
+                done, submitted = self.done, self.submitted
+                if done >= submitted:
+                    self.done = self.submitted = 0
+            self.progress.emit(done, submitted)
+
+    def pulse(self, measurement_ID, port, contact, button, parameters):
+        self.apply_parameters(parameters)
+        if button == "conn":
+            current_profile = self.cs.connect(port=port, contact=contact)
+        else:
+            current_profile = self.cs.disconnect(port=port, contact=contact)
+        self.pulse_done.emit(
+            measurement_ID, current_profile, self.cs.internal_OCP_mA_tracked
+        )
+
+    def read_telemetry(self):
+        try:
+            if not self.cs.started:
+                return
+            values = {
+                "internal_temperature": self.cs.get_internal_temperature(),
+                "converter_voltage": self.cs.get_converter_voltage(),
+                "bias_voltage": self.cs.get_bias_voltage(),
+                "PWR_STATUS": self.cs.get_power_status(),
+                "OCP_status": self.cs.get_OCP_status(),
+            }
+        finally:
+            self._telemetry_pending.clear()
+        self.telemetry.emit(time.time(), values)
+
+    def apply_parameters(self, parameters):
+        if self.cs.converter_voltage != parameters["voltage_V"]:
+            self.cs.set_output_voltage(parameters["voltage_V"])
+        if self.cs.pulse_duration_ms != parameters["duration_ms"]:
+            self.cs.set_pulse_duration_ms(parameters["duration_ms"])
+        if self.cs.internal_OCP_mA_tracked != parameters["current_mA"]:
+            self.cs.set_OCP_mA(parameters["current_mA"])
+            self.cs.internal_OCP_mA_tracked = parameters["current_mA"]
+        if self.cs.internal_chopping_tracked != parameters["chopping_enabled"]:
+            if parameters["chopping_enabled"]:
+                self.cs.enable_chopping()
+            else:
+                self.cs.disable_chopping()
+            self.cs.internal_chopping_tracked = parameters["chopping_enabled"]
+
+
 class GridButton(QPushButton):
     def __init__(
         self,
@@ -201,6 +581,7 @@ class GridButton(QPushButton):
         self.customContextMenuRequested.connect(self.right_click)
         self.clicked.connect(self.left_click)
         self.cs = functionality_IDs["CS"]
+        self.worker = functionality_IDs["worker"]
         self.measurement_ID = f"{self.functionality_IDs['port']}/{self.functionality_IDs['contact']}/{self.functionality_IDs['button']}"
 
     def left_click(self):
@@ -216,61 +597,24 @@ class GridButton(QPushButton):
             for btn in self.buttonallies:
                 btn.left_click()
         else:
-            self.update_parameters()
-
-            if self.functionality_IDs["button"] == "conn":
-                self.cs.internal_measured_A[self.measurement_ID] = (
-                    self.cs.connect(
-                        port=self.functionality_IDs["port"],
-                        contact=self.functionality_IDs["contact"],
-                    )
-                    / 1000
-                )  # turn into smart connect and then also change button logic? - no, but see if it was disconnected before
-            elif self.functionality_IDs["button"] == "disc":
-                self.cs.internal_measured_A[self.measurement_ID] = (
-                    self.cs.disconnect(
-                        port=self.functionality_IDs["port"],
-                        contact=self.functionality_IDs["contact"],
-                    )
-                    / 1000
-                )
-            self.cs.internal_inferred_t[self.measurement_ID] = python_arange(
-                0,
-                0
-                + (
-                    len(self.cs.internal_measured_A[self.measurement_ID])
-                    * 1
-                    / self.cs.sampling_freq
-                ),
-                1 / self.cs.sampling_freq,
-            )
-            self.cs.internal_limit_of_mA[self.measurement_ID] = (
-                python_ones(len(self.cs.internal_measured_A[self.measurement_ID]))
-                * self.cs.internal_OCP_mA_tracked
-                / 1000
-            )
-            self.right_click()
-
-    def update_parameters(self):
+            # the pulse is queued with the parameters shown at the time of the click, the result
+            # comes back through HardwareWorker.pulse_done
+            self.worker.submit_pulse(
+                self.measurement_ID,
+                self.functionality_IDs["port"],
+                self.functionality_IDs["contact"],
+                self.functionality_IDs["button"],
+                self.read_parameters(),
+            )  # turn into smart connect and then also change button logic? - no, but see if it was disconnected before
+
+    def read_parameters(self):
         self.data_validation()
-        voltage_V = float(self.functionality_IDs["voltage"].text().replace(",", "."))
-        duration_ms = float(self.functionality_IDs["duration"].text().replace(",", "."))
-        current_mA = float(self.functionality_IDs["OCP"].text().replace(",", "."))
-        chopping_enabled = self.functionality_IDs["chopping"].isChecked()
-
-        if self.cs.converter_voltage != voltage_V:
-            self.cs.set_output_voltage(voltage_V)
-        if self.cs.pulse_duration_ms != duration_ms:
-            self.cs.set_pulse_duration_ms(duration_ms)
-        if self.cs.internal_OCP_mA_tracked != current_mA:
-            self.cs.set_OCP_mA(current_mA)
-            self.cs.internal_OCP_mA_tracked = current_mA
-        if self.cs.internal_chopping_tracked != chopping_enabled:
-            if chopping_enabled:
-                self.cs.enable_chopping()
-            else:
-                self.cs.disable_chopping()
-            self.cs.internal_chopping_tracked = chopping_enabled
+        return {
+            "voltage_V": float(self.functionality_IDs["voltage"].text().replace(",", ".")),
+            "duration_ms": float(self.functionality_IDs["duration"].text().replace(",", ".")),
+            "current_mA": float(self.functionality_IDs["OCP"].text().replace(",", ".")),
+            "chopping_enabled": self.functionality_IDs["chopping"].isChecked(),
+        }
 
     def data_validation(self):
         self.limit_checker("voltage", 5, 30)
@@ -312,10 +656,15 @@ class GridButton(QPushButton):
             )
             __main__.__dict__["last_meas_ID"] = self.measurement_ID
             self.right_click_helper()
+        else:
+            self.history_helper(self.functionality_IDs["port"])
 
     def right_click_helper(self):
         pass
 
+    def history_helper(self, port):
+        pass
+
 
 class CSCApp(QWidget):
     def __init__(self):
@@ -353,19 +702,58 @@ class CSCApp(QWidget):
         self.plot_font_size = 18
 
         # Inits
+        self.buttons = {}
+        self.worker = HardwareWorker(self.cs)
         self.initUI()
         self.initHW()
 
     def initHW(self):
-        self.cs.start()
         self.cs.plot = False
-        self.cs.log_wav = False
+        self.cs.log_wav = settings["log_waveforms"]
+        if self.cs.log_wav:
+            self.cs.log_wav_init()
+        # the history is read from the waveform log, there is none to browse without it
+        self.history_button.setEnabled(self.cs.waveform_index is not None)
         self.cs.plot_polarization = False
         self.cs.internal_OCP_mA_tracked = None
         self.cs.internal_chopping_tracked = None
-        self.cs.internal_measured_A = {}
-        self.cs.internal_inferred_t = {}
-        self.cs.internal_limit_of_mA = {}
+        self.waveforms = WaveformCache(settings["plot_cache_size"])
+        self.telemetry = TelemetryBuffer(settings["telemetry_history"])
+
+        self.worker.pulse_done.connect(self.store_pulse)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.failed.connect(self.show_error)
+        self.worker.telemetry.connect(self.store_telemetry)
+        self.hw_thread = QtCore.QThread(self)
+        self.worker.moveToThread(self.hw_thread)
+        self.hw_thread.started.connect(self.worker.run)
+        QApplication.instance().aboutToQuit.connect(self.stop_worker)
+        self.hw_thread.start()
+        self.worker.submit(HardwareWorker.PRIORITY_STARTUP, self.cs.start)
+
+        # polling and redrawing are independent, the panel redraws at a fixed rate whatever the poll interval
+        self.telemetry_poll_timer = QtCore.QTimer(self)
+        self.telemetry_poll_timer.timeout.connect(self.worker.request_telemetry)
+        self.telemetry_redraw_timer = QtCore.QTimer(self)
+        self.telemetry_redraw_timer.timeout.connect(self.update_telemetry_plot)
+        self.telemetry_redraw_timer.start(int(1000 / TELEMETRY_FRAME_RATE_HZ))
+        self.toggle_telemetry(self.telemetry_checkbox.isChecked())
+
+    def toggle_telemetry(self, enabled):
+        if enabled:
+            self.telemetry_poll_timer.start(int(1000 * settings["telemetry_interval_s"]))
+        else:
+            self.telemetry_poll_timer.stop()
+
+    def stop_worker(self):
+        self.telemetry_poll_timer.stop()
+        self.worker.stop()
+        self.hw_thread.quit()
+        self.hw_thread.wait()
+
+    def closeEvent(self, event):
+        self.stop_worker()
+        super().closeEvent(event)
 
     def initUI(self):
         self.shortcut1 = QShortcut(QKeySequence("Ctrl+Q"), self)
@@ -491,6 +879,7 @@ class CSCApp(QWidget):
                             # 0 is cs, 1 is V QE, 2 is ms QE, 3 is mA QE, 4 is port, 5 is contact, 6 is conn disc, 7 is chopping chb, 8 is plot label
                             functionality_IDs={
                                 "CS": self.cs,
+                                "worker": self.worker,
                                 "voltage": voltage_lineedit,
                                 "duration": duration_lineedit,
                                 "OCP": OCP_lineedit,
@@ -527,6 +916,7 @@ class CSCApp(QWidget):
                                 f"{labphoxch_startsfrom1}/ALL/{buttonfn}"
                             ].append(button)
                             button.right_click_helper = self.update_plot_data
+                            self.buttons[button.measurement_ID] = button
                             grid.addWidget(button, i, j)
 
                         else:
@@ -534,7 +924,7 @@ class CSCApp(QWidget):
                                 buttonfriends[
                                     f"{labphoxch_startsfrom1}/{k}/{buttonfn_opposite}"
                                 ].append(button)
-
+                            button.history_helper = self.show_history
                             grid.addWidget(button, i, j, 1, 2)
 
                         buttonfriends[
@@ -581,37 +971,169 @@ class CSCApp(QWidget):
         grid.addWidget(plot_label, 0, 8, 1, 1)
 
         help_info_label = QLabel(
-            f"Leftclick: Actuate switch // Rightclick: Show last measured current.\nOptionally, change labels and default settings in {_config_path}/cryoswitch_settings_{generate_checksum(script_filename)}.json",
+            f"Leftclick: Actuate switch // Rightclick: Show last measured current, or the history of the port for ALL.\nOptionally, change labels and default settings in {_config_path}/cryoswitch_settings_{generate_checksum(script_filename)}.json",
             self,
         )
         help_info_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
         # help_info_label.setAlignment(Qt.AlignCenter)
         help_info_label.setStyleSheet("color: gray;")
-        grid.addWidget(help_info_label, 10, 0, 1, 7)
+        grid.addWidget(help_info_label, 10, 0, 1, 6)
+        self.history_button = QPushButton("History")
+        self.history_button.setToolTip("Past actuations from the waveform log, rightclick an ALL button for one port")
+        self.history_button.clicked.connect(lambda: self.show_history())
+        grid.addWidget(self.history_button, 10, 6, 1, 1)
         about_button = QPushButton("About")
         about_button.clicked.connect(self.show_about_dialog)
         grid.addWidget(about_button, 10, 7, 1, 1)
+
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(1)
+        self.progress_bar.setFormat("Idle")
+        self.progress_bar.setToolTip("Queued hardware commands")
+        grid.addWidget(self.progress_bar, 11, 0, 1, 8)
+        self.error_label = QLabel("", self)
+        self.error_label.setStyleSheet("color: firebrick;")
+        grid.addWidget(self.error_label, 11, 8, 1, 1)
+
+        self.initTelemetryUI(grid)
         # self.setGeometry(300, 300, 800, 600)
         self.setWindowTitle(f"CryoSwitch Control Panel {_VERSION}")
         self.show()
 
+    def initTelemetryUI(self, grid):
+        telemetry_widget = pg.GraphicsLayoutWidget(self)
+        telemetry_widget.setBackground(self.background_color)
+        telemetry_widget.setFixedHeight(220)
+        plots = {}
+        for column, (name, label, units) in enumerate(
+            [
+                ("temperature", "Temperature", "°C"),
+                ("voltage", "Voltage", "V"),
+                ("status", "Status", ""),
+            ]
+        ):
+            plot = telemetry_widget.addPlot(row=0, col=column, axisItems={"bottom": pg.DateAxisItem()})
+            plot.getViewBox().setBackgroundColor(self.plot_background_color)
+            plot.setLabel("left", label, units=units)
+            plot.addLegend(offset=(10, 5))
+            plots[name] = plot
+        plots["voltage"].setXLink(plots["temperature"])
+        plots["status"].setXLink(plots["temperature"])
+        plots["status"].setYRange(-0.1, 1.1)
+
+        # curves are created once, redraws only replace their data
+        self.telemetry_curves = {
+            "internal_temperature": plots["temperature"].plot(
+                pen=pg.mkPen(color=self.current_line_color, width=self.line_widths), name="Internal"
+            ),
+            "converter_voltage": plots["voltage"].plot(
+                pen=pg.mkPen(color=self.current_line_color, width=self.line_widths), name="Converter"
+            ),
+            "bias_voltage": plots["voltage"].plot(
+                pen=pg.mkPen(color=self.OCP_line_color, width=self.line_widths), name="Bias"
+            ),
+            "PWR_STATUS": plots["status"].plot(
+                pen=pg.mkPen(color=self.current_line_color, width=self.line_widths),
+                stepMode="left",
+                name="PWR_STATUS",
+            ),
+            "OCP_status": plots["status"].plot(
+                pen=pg.mkPen(color=self.OCP_line_color, width=self.line_widths),
+                stepMode="left",
+                name="OCP",
+            ),
+        }
+
+        self.telemetry_checkbox = QCheckBox("Live telemetry", self)
+        self.telemetry_checkbox.setChecked(True)
+        self.telemetry_checkbox.toggled.connect(self.toggle_telemetry)
+        self.telemetry_label = QLabel("", self)
+        self.telemetry_label.setStyleSheet("color: gray;")
+        grid.addWidget(self.telemetry_checkbox, 12, 0, 1, 2)
+        grid.addWidget(self.telemetry_label, 12, 2, 1, 7)
+        grid.addWidget(telemetry_widget, 13, 0, 1, 9)
+
+    def store_telemetry(self, timestamp, values):
+        self.telemetry.append(timestamp, values)
+
+    def update_telemetry_plot(self):
+        if not self.telemetry.updated:
+            return
+        self.telemetry.updated = False
+        time_axis = self.telemetry.time()
+        for channel, curve in self.telemetry_curves.items():
+            values = self.telemetry.values(channel)
+            if curve.opts["stepMode"]:
+                # step curves take one more x value than y values
+                curve.setData(np.append(time_axis, time_axis[-1]), values)
+            else:
+                curve.setData(time_axis, values)
+        latest = self.telemetry.latest()
+        self.telemetry_label.setText(
+            f"T={latest['internal_temperature']:.1f}°C  "
+            f"Converter={latest['converter_voltage']:.2f}V  "
+            f"Bias={latest['bias_voltage']:.2f}V  "
+            f"PWR_STATUS={latest['PWR_STATUS']:.0f}  "
+            f"OCP={latest['OCP_status']:.0f}"
+        )
+
+    def show_history(self, port=None):
+        if self.cs.waveform_index is None:
+            return
+        browser = HistoryBrowser(
+            self.cs.waveform_index,
+            port=port,
+            colors={
+                "old": (190, 190, 190),
+                "new": self.current_line_color,
+                "background": self.plot_background_color,
+            },
+            parent=self,
+        )
+        browser.setAttribute(Qt.WA_DeleteOnClose)
+        browser.show()
+
     def show_about_dialog(self):
         dialog = AboutDialog()
         dialog.exec_()
 
+    def store_pulse(self, measurement_ID, current_profile, OCP_mA):
+        if not current_profile:
+            self.show_error(f"No current profile for {measurement_ID}")
+            return
+        # raw PulseCapture, scaled to A only when plotted
+        self.waveforms.put(measurement_ID, current_profile, OCP_mA)
+        self.buttons[measurement_ID].right_click()
+
+    def update_progress(self, done, submitted):
+        if submitted:
+            self.progress_bar.setRange(0, submitted)
+            self.progress_bar.setValue(done)
+            self.progress_bar.setFormat(f"%v/%m commands ({submitted - done} queued)")
+        else:
+            self.progress_bar.setRange(0, 1)
+            self.progress_bar.setValue(1)
+            self.progress_bar.setFormat("Idle")
+
+    def show_error(self, message):
+        print(message)
+        self.error_label.setText(message)
+
     def update_plot_data(self):
         try:
-            self.measured_line.setData(
-                self.cs.internal_inferred_t[__main__.__dict__["last_meas_ID"]],
-                self.cs.internal_measured_A[__main__.__dict__["last_meas_ID"]],
-            )
-            self.OCP_line.setData(
-                self.cs.internal_inferred_t[__main__.__dict__["last_meas_ID"]],
-                self.cs.internal_limit_of_mA[__main__.__dict__["last_meas_ID"]],
-            )
-            # self.data_line3.setData(self.x, self.y3)
+            current_profile, OCP_mA = self.waveforms.get(__main__.__dict__["last_meas_ID"])
         except KeyError:
             print("No saved data in this slot.")
+            return
+        sampling_freq = getattr(current_profile, "sampling_freq", self.cs.sampling_freq)
+        time_axis = self.waveforms.time_axis(len(current_profile), sampling_freq)
+        self.measured_line.setData(*decimate_min_max(time_axis, current_profile.A))
+        # the limit is constant, its two ends are enough
+        self.OCP_line.setData(
+            [time_axis[0], time_axis[-1]], [OCP_mA / 1000, OCP_mA / 1000]
+        )
+        # self.data_line3.setData(self.x, self.y3)
 
 
 if __name__ == "__main__":
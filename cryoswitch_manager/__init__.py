@@ -1,12 +1,44 @@
 from .CryoSwitchController import Cryoswitch
+from .guard_time import GuardTimePolicy, DEFAULT_GUARD_TIME_POLICY
+from .planner import PulseStep, PulsePlan, merge_reports
+from .heat_budget import HeatBudgetScheduler
+from .presets import RoutingPreset
+from .worker import ControllerWorker, gather_futures
+from .routing import RoutingGraph
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+import re
+import threading
 import time
 
-class CryoSwitchConfig:
+# served by the daemon module, imported on first use like the other optional parts of the package
+_DAEMON_NAMES = ('ControllerDaemon', 'CryoswitchClient', 'CryoSwitchManagerClient')
+
+
+def __getattr__(name):
+    if name in _DAEMON_NAMES:
+        from . import daemon
+        return getattr(daemon, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# switch model of a configuration -> model name the controller selects its drive type with. The 2x2
+# switches have always been driven with the drive type selected by `Cryoswitch.start()`.
+CONTROLLER_SWITCH_MODELS = {
+    'R583423141': 'R583423141',
+    'R577433007': 'R583423141',
+}
+
+class CryoSwitchConfig(ABC):
+    positions = ()
+    terminals = ()
+
     def __init__(
         self, name: str, switch_model: str, controller: Cryoswitch,
         controller_port: str, position: int=None
     ):
         self._name = name           # name of the switch. e.g., switch_a_6x1, input_switch_a_2x2
+        self.position_listeners = []  # called with the switch whenever its known position changes
 
         if switch_model in ['R583423141', 'R577433007']:
             self._switch_model = switch_model
@@ -16,6 +48,20 @@ class CryoSwitchConfig:
         self._position = position
         self.controller = controller
         self.controller_port = controller_port
+        self.guard_time_policy = DEFAULT_GUARD_TIME_POLICY
+        self.before_actuation = None  # called with the controller before pulsing, e.g. to bring it up lazily
+
+    @property
+    def _position(self) -> int:
+        return self._known_position
+
+    @_position.setter
+    def _position(self, value: int):
+        changed = value != getattr(self, '_known_position', None)
+        self._known_position = value
+        if changed:
+            for listener in self.position_listeners:
+                listener(self)
 
     @property
     def name(self) -> str:
@@ -35,21 +81,95 @@ class CryoSwitchConfig:
         """
         return self._switch_model
 
+    def select_controller_model(self) -> bool:
+        """Select the switch model on the controller, if it isn't selected already.
+
+        Returns:
+            bool: whether the controller's switch model changed.
+
+        Raises:
+            ValueError: Error is raised when the controller rejects the switch model.
+        """
+        model = CONTROLLER_SWITCH_MODELS.get(self.switch_model, self.switch_model)
+        if self.controller.current_switch_model == model:
+            return False
+        if not self.controller.select_switch_model(model):
+            raise ValueError(f"Switch {self.name}: the controller rejected the switch model {model}.")
+        return True
+
     def connect(self, value: int):
         """Connect the switch to position specified by the `value`.
 
         Args:
             value (int): an integer indicating the position to connect to.
+
+        Returns:
+            PulseCapture: the captured current profile.
         """
-        self.controller.connect(self.controller_port[0], value)
+        return self.pulse(value, 1)
 
     def disconnect(self, value: int):
         """Disconnect the switch from the position specified by the `value`.
 
         Args:
             value (int): an integer indicating the position to disconnect from.
+
+        Returns:
+            PulseCapture: the captured current profile.
+        """
+        return self.pulse(value, 0)
+
+    def pulse(self, contact: int, polarity: int):
+        """Send a single pulse on a contact of the switch's controller port, paced by the controller's heat budget if any.
+
+        Args:
+            contact (int): contact of the controller port.
+            polarity (int): 1 to connect, 0 to disconnect.
+
+        Returns:
+            PulseCapture: the captured current profile.
+        """
+        self.prepare_controller()
+        self.select_controller_model()
+        if polarity:
+            return self.controller.connect(self.controller_port[0], contact)
+        return self.controller.disconnect(self.controller_port[0], contact)
+
+    @staticmethod
+    def actuated(current_profile) -> bool:
+        """Whether a pulse was sent and, when the controller verifies actuations, passed the verification."""
+        if current_profile is None or not len(current_profile):
+            return False
+        return current_profile.metadata.get('verified', True)
+
+    def prepare_controller(self):
+        """Make sure the controller is ready to pulse, see `CryoSwitchManager.bring_up`."""
+        if self.before_actuation:
+            self.before_actuation(self.controller)
+
+    def guard_time_s(self, current_profile=None) -> float:
+        """Guard time to respect between a disconnect pulse and the next connect pulse.
+
+        Args:
+            current_profile (PulseCapture, optional): the captured disconnect pulse. Defaults to None.
+
+        Returns:
+            float: guard time in seconds, see `GuardTimePolicy`.
         """
-        self.controller.disconnect(self.controller_port[0], value)
+        return self.guard_time_policy.guard_time_s(
+            self.switch_model, self.controller.pulse_duration_ms, current_profile, self.controller.sampling_freq
+        )
+
+    def wait_guard_time(self, current_profile, disconnected_at: float):
+        """Sleep for what remains of the guard time after a disconnect pulse.
+
+        Args:
+            current_profile (PulseCapture): the captured disconnect pulse.
+            disconnected_at (float): `time.monotonic()` when the disconnect pulse returned.
+        """
+        remaining = self.guard_time_s(current_profile) - (time.monotonic() - disconnected_at)
+        if remaining > 0:
+            time.sleep(remaining)
 
     def initialize(self):
         """Initialize the switch to position 1.
@@ -60,10 +180,88 @@ class CryoSwitchConfig:
     def set_position(self, value: int):
         self.position = value
 
+    @abstractmethod
+    def internal_links(self, position: int) -> list[tuple[str, str]]:
+        """Pairs of terminals connected by the switch in `position`."""
+
+    def validate_position(self, value: int):
+        """Raise a ValueError if `value` is not a position of the switch."""
+        if value not in self.positions:
+            raise ValueError(f"The specified position {value} is unsettable for switch {self.name}. Valid positions: {self.positions}.")
+
+    @abstractmethod
+    def plan_steps(self, start: int, value: int) -> list[PulseStep]:
+        """Minimal pulses bringing the switch from position `start` to position `value`.
+
+        Args:
+            start (int): initial position, None if unknown.
+            value (int): target position.
+
+        Returns:
+            list[PulseStep]: pulses to send, empty if the switch is already in position.
+        """
+
+    def actuation_steps(self, value: int) -> list[PulseStep]:
+        """Minimal pulses bringing the switch from its current position to position `value`."""
+        self.validate_position(value)
+        return self.plan_steps(self._position, value)
+
+    @abstractmethod
+    def position_from_states(self, port_states: dict) -> int:
+        """Position of the switch implied by the tracked contact states of its controller port.
+
+        Args:
+            port_states (dict): tracked states of the controller port, {'contact_1': 0, ...}. A contact that was
+                never actuated is `None`.
+
+        Returns:
+            int: the position, or None if the tracked states don't determine it.
+        """
+
+    def restore_position(self) -> int:
+        """Restore the switch position from the state persisted by the controller, without pulsing.
+
+        The position is restored only if the tracked contact states are consistent and no interrupted
+        actuation of the port is waiting in the controller's state journal.
+
+        Returns:
+            int: the restored position, or None if it is unknown.
+        """
+        port = self.controller_port[0]
+        port_states = self.controller.get_port_states(port)
+        if port_states is None or self.controller.has_pending_actuation(port):
+            return None
+        position = self.position_from_states(port_states)
+        if position is not None:
+            self._position = position
+        return position
+
 class Cryo6x1SwitchConfig(CryoSwitchConfig):
+    positions = (1, 2, 3, 4, 5, 6)
+    terminals = ('1', '2', '3', '4', '5', '6', 'C')
+
+    def internal_links(self, position: int) -> list[tuple[str, str]]:
+        return [(str(position), 'C')]
 
     def disconnect_all(self):
-        self.controller.disconnect_all(self.controller_port)
+        return [self.disconnect(contact) for contact in self.positions]
+
+    def plan_steps(self, start: int, value: int) -> list[PulseStep]:
+        if start == value:
+            return []
+        if start is None:
+            steps = [PulseStep(self, contact, 0) for contact in self.positions]
+        else:
+            steps = [PulseStep(self, start, 0)]
+        steps.append(PulseStep(self, value, 1, after_guard=True, last=True))
+        return steps
+
+    def position_from_states(self, port_states: dict) -> int:
+        connected = [contact for contact in range(1, 7) if port_states.get(f'contact_{contact}') == 1]
+        disconnected = [contact for contact in range(1, 7) if port_states.get(f'contact_{contact}') == 0]
+        if len(connected) == 1 and len(disconnected) == 5:
+            return connected[0]
+        return None
 
     @property
     def position(self) -> int:
@@ -74,19 +272,33 @@ class Cryo6x1SwitchConfig(CryoSwitchConfig):
 
     @position.setter
     def position(self, value: int):
+        with self.controller.lock:
+            self._set_position(value)
+
+    def _set_position(self, value: int):
         if value in [1, 2, 3, 4, 5, 6]:
             init_pos = self.position
             if init_pos == None:
                 # initial position unknown. Perform global reset
-                self.disconnect_all()
+                current_profiles = self.disconnect_all()
             else:
                 # if initial position is known, disconnect that position
-                self.disconnect(init_pos)
-            time.sleep(1)   # delay between disconnect operation and connect operation
+                current_profiles = [self.disconnect(init_pos)]
+            # the guard time runs from the return of the last disconnect pulse
+            disconnected_at = time.monotonic()
+            if not all(self.actuated(current_profile) for current_profile in current_profiles):
+                self._position = None
+                print(f"WARNING: Switch {self.name}: disconnect failed, position unknown")
+                return
+            # delay between disconnect operation and connect operation
+            self.wait_guard_time(current_profiles[-1], disconnected_at)
 
             # connect to the specified position
-            self.connect(value)
-            self._position = value
+            if self.actuated(self.connect(value)):
+                self._position = value
+            else:
+                self._position = None
+                print(f"WARNING: Switch {self.name}: connect to {value} failed, position unknown")
         else:
             raise ValueError(f"The specified position {value} is unsettable. You need to specify an integer between 1 and 6.")
 
@@ -98,6 +310,21 @@ class Cryo6x1SwitchConfig(CryoSwitchConfig):
             return ("Unknown", )
 
 class Cryo2x2SwitchConfig(CryoSwitchConfig):
+    positions = (1, 2)
+    terminals = ('1', '2', '3', '4')
+    position_links = {
+        1: [('1', '3'), ('2', '4')],
+        2: [('1', '2'), ('3', '4')],
+    }
+
+    def internal_links(self, position: int) -> list[tuple[str, str]]:
+        return self.position_links[position]
+
+    def plan_steps(self, start: int, value: int) -> list[PulseStep]:
+        if start == value:
+            return []
+        return [PulseStep(self, int(self.controller_port[1]), 1 if value == 1 else 0, last=True)]
+
     @property
     def position(self) -> int:
         if self._position is not None:
@@ -107,57 +334,210 @@ class Cryo2x2SwitchConfig(CryoSwitchConfig):
 
     @position.setter
     def position(self, value: int):
+        with self.controller.lock:
+            self._set_position(value)
+
+    def _set_position(self, value: int):
         if value == 1:
-            self.connect(int(self.controller_port[1]))
-            self._position = value
+            current_profile = self.connect(int(self.controller_port[1]))
         elif value == 2:
-            self.disconnect(int(self.controller_port[1]))
-            self._position = value
+            current_profile = self.disconnect(int(self.controller_port[1]))
         else:
             raise ValueError(f"The specified position {value} is unsettable. You need to specify an integer 1 or 2.")
+        if self.actuated(current_profile):
+            self._position = value
+        else:
+            self._position = None
+            print(f"WARNING: Switch {self.name}: switching to {value} failed, position unknown")
+
+    def position_from_states(self, port_states: dict) -> int:
+        state = port_states.get(f'contact_{int(self.controller_port[1])}')
+        if state == 1:
+            return 1
+        elif state == 0:
+            return 2
+        return None
 
     @property
     def connectivity(self) -> list[tuple[str, str]]:
         if self.position is not None:
-            if self.position == 1:
-                return [('1', '3'), ('2', '4')]
-            elif self.position == 2:
-                return [('1', '2'), ('3', '4')]
+            return self.internal_links(self.position)
         else:
             return ("Unknown", )
 
 class CryoSwitchManager:
+    # controllers identified by serial number are looked up by probing every serial port, one lookup at a time
+    _discovery_lock = threading.Lock()
+
+    # manager settings and the `Cryoswitch` methods writing them
+    SETTINGS = {
+        'output_voltage': 'set_output_voltage',
+        'ocp_mA': 'set_OCP_mA',
+        'pulse_duration_ms': 'set_pulse_duration_ms',
+    }
+
     def __init__(
         self, switch_config_list: list[dict], COM_port: str = "COM5",
-        initialize_all: bool = True, control_mode: str = "cryo",
+        initialize_all: bool = True, restore_positions: bool = True, control_mode: str = "cryo",
         cryo_output_voltage: float = 10.0, room_temp_output_voltage = 28.0,
         ocp_mA: float = 130.0, pulse_duration_ms: int = 100,
+        heat_budget_mJ: float = None, cooling_rate_mW: float = None,
+        presets: dict = None, links: list = None, endpoints: dict = None, lazy: bool = False,
     ):
         # set parameters
         self._cryo_output_voltage = cryo_output_voltage
         self._room_temp_output_voltage = room_temp_output_voltage
-
-        # establish connection to the QPhoX CryoSwitch Controller
-        self.controller = Cryoswitch(COM_port = COM_port)
-        self.controller.start()
+        # in lazy mode the controllers are started, and the settings written, only before the first actuation
+        self.lazy = lazy
+        self._applied_settings = {}
+        self._output_voltage = self._control_mode_voltage(control_mode)
+        self.scheduler = None
+        if heat_budget_mJ is not None:
+            self.scheduler = HeatBudgetScheduler(heat_budget_mJ, cooling_rate_mW)
+
+        # establish connection to the QPhoX CryoSwitch Controllers, concurrently when there are several.
+        # switches without a "controller" entry use the controller on `COM_port`
+        specs = []
+        for switch_config in switch_config_list:
+            spec = switch_config.get("controller", COM_port)
+            if spec not in specs:
+                specs.append(spec)
+        if not specs:
+            specs.append(COM_port)
+        self.controllers = dict(zip(specs, self._map_parallel(self._connect_controller, specs)))
+        self.controller = self.controllers[specs[0]]
 
         self.control_mode = control_mode
         self.ocp_mA = ocp_mA
         self.pulse_duration_ms = pulse_duration_ms
 
         self._switch_list = []
+        self._switch_list_version = 0
+        self._presets = {}
+        self._preset_targets = {}
+        self._workers = {}
+        self._links = list(links or [])
+        self._endpoints = dict(endpoints or {})
+        self._routing = None
 
         for switch_config in switch_config_list:
             name = switch_config["name"]
-            switch_model = switch_config["name"]
+            switch_model = switch_config["switch_model"]
             controller_port = switch_config["controller_port"]
-            position = switch_config["controller_port"] if "controller_port" in switch_config.keys() else None
-            self.add_switch(name, switch_model, controller_port, position=position)
+            position = switch_config["position"] if "position" in switch_config.keys() else None
+            controller = switch_config.get("controller", COM_port)
+            self.add_switch(name, switch_model, controller_port, position=position, controller=controller)
+
+        if restore_positions:
+            self.restore_positions()
+
+        if initialize_all and not lazy:
+            # with restored positions, only the switches left in an unknown position need pulsing
+            self.initialize_all(only_unknown=restore_positions)
+
+        for name, target in (presets or {}).items():
+            self.add_preset(name, target)
+
+    @staticmethod
+    def _map_parallel(function, items) -> list:
+        """`[function(item) for item in items]`, with one thread per item when there are several."""
+        items = list(items)
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=len(items)) as executor:
+            return list(executor.map(function, items))
+
+    @staticmethod
+    def controller_kwargs(spec: str) -> dict:
+        """`Cryoswitch` arguments of a controller named by IP address ('tcp://<IP>' for the TCP transport),
+        COM port (or 'sim://' URL) or serial number."""
+        if spec.startswith('tcp://'):
+            return {'IP': spec[len('tcp://'):], 'TCP': True}
+        if re.fullmatch(r'\d{1,3}(\.\d{1,3}){3}(:\d+)?', spec):
+            return {'IP': spec}
+        if spec.upper().startswith('COM') or spec.startswith('/dev/') or '://' in spec:
+            return {'COM_port': spec}
+        return {'SN': spec}
+
+    def _connect_controller(self, spec: str) -> Cryoswitch:
+        kwargs = self.controller_kwargs(spec)
+        if 'SN' in kwargs:
+            with self._discovery_lock:
+                controller = Cryoswitch(**kwargs)
+        else:
+            controller = Cryoswitch(**kwargs)
+        # before start(), which replays the interrupted actuations
+        controller.heat_scheduler = self.scheduler
+        if not self.lazy:
+            self.bring_up(controller)
+        return controller
+
+    def bring_up(self, controller: Cryoswitch = None):
+        """Start a controller if needed and write the settings that changed since they were last written.
+
+        The output voltage is set before `Cryoswitch.start`, so that the converter settles directly at the
+        target voltage. In lazy mode this is called before every actuation.
+
+        Args:
+            controller (Cryoswitch, optional): controller to bring up. Defaults to None, all the controllers.
+        """
+        if controller is None:
+            self._map_parallel(self.bring_up, self.controllers.values())
+            return
+        with controller.lock:
+            applied = self._applied_settings.setdefault(controller, {})
+            if not controller.started:
+                controller.converter_voltage = self._output_voltage
+                controller.start()
+                applied['output_voltage'] = self._output_voltage
+            for name, method in self.SETTINGS.items():
+                value = getattr(self, '_' + name, None)
+                if value is not None and applied.get(name) != value:
+                    getattr(controller, method)(value)
+                    applied[name] = value
+
+    def _set_setting(self, name: str, value):
+        setattr(self, '_' + name, value)
+        if not self.lazy:
+            self._map_parallel(self.bring_up, self.controllers.values())
+
+    def add_controller(self, spec: str) -> Cryoswitch:
+        """Connect, start and configure an additional controller with the manager's settings (on first use in lazy mode).
+
+        Args:
+            spec (str): serial number, COM port or IP address of the controller.
 
-        if initialize_all:
-            self.initialize_all()
+        Returns:
+            Cryoswitch: the controller.
+        """
+        if spec in self.controllers:
+            return self.controllers[spec]
+        controller = self._connect_controller(spec)
+        self.controllers[spec] = controller
+        return controller
 
-    def add_switch(self, name: str, switch_model: str, controller_port: str, position: int = None):
+    def get_controller(self, controller=None) -> Cryoswitch:
+        """Controller managed by this manager.
+
+        Args:
+            controller (str | Cryoswitch, optional): serial number, COM port or IP address the controller was
+                declared with, its serial number, or the controller itself. Defaults to None, the first controller.
+
+        Raises:
+            ValueError: Error is raised when the controller is not managed by this manager.
+        """
+        if controller is None:
+            return self.controller
+        if controller in self.controllers:
+            return self.controllers[controller]
+        for managed_controller in self.controllers.values():
+            if managed_controller is controller or managed_controller.SN == controller:
+                return managed_controller
+        raise ValueError(f"Unknown controller {controller}. Available controllers: {list(self.controllers)}.")
+
+    def add_switch(
+        self, name: str, switch_model: str, controller_port: str, position: int = None, controller=None
+    ):
         """Add a switch to the manager.
 
         Args:
@@ -165,23 +545,246 @@ class CryoSwitchManager:
             switch_model (str): Model of the switch.
             controller_port (str): Port of the controller connected to the switch.
             position (int, optional): Initial known position of the switch. Defaults to None.
+            controller (str | Cryoswitch, optional): controller of the switch, see `get_controller`. A controller
+                not managed yet is added with `add_controller`. Defaults to None, the first controller.
 
         Raises:
             ValueError: Error is raised when switch models are not 'R583423141' or 'R577433007'.
         """
+        if isinstance(controller, str) and controller not in self.controllers:
+            try:
+                controller = self.get_controller(controller)
+            except ValueError:
+                controller = self.add_controller(controller)
+        else:
+            controller = self.get_controller(controller)
         if switch_model in ['R583423141']:
             switch = Cryo6x1SwitchConfig(
-                name, switch_model, self.controller, controller_port, position=position
+                name, switch_model, controller, controller_port, position=position
             )
         elif switch_model in ['R577433007']:
             switch = Cryo2x2SwitchConfig(
-                name, switch_model, self.controller, controller_port, position=position
+                name, switch_model, controller, controller_port, position=position
             )
         else:
             raise ValueError(f"The switch model {switch_model} is currently unsupported.")
+        switch.before_actuation = self.bring_up
+        switch.position_listeners.append(self._position_changed)
         self._switch_list.append(switch)
+        self._switch_list_version += 1
+        self._routing = None
         setattr(self, name, switch)
 
+    def set_heat_budget(self, heat_budget_mJ: float, cooling_rate_mW: float):
+        """Pace all pulses to keep the heat load within a budget.
+
+        The budget holds up to `heat_budget_mJ` of energy that pulses can dissipate in a burst, and refills
+        at `cooling_rate_mW`. Each pulse of the controllers waits until the budget holds its estimated energy,
+        including the retries of verified actuations and the replayed interrupted actuations.
+
+        Args:
+            heat_budget_mJ (float): energy that can be dissipated in a burst, None to disable the pacing.
+            cooling_rate_mW (float): sustained heat load the fridge can absorb, required and positive with a budget.
+
+        Raises:
+            ValueError: if a budget is given without a positive cooling rate.
+        """
+        if heat_budget_mJ is None:
+            self.scheduler = None
+        else:
+            self.scheduler = HeatBudgetScheduler(heat_budget_mJ, cooling_rate_mW)
+        for controller in self.controllers.values():
+            controller.heat_scheduler = self.scheduler
+
+    def get_switch(self, switch) -> CryoSwitchConfig:
+        """Switch managed by this manager.
+
+        Args:
+            switch (str | CryoSwitchConfig): name of the switch, or the switch itself.
+
+        Raises:
+            ValueError: Error is raised when the switch is not managed by this manager.
+        """
+        if isinstance(switch, CryoSwitchConfig) and switch in self._switch_list:
+            return switch
+        for managed_switch in self._switch_list:
+            if managed_switch.name == switch:
+                return managed_switch
+        raise ValueError(f"Unknown switch {switch}.")
+
+    def plan(self, target: dict) -> PulsePlan:
+        """Plan the minimal pulses bringing switches to target positions.
+
+        Args:
+            target (dict): target position keyed by switch name (or switch).
+
+        Returns:
+            PulsePlan: the ordered plan, see `apply`.
+        """
+        return PulsePlan.from_targets({self.get_switch(switch): position for switch, position in target.items()})
+
+    def _group_by_controller(self, target: dict) -> dict:
+        groups = {}
+        for switch, position in target.items():
+            switch = self.get_switch(switch)
+            switch.validate_position(position)
+            groups.setdefault(switch.controller, {})[switch] = position
+        return groups
+
+    @staticmethod
+    def _execute_targets(targets: dict) -> dict:
+        return PulsePlan.from_targets(targets).execute()
+
+    def apply(self, target: dict) -> dict:
+        """Bring several switches to target positions in one batch.
+
+        Only the switches not already in their target position are pulsed. The disconnect pulses of all
+        switches are sent first so that their guard times overlap, and pulses are grouped by controller
+        port and switch model. The switches of different controllers are pulsed in parallel.
+
+        Args:
+            target (dict): target position keyed by switch name (or switch), e.g. {'switch_A_6x1': 3}.
+
+        Returns:
+            dict: report with the per-switch results and the total wall time, see `PulsePlan.execute`.
+        """
+        start_time = time.monotonic()
+        groups = self._group_by_controller(target)
+
+        def execute(controller):
+            with controller.lock:
+                return self._execute_targets(groups[controller])
+
+        reports = self._map_parallel(execute, groups)
+        return merge_reports(reports, time.monotonic() - start_time)
+
+    def add_preset(self, name: str, target: dict) -> RoutingPreset:
+        """Declare a named routing preset and compile its pulse plans.
+
+        The plan reaching the preset is compiled for every combination of starting positions of its
+        switches, and compiled again only when the switch list changes.
+
+        Args:
+            name (str): name of the preset, e.g. 'qubit_A_readout'.
+            target (dict): target position keyed by switch name, e.g. {'switch_A_6x1': 3, 'input_switch_A_2x2': 1}.
+
+        Returns:
+            RoutingPreset: the compiled preset.
+
+        Raises:
+            ValueError: Error is raised when a switch is unknown or a position is unsettable.
+        """
+        preset = self._compile_preset(name, target)
+        self._preset_targets[name] = dict(target)
+        return preset
+
+    def _compile_preset(self, name: str, target: dict) -> RoutingPreset:
+        preset = RoutingPreset(name, {self.get_switch(switch): position for switch, position in target.items()})
+        preset.compile(self._switch_list_version)
+        self._presets[name] = preset
+        return preset
+
+    def remove_preset(self, name: str):
+        self._presets.pop(name, None)
+        self._preset_targets.pop(name, None)
+
+    @property
+    def presets(self) -> dict[str, RoutingPreset]:
+        """Declared routing presets, keyed by name."""
+        return self._presets
+
+    def activate(self, name: str) -> dict:
+        """Bring the switches to a routing preset using its precompiled plan.
+
+        Args:
+            name (str): name of the preset.
+
+        Returns:
+            dict: report of the execution, see `PulsePlan.execute`.
+
+        Raises:
+            ValueError: Error is raised when the preset is unknown.
+        """
+        start_time = time.monotonic()
+        preset = self._get_preset(name)
+        version = self._switch_list_version
+
+        def execute(controller):
+            with controller.lock:
+                return preset.plan(controller, version).execute()
+
+        reports = self._map_parallel(execute, preset.controllers)
+        return merge_reports(reports, time.monotonic() - start_time)
+
+    def _get_preset(self, name: str) -> RoutingPreset:
+        if name not in self._presets:
+            raise ValueError(f"Unknown preset {name}. Available presets: {list(self._presets)}.")
+        preset = self._presets[name]
+        if preset._version != self._switch_list_version:
+            preset = self._compile_preset(name, self._preset_targets[name])
+        return preset
+
+    def worker(self, controller: Cryoswitch = None) -> ControllerWorker:
+        """Worker executing the asynchronous operations of a controller, created on first use."""
+        controller = self.get_controller(controller)
+        if id(controller) not in self._workers:
+            self._workers[id(controller)] = ControllerWorker(controller)
+        return self._workers[id(controller)]
+
+    def set_position_async(self, switch, position: int) -> Future:
+        """Set the position of a switch without blocking.
+
+        The operation runs on the worker of the switch's controller, after the operations already
+        submitted to it. It can be cancelled with `Future.cancel()` until it starts, and awaited from
+        asyncio code with `await asyncio.wrap_future(future)`.
+
+        Args:
+            switch (str | CryoSwitchConfig): name of the switch, or the switch itself.
+            position (int): target position.
+
+        Returns:
+            concurrent.futures.Future: resolves to None once the switch is in position.
+        """
+        switch = self.get_switch(switch)
+        switch.validate_position(position)
+        return self.worker(switch.controller).submit(setattr, switch, 'position', position)
+
+    def apply_async(self, target: dict) -> Future:
+        """Non-blocking `apply`. The switches of each controller are planned when the controller's worker
+        starts the operation, from the positions reached by the operations submitted before it.
+
+        Returns:
+            concurrent.futures.Future: resolves to the report of `apply`.
+        """
+        groups = self._group_by_controller(target)
+        futures = [
+            self.worker(controller).submit(self._execute_targets, targets) for controller, targets in groups.items()
+        ]
+        return gather_futures(futures, merge_reports)
+
+    def activate_async(self, name: str) -> Future:
+        """Non-blocking `activate`.
+
+        Returns:
+            concurrent.futures.Future: resolves to the report of `activate`.
+        """
+        preset = self._get_preset(name)
+        version = self._switch_list_version
+        futures = [
+            self.worker(controller).submit(lambda controller=controller: preset.plan(controller, version).execute())
+            for controller in preset.controllers
+        ]
+        return gather_futures(futures, merge_reports)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        """Stop the workers once their queued operations are done, or cancel the operations not started yet,
+        and close the controllers' event stores."""
+        for worker in self._workers.values():
+            worker.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self._workers = {}
+        for controller in self.controllers.values():
+            controller.close()
+
     def get_internal_temperature(self) -> float:
         """Get internal temperature of the controller
 
@@ -190,15 +793,86 @@ class CryoSwitchManager:
         """
         return self.controller.get_internal_temperature()
 
+    def _position_changed(self, switch):
+        routing = self._routing
+        if routing is not None and switch.name in routing.switches:
+            routing.update(switch)
+
+    @property
+    def routing(self) -> RoutingGraph:
+        """Connectivity graph of the switch terminals, built from the `links` and `endpoints` of the manager on
+        first use and kept up to date as switches move."""
+        if self._routing is None:
+            self._routing = RoutingGraph(self._switch_list, self._links, self._endpoints)
+        return self._routing
+
+    def add_link(self, a: str, b: str):
+        """Declare a cable between two terminals, e.g. add_link('switch_A_6x1:C', 'input_switch_A_2x2:1')."""
+        self._links.append((a, b))
+        self._routing = None
+
+    def path_of(self, src: str) -> tuple:
+        """Signal path an endpoint or terminal is part of with the current switch positions.
+
+        Args:
+            src (str): endpoint name or '<switch name>:<terminal>'.
+
+        Returns:
+            tuple[str]: terminals along the path, from `src` to the other end.
+        """
+        return self.routing.path_of(src)
+
+    def route(self, src: str, dst: str) -> dict:
+        """Switch positions connecting two endpoints or terminals with the fewest pulses.
+
+        Returns:
+            dict: 'positions' (target position keyed by switch name, to pass to `apply`), 'pulses' and 'path',
+                see `RoutingGraph.route`.
+
+        Raises:
+            ValueError: Error is raised when the terminals can't be connected.
+        """
+        return self.routing.route(src, dst)
+
+    def connect(self, src: str, dst: str) -> dict:
+        """Connect two endpoints or terminals through the route needing the fewest pulses.
+
+        Returns:
+            dict: report of `apply`.
+        """
+        return self.apply(self.route(src, dst)['positions'])
+
+    def get_internal_temperatures(self) -> dict[str, float]:
+        """Internal temperature of every controller, keyed like `controllers`."""
+        temperatures = self._map_parallel(Cryoswitch.get_internal_temperature, self.controllers.values())
+        return dict(zip(self.controllers, temperatures))
+
     def report_connectivity(self) -> None:
         print("Cryo Switch Connectivity Report: ")
-        for switch in self.switch_list:
-            report_str = f"• {switch.name}: "
-            if isinstance(switch.connectivity, tuple):
-                report_str += '↔'.join(switch.connectivity)
-            elif isinstance(switch.connectivity, list):
-                report_str += ', '.join(["↔".join(_connectivity) for _connectivity in switch.connectivity])
-            print(report_str)
+        for spec, controller in self.controllers.items():
+            if len(self.controllers) > 1:
+                print(f"Controller {controller.SN} ({spec}):")
+            for switch in self.switch_list:
+                if switch.controller is controller:
+                    self._report_switch_connectivity(switch)
+        if self._endpoints:
+            print("Signal paths: ")
+            reported = set()
+            for endpoint in self._endpoints:
+                path = self.path_of(endpoint)
+                if len(path) == 1 or path[-1] in reported:
+                    continue
+                reported.add(endpoint)
+                print(f"• {path[0]} → {path[-1]} ({len(path)} terminals)")
+
+    @staticmethod
+    def _report_switch_connectivity(switch) -> None:
+        report_str = f"• {switch.name}: "
+        if isinstance(switch.connectivity, tuple):
+            report_str += '↔'.join(switch.connectivity)
+        elif isinstance(switch.connectivity, list):
+            report_str += ', '.join(["↔".join(_connectivity) for _connectivity in switch.connectivity])
+        print(report_str)
 
     @property
     def ocp_mA(self):
@@ -206,8 +880,7 @@ class CryoSwitchManager:
 
     @ocp_mA.setter
     def ocp_mA(self, ocp_value: float):
-        self.controller.set_OCP_mA(ocp_value)
-        self._ocp_mA = ocp_value
+        self._set_setting('ocp_mA', ocp_value)
 
     @property
     def output_voltage(self):
@@ -215,8 +888,7 @@ class CryoSwitchManager:
 
     @output_voltage.setter
     def output_voltage(self, v_out: float):
-        self.controller.set_output_voltage(v_out)
-        self._output_voltage = v_out
+        self._set_setting('output_voltage', v_out)
    
     @property
     def pulse_duration_ms(self):
@@ -224,8 +896,7 @@ class CryoSwitchManager:
 
     @pulse_duration_ms.setter
     def pulse_duration_ms(self, ms_duration):
-        self.controller.set_pulse_duration_ms(ms_duration)
-        self._pulse_duration_ms = ms_duration
+        self._set_setting('pulse_duration_ms', ms_duration)
 
     def set_room_temp_control_mode(self):
         """
@@ -241,9 +912,46 @@ class CryoSwitchManager:
         self.output_voltage = self._cryo_output_voltage
         self._control_mode = "cryo"
 
-    def initialize_all(self) -> None:
+    def initialize_all(self, only_unknown: bool = False) -> None:
+        """Initialize the switches to position 1.
+
+        Args:
+            only_unknown (bool, optional): skip the switches whose position is known. Defaults to False.
+        """
+        def initialize(controller):
+            for switch in self.switch_list:
+                if switch.controller is not controller or (only_unknown and switch._position is not None):
+                    continue
+                switch.initialize()
+
+        self._map_parallel(initialize, self.controllers.values())
+
+    def restore_positions(self) -> list[CryoSwitchConfig]:
+        """Restore the position of every switch in an unknown position from the controller's tracked states.
+
+        Returns:
+            list[CryoSwitchConfig]: switches whose position is still unknown.
+        """
+        unknown = []
         for switch in self.switch_list:
-            switch.initialize()
+            if switch._position is not None:
+                continue
+            position = switch.restore_position()
+            if position is None:
+                unknown.append(switch)
+                print(f"INFO: Switch {switch.name}: position could not be restored")
+            else:
+                print(f"INFO: Switch {switch.name}: position restored to {position}")
+        return unknown
+
+    def _control_mode_voltage(self, mode: str) -> float:
+        if mode == "cryo":
+            return self._cryo_output_voltage
+        elif mode == "room temp":
+            return self._room_temp_output_voltage
+        raise ValueError(
+            f"The specified control mode {mode} is not available. Control mode must be either 'cryo' or 'room temp'."
+        )
 
     @property
     def control_mode(self) -> str:
@@ -0,0 +1,533 @@
+"""Local daemon owning the controllers, serving many client processes.
+
+Only one process can hold a controller's serial port, and every process constructing
+a `Cryoswitch` pays for the connection queries and `start()`. The daemon keeps one
+started `Cryoswitch` per controller (or a whole `CryoSwitchManager`) and serves its
+methods over a Unix socket, so that scripts get a warm controller in milliseconds:
+
+    python -m cryoswitch_manager.daemon --controller COM5
+    python -m cryoswitch_manager.daemon --config switches.json
+
+    with CryoswitchClient() as cs:
+        cs.connect('A', 1)
+
+    with CryoSwitchManagerClient() as manager:
+        manager.switch_A_6x1.position = 2
+
+Messages are a 4 byte big-endian length followed by a JSON object. Requests are
+{'id', 'target': 'controller' | 'manager' | 'switch' | 'daemon', 'controller', 'switch',
+'op': 'call' | 'get' | 'set', 'name', 'args', 'kwargs'} and replies {'id', 'result'} or
+{'id', 'error': [type, message]}. Every controller, and the manager with its switches, has
+a dispatcher thread taking requests from a `FairQueue`: clients are served round robin, so
+one client queuing many pulses does not starve the others. Switches are returned by name
+and futures are resolved in the daemon, the client gets their result.
+
+The socket is only accessible to the user running the daemon. Where Unix sockets are
+not available (Windows), the daemon listens on a loopback TCP port instead and writes
+the port and a random token to the socket path, readable by the user only. Clients read
+that file and present the token first. A daemon refuses to start while another one
+answers on its socket path.
+"""
+import argparse
+import base64
+import collections
+import itertools
+import json
+import os
+import secrets
+import socket
+import struct
+import tempfile
+import threading
+
+from concurrent.futures import Future
+
+from .CryoSwitchController import Cryoswitch
+from .pulse_capture import PulseCapture
+
+DEFAULT_SOCKET_PATH = os.environ.get('CRYOSWITCH_SOCKET', os.path.join(tempfile.gettempdir(), 'cryoswitch.sock'))
+HEADER = struct.Struct('>I')
+# not served: interactive, firmware and plotting methods would block the dispatcher of every
+# client, and the lifetime of the controllers and workers belongs to the daemon
+NOT_SERVED = frozenset({
+    'flash', 'set_FW_upgrade_mode', 'plotting_function', 'plot', 'close', 'shutdown',
+})
+# Unix sockets are missing on Windows, the daemon listens on a loopback TCP port there
+UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+
+
+def send_message(connection, message):
+    data = json.dumps(message, separators=(',', ':')).encode()
+    connection.sendall(HEADER.pack(len(data)) + data)
+
+
+def _receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(connection):
+    (size,) = HEADER.unpack(_receive_exactly(connection, HEADER.size))
+    return json.loads(_receive_exactly(connection, size))
+
+
+def encode_value(value):
+    """JSON compatible form of a result, pulse captures and NumPy values included."""
+    if isinstance(value, PulseCapture):
+        return {'__pulse_capture__': {
+            'raw': base64.b64encode(value.to_bytes()).decode(), 'dtype': value.raw.dtype.str, 'gain': value.gain,
+            'sampling_freq': value.sampling_freq, 'metadata': encode_value(value.metadata),
+        }}
+    if isinstance(value, dict):
+        return {str(key): encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [encode_value(item) for item in value]
+    if hasattr(value, 'tolist'):  # NumPy arrays and scalars
+        return value.tolist()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, 'name'):  # switches and presets are referred to by name
+        return value.name
+    return repr(value)
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        capture = value.get('__pulse_capture__')
+        if capture is not None:
+            import numpy as np
+            raw = np.frombuffer(base64.b64decode(capture['raw']), dtype=capture['dtype'])
+            return PulseCapture(raw, capture['gain'], capture['sampling_freq'], metadata=capture['metadata'])
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def describe(obj) -> dict:
+    """Public methods and attributes of an object, used by the clients to mirror its API."""
+    methods = []
+    attributes = []
+    for name in dir(obj):
+        if name.startswith('_') or name in NOT_SERVED:
+            continue
+        class_attribute = getattr(type(obj), name, None)
+        if callable(class_attribute) and not isinstance(class_attribute, property):
+            methods.append(name)
+        else:
+            attributes.append(name)
+    return {'methods': methods, 'attributes': attributes}
+
+
+def connect_to_daemon(socket_path, timeout=None):
+    """Socket connected to the daemon of a socket path, authenticated if it listens on TCP."""
+    if UNIX_SOCKETS:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        try:
+            connection.connect(socket_path)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+    with open(socket_path) as file:
+        address = json.load(file)
+    connection = socket.create_connection(('127.0.0.1', address['port']), timeout=timeout)
+    send_message(connection, {'token': address['token']})
+    return connection
+
+
+def daemon_running(socket_path) -> bool:
+    """Whether a daemon answers on a socket path."""
+    try:
+        connection = connect_to_daemon(socket_path, timeout=1)
+    except (OSError, ValueError, KeyError):
+        return False
+    try:
+        send_message(connection, {'id': 0, 'target': 'daemon', 'name': 'ping'})
+        return receive_message(connection).get('result') == 'pong'
+    except (OSError, ValueError):
+        return False
+    finally:
+        connection.close()
+
+
+class FairQueue:
+    def __init__(self):
+        """Queue serving its clients round robin, each client's requests in order."""
+        self._queues = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, client, item):
+        with self._condition:
+            self._queues.setdefault(client, collections.deque()).append(item)
+            self._condition.notify()
+
+    def get(self):
+        """Next request, from the client after the one served last. Returns None once closed."""
+        with self._condition:
+            while not self._queues and not self._closed:
+                self._condition.wait()
+            if not self._queues:
+                return None
+            client, queue = next(iter(self._queues.items()))
+            item = queue.popleft()
+            # the client goes to the back of the line
+            del self._queues[client]
+            if queue:
+                self._queues[client] = queue
+            return item
+
+    def remove(self, client):
+        """Drop the requests of a disconnected client."""
+        with self._condition:
+            self._queues.pop(client, None)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class ControllerDaemon:
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, controllers=(), switch_config_list=None, manager_kwargs=None):
+        """Daemon keeping controllers started and serving them over a Unix socket.
+
+        Args:
+            socket_path (str, optional): path of the Unix socket. Defaults to DEFAULT_SOCKET_PATH.
+            controllers (list[str], optional): controllers named by IP address, COM port or serial number,
+                see `CryoSwitchManager.controller_kwargs`. Defaults to ().
+            switch_config_list (list[dict], optional): switch configuration of a `CryoSwitchManager` to serve,
+                its controllers and switches are served too. Defaults to None.
+            manager_kwargs (dict, optional): other arguments of the `CryoSwitchManager`. Defaults to None.
+
+        Raises:
+            ValueError: Error is raised when no controller is given.
+        """
+        from . import CryoSwitchManager
+
+        self.socket_path = socket_path
+        self.manager = None
+        if switch_config_list is not None:
+            self.manager = CryoSwitchManager(switch_config_list, **(manager_kwargs or {}))
+            self.controllers = dict(self.manager.controllers)
+        else:
+            self.controllers = {}
+            for spec in controllers:
+                controller = Cryoswitch(**CryoSwitchManager.controller_kwargs(spec))
+                controller.start()
+                self.controllers[spec] = controller
+        if not self.controllers:
+            raise ValueError("No controller to serve.")
+        # controllers are also reachable by serial number
+        self._aliases = {controller.SN: spec for spec, controller in self.controllers.items()}
+
+        self._queues = {spec: FairQueue() for spec in self.controllers}
+        if self.manager is not None:
+            self._queues['manager'] = FairQueue()
+        self._client_ids = itertools.count()
+        self._server = None
+        self._token = None
+        self._stopped = threading.Event()
+        self._dispatchers = [
+            threading.Thread(target=self._dispatch, args=(queue,), name=f'cryoswitch-daemon-{key}', daemon=True)
+            for key, queue in self._queues.items()
+        ]
+        for dispatcher in self._dispatchers:
+            dispatcher.start()
+
+    def _resolve(self, request):
+        target = request.get('target', 'controller')
+        if target in ('manager', 'switch'):
+            if self.manager is None:
+                raise ValueError("The daemon serves no manager.")
+            if target == 'switch':
+                return 'manager', self.manager.get_switch(request.get('switch'))
+            return 'manager', self.manager
+        spec = request.get('controller') or next(iter(self.controllers))
+        spec = self._aliases.get(spec, spec)
+        if spec not in self.controllers:
+            raise ValueError(f"Unknown controller {spec}.")
+        return spec, self.controllers[spec]
+
+    @staticmethod
+    def _execute(obj, request):
+        name = request['name']
+        if name.startswith('_'):
+            raise AttributeError(f"{name} is private.")
+        if name in NOT_SERVED:
+            raise AttributeError(f"{name} is not served by the daemon.")
+        op = request.get('op', 'call')
+        if op == 'get':
+            return getattr(obj, name)
+        if op == 'set':
+            setattr(obj, name, decode_value(request['args'][0]))
+            return None
+        method = getattr(obj, name)
+        result = method(*decode_value(request.get('args', [])), **decode_value(request.get('kwargs', {})))
+        if isinstance(result, Future):
+            return result.result()
+        return result
+
+    def _dispatch(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            reply, obj, request = item
+            try:
+                if isinstance(obj, Cryoswitch):
+                    with obj.lock:
+                        result = self._execute(obj, request)
+                else:
+                    result = self._execute(obj, request)
+                reply({'id': request.get('id'), 'result': encode_value(result)})
+            except Exception as error:
+                reply({'id': request.get('id'), 'error': [type(error).__name__, str(error)]})
+
+    def _daemon_request(self, request):
+        if request['name'] == 'describe':
+            description = {
+                'controllers': {spec: controller.SN for spec, controller in self.controllers.items()},
+                'controller': describe(next(iter(self.controllers.values()))),
+            }
+            if self.manager is not None:
+                description['manager'] = describe(self.manager)
+                description['switches'] = {switch.name: describe(switch) for switch in self.manager.switch_list}
+            return description
+        if request['name'] == 'ping':
+            return 'pong'
+        raise ValueError(f"Unknown daemon request {request['name']}.")
+
+    def _serve_client(self, connection):
+        client = next(self._client_ids)
+        send_lock = threading.Lock()
+
+        def reply(message):
+            with send_lock:
+                try:
+                    send_message(connection, message)
+                except OSError:
+                    pass
+
+        try:
+            if self._token is not None and receive_message(connection).get('token') != self._token:
+                return
+            while not self._stopped.is_set():
+                request = receive_message(connection)
+                if request.get('target') == 'daemon':
+                    try:
+                        reply({'id': request.get('id'), 'result': self._daemon_request(request)})
+                    except Exception as error:
+                        reply({'id': request.get('id'), 'error': [type(error).__name__, str(error)]})
+                    continue
+                try:
+                    key, obj = self._resolve(request)
+                except ValueError as error:
+                    reply({'id': request.get('id'), 'error': ['ValueError', str(error)]})
+                    continue
+                self._queues[key].put(client, (reply, obj, request))
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            for queue in self._queues.values():
+                queue.remove(client)
+            connection.close()
+
+    def serve_forever(self):
+        """Accept clients until `shutdown`, one thread per client.
+
+        Raises:
+            RuntimeError: Error is raised when another daemon answers on the socket path.
+        """
+        if os.path.exists(self.socket_path):
+            if daemon_running(self.socket_path):
+                raise RuntimeError(f"A daemon is already serving on {self.socket_path}.")
+            os.remove(self.socket_path)  # left by a daemon that didn't shut down
+        if UNIX_SOCKETS:
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # created without access for other users, there is no window before a chmod
+            umask = os.umask(0o177)
+            try:
+                self._server.bind(self.socket_path)
+            finally:
+                os.umask(umask)
+        else:
+            self._server = socket.create_server(('127.0.0.1', 0))
+            self._token = secrets.token_hex(16)
+            fd = os.open(self.socket_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'port': self._server.getsockname()[1], 'token': self._token}, file)
+        self._server.listen()
+        print(f'Serving {", ".join(self.controllers)} on {self.socket_path}')
+        try:
+            while not self._stopped.is_set():
+                try:
+                    connection, _ = self._server.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._serve_client, args=(connection,), daemon=True).start()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self._stopped.set()
+        for queue in self._queues.values():
+            queue.close()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        if self.manager is not None:
+            self.manager.shutdown(wait=False)
+        for controller in self.controllers.values():
+            controller.close()
+
+
+class DaemonConnection:
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, timeout=None):
+        """Connection to a `ControllerDaemon`, requests from several threads are sent one at a time."""
+        self.socket = connect_to_daemon(socket_path, timeout)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def request(self, target, name, op='call', args=(), kwargs=None, controller=None, switch=None):
+        """Send a request and wait for its reply.
+
+        Raises:
+            RuntimeError: Error is raised with the type and message of the exception raised in the daemon.
+        """
+        message = {
+            'id': next(self._ids), 'target': target, 'controller': controller, 'switch': switch, 'op': op, 'name': name,
+            'args': encode_value(list(args)), 'kwargs': encode_value(kwargs or {}),
+        }
+        with self._lock:
+            send_message(self.socket, message)
+            reply = receive_message(self.socket)
+        if 'error' in reply:
+            raise RuntimeError(f'{reply["error"][0]}: {reply["error"][1]}')
+        return decode_value(reply['result'])
+
+    def close(self):
+        self.socket.close()
+
+
+class _RemoteObject:
+    _target = None
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, controller=None, connection=None):
+        connection = connection or DaemonConnection(socket_path)
+        description = connection.request('daemon', 'describe')
+        if self._target not in description:
+            raise ValueError(f"The daemon serves no {self._target}.")
+        self._bind(connection, description[self._target], controller=controller)
+        object.__setattr__(self, 'controllers', description['controllers'])
+
+    def _bind(self, connection, description, **route):
+        object.__setattr__(self, '_connection', connection)
+        object.__setattr__(self, '_route', route)
+        object.__setattr__(self, '_methods', frozenset(description['methods']))
+        object.__setattr__(self, '_attributes', frozenset(description['attributes']))
+
+    def __getattr__(self, name):
+        if name in self._methods:
+            def method(*args, **kwargs):
+                return self._connection.request(self._target, name, args=args, kwargs=kwargs, **self._route)
+            method.__name__ = name
+            return method
+        if name in self._attributes:
+            return self._connection.request(self._target, name, op='get', **self._route)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name not in self._attributes:
+            raise AttributeError(f"Unknown remote attribute {name}.")
+        self._connection.request(self._target, name, op='set', args=(value,), **self._route)
+
+    def __dir__(self):
+        return sorted(self._methods | self._attributes)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CryoswitchClient(_RemoteObject):
+    """`Cryoswitch` API of a controller served by a `ControllerDaemon`.
+
+    Args:
+        socket_path (str, optional): daemon socket. Defaults to DEFAULT_SOCKET_PATH.
+        controller (str, optional): controller spec or serial number. Defaults to None, the first controller.
+    """
+    _target = 'controller'
+
+
+class SwitchClient(_RemoteObject):
+    """`CryoSwitchConfig` API of a switch of the manager served by a `ControllerDaemon`, see `CryoSwitchManagerClient`."""
+    _target = 'switch'
+
+    def __init__(self, connection, name, description):
+        self._bind(connection, description, switch=name)
+        object.__setattr__(self, 'name', name)
+
+    def close(self):
+        pass  # the connection belongs to the manager client
+
+
+class CryoSwitchManagerClient(_RemoteObject):
+    """`CryoSwitchManager` API of the manager served by a `ControllerDaemon`.
+
+    Switches are attributes like on the manager, `manager.<switch>.position = 2`, and are
+    passed to and returned by the manager methods by name. The `*_async` methods block
+    until done, the client gets the result of their future.
+    """
+    _target = 'manager'
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, connection=None):
+        connection = connection or DaemonConnection(socket_path)
+        super().__init__(connection=connection)
+        description = connection.request('daemon', 'describe')
+        object.__setattr__(self, 'switches', {name: SwitchClient(connection, name, switch_description)
+                                              for name, switch_description in description['switches'].items()})
+
+    def __getattr__(self, name):
+        switches = self.__dict__.get('switches', {})
+        if name in switches:
+            return switches[name]
+        return super().__getattr__(name)
+
+    def __dir__(self):
+        return sorted(super().__dir__() + list(self.switches))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='CryoSwitch controller daemon')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='path of the Unix socket, or of the port file where Unix sockets are not available')
+    parser.add_argument('--controller', action='append', default=[],
+                        help='controller to serve (IP address, COM port or serial number), can be repeated')
+    parser.add_argument('--config', default=None,
+                        help='JSON file with the switch configuration list of a CryoSwitchManager to serve')
+    args = parser.parse_args()
+
+    switch_config_list = None
+    if args.config:
+        with open(args.config) as file:
+            switch_config_list = json.load(file)
+    daemon = ControllerDaemon(args.socket, args.controller, switch_config_list=switch_config_list,
+                              manager_kwargs={'COM_port': args.controller[0]} if args.controller else None)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        daemon.shutdown()
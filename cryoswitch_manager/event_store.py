@@ -0,0 +1,339 @@
+"""Optional local event store for pulses, switch states, housekeeping and faults.
+
+All events go to a single SQLite database in WAL mode, so that readers (GUI, analysis
+scripts) never block the controller process writing to it. Events are buffered and
+inserted in batches, each batch in one transaction. A background thread inserts the
+buffered events every `flush_interval_s`, and the store is closed, and flushed, at exit.
+
+The existing log files (`states.json`, `pulse_logging.txt`, the waveform log and
+`history.json`) can be imported with:
+
+    python -m cryoswitch_manager.event_store migrate <directory> [--db events.sqlite]
+"""
+import argparse
+import atexit
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from .pulse_capture import PulseCapture
+
+# pulses of the waveform log and of pulse_logging.txt closer than this are the same pulse, the
+# text log only keeps whole seconds
+MIGRATION_TIME_TOLERANCE_S = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pulses (
+    id INTEGER PRIMARY KEY, time REAL NOT NULL, SN TEXT, port TEXT, contact INTEGER, polarity INTEGER,
+    voltage REAL, max_current REAL, sampling_freq REAL, waveform BLOB, gain REAL
+);
+CREATE INDEX IF NOT EXISTS pulses_switch ON pulses (SN, port, contact, time);
+CREATE INDEX IF NOT EXISTS pulses_time ON pulses (time);
+
+CREATE TABLE IF NOT EXISTS states (
+    id INTEGER PRIMARY KEY, time REAL NOT NULL, SN TEXT, port TEXT, contact INTEGER, state INTEGER
+);
+CREATE INDEX IF NOT EXISTS states_switch ON states (SN, port, contact, time);
+
+CREATE TABLE IF NOT EXISTS housekeeping (
+    id INTEGER PRIMARY KEY, time REAL NOT NULL, SN TEXT, quantity TEXT, value REAL
+);
+CREATE INDEX IF NOT EXISTS housekeeping_quantity ON housekeeping (SN, quantity, time);
+
+CREATE TABLE IF NOT EXISTS faults (
+    id INTEGER PRIMARY KEY, time REAL NOT NULL, SN TEXT, kind TEXT, detail TEXT
+);
+CREATE INDEX IF NOT EXISTS faults_time ON faults (SN, time);
+
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY, time REAL NOT NULL, direction TEXT, data TEXT
+);
+CREATE INDEX IF NOT EXISTS commands_time ON commands (time);
+"""
+
+COLUMNS = {
+    'pulses': ('time', 'SN', 'port', 'contact', 'polarity', 'voltage', 'max_current', 'sampling_freq', 'waveform', 'gain'),
+    'states': ('time', 'SN', 'port', 'contact', 'state'),
+    'housekeeping': ('time', 'SN', 'quantity', 'value'),
+    'faults': ('time', 'SN', 'kind', 'detail'),
+    'commands': ('time', 'direction', 'data'),
+}
+
+
+class EventStore:
+    def __init__(self, filename, batch_size=100, flush_interval_s=1.0):
+        """SQLite event store.
+
+        Args:
+            filename (str): database file, created if it doesn't exist.
+            batch_size (int, optional): number of buffered events that triggers an insert. Defaults to 100.
+            flush_interval_s (float, optional): buffered events are inserted at least this often. Defaults to 1.0.
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+
+        self._lock = threading.RLock()
+        self._buffers = {table: [] for table in COLUMNS}
+        self._buffered = 0
+        self._last_flush = time.time()
+
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval_s):
+            try:
+                self.flush()
+            except sqlite3.Error as error:
+                print(f'WARNING: event store {self.filename}: {error}')
+
+    def _add(self, table, row):
+        with self._lock:
+            self._buffers[table].append(row)
+            self._buffered += 1
+            if self._buffered >= self.batch_size or time.time() - self._last_flush > self.flush_interval_s:
+                self.flush()
+
+    def flush(self):
+        """Insert every buffered event in a single transaction."""
+        with self._lock:
+            self._last_flush = time.time()
+            if not self._buffered:
+                return
+            with self._connection:
+                for table, rows in self._buffers.items():
+                    if rows:
+                        columns = COLUMNS[table]
+                        self._connection.executemany(
+                            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+                        )
+                        rows.clear()
+            self._buffered = 0
+
+    def close(self):
+        """Insert the buffered events and close the database, called at exit if not called before."""
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+            self.flush()
+            self._connection.close()
+        atexit.unregister(self.close)
+
+    def record_pulse(
+        self, SN, port, contact, polarity, voltage, current_profile, sampling_freq, timestamp=None,
+        store_waveform=True, max_current=None
+    ):
+        waveform = None
+        gain = None
+        if current_profile is not None and len(current_profile):
+            max_current = float(current_profile.max()) if isinstance(current_profile, PulseCapture) else float(np.max(current_profile))
+            if store_waveform and isinstance(current_profile, PulseCapture):
+                waveform = current_profile.to_bytes()  # raw ADC codes, scaled by `gain` when read back
+                gain = current_profile.gain
+            elif store_waveform:
+                waveform = np.asarray(current_profile, dtype=np.float32).tobytes()
+        self._add('pulses', (
+            timestamp or time.time(), SN, port, contact, polarity, voltage, max_current, sampling_freq, waveform, gain
+        ))
+
+    def record_state(self, SN, port, contact, state, timestamp=None):
+        self._add('states', (timestamp or time.time(), SN, port, contact, state))
+
+    def record_housekeeping(self, SN, quantity, value, timestamp=None):
+        self._add('housekeeping', (timestamp or time.time(), SN, quantity, value))
+
+    def record_fault(self, SN, kind, detail='', timestamp=None):
+        self._add('faults', (timestamp or time.time(), SN, kind, detail))
+
+    def record_command(self, direction, data, timestamp=None):
+        self._add('commands', (timestamp or time.time(), direction, data))
+
+    def _select(self, table, columns, filters, since=None, until=None, limit=None, order='time'):
+        conditions = []
+        values = []
+        for column, value in filters.items():
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                values.append(value)
+        if since is not None:
+            conditions.append('time >= ?')
+            values.append(since)
+        if until is not None:
+            conditions.append('time < ?')
+            values.append(until)
+
+        query = f"SELECT {columns} FROM {table}"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += f' ORDER BY {order}'
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+
+        self.flush()
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(query, values)]
+
+    def pulses(self, SN=None, port=None, contact=None, since=None, until=None, limit=None, waveforms=False):
+        """Pulses matching the given filters, oldest first.
+
+        Args:
+            waveforms (bool, optional): also decode the captured current profiles, as `PulseCapture` when the raw
+                ADC codes were stored, as float arrays in mA otherwise. Defaults to False.
+        """
+        columns = '*' if waveforms else 'id, time, SN, port, contact, polarity, voltage, max_current, sampling_freq'
+        rows = self._select('pulses', columns, {'SN': SN, 'port': port, 'contact': contact}, since, until, limit)
+        if waveforms:
+            for row in rows:
+                if row['waveform'] is None:
+                    continue
+                if row['gain'] is not None:
+                    row['waveform'] = PulseCapture(row['waveform'], row['gain'], row['sampling_freq'])
+                else:
+                    row['waveform'] = np.frombuffer(row['waveform'], dtype=np.float32)
+        return rows
+
+    def latest_states(self, SN):
+        """Last recorded state of every contact of a controller.
+
+        Returns:
+            dict: same layout as a controller entry of `states.json`, {'port_A': {'contact_1': 0, ...}, ...}
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT port, contact, state, MAX(time) FROM states WHERE SN = ? GROUP BY port, contact', (SN,)
+            ).fetchall()
+        states = {}
+        for row in rows:
+            states.setdefault('port_' + str(row['port']), {})['contact_' + str(row['contact'])] = row['state']
+        return states
+
+    def housekeeping(self, SN=None, quantity=None, since=None, until=None, limit=None):
+        return self._select('housekeeping', '*', {'SN': SN, 'quantity': quantity}, since, until, limit)
+
+    def faults(self, SN=None, kind=None, since=None, until=None, limit=None):
+        return self._select('faults', '*', {'SN': SN, 'kind': kind}, since, until, limit)
+
+    def commands(self, direction=None, since=None, until=None, limit=None):
+        return self._select('commands', '*', {'direction': direction}, since, until, limit)
+
+
+def _parse_pulse_line(line):
+    """Parse a `pulse_logging.txt` line, see `Cryoswitch.log_pulse`."""
+    direction, rest = line.split('->', 1)
+    switch, rest = rest.split(',', 1)
+    port, contact = switch.split('Port:')[1].split('-')
+    max_current = float(rest.split('CurrentMax:')[1].split()[0])
+    timestamp = int(rest.split('Timestamp:')[1].split('*')[0].strip())
+    return {
+        'time': timestamp, 'port': port.strip(), 'contact': int(contact),
+        'polarity': 1 if direction.strip() == 'Connect' else 0, 'max_current': max_current, 'warning': '*' in rest,
+    }
+
+
+def migrate(store, directory):
+    """Import the existing log files of a controller directory into an event store.
+
+    Args:
+        store (EventStore): destination store.
+        directory (str): directory holding `states.json`, `pulse_logging.txt`, `history.json` and the `data` waveform log.
+
+    Returns:
+        dict: number of imported records per source.
+    """
+    from .pulse_analytics import find_waveform_files, load_waveforms
+
+    imported = {'states': 0, 'waveforms': 0, 'pulses': 0, 'commands': 0}
+
+    states_file = os.path.join(directory, 'states.json')
+    if os.path.isfile(states_file):
+        timestamp = os.path.getmtime(states_file)
+        with open(states_file) as file:
+            states = json.load(file)
+        for SN, ports in states.items():
+            if SN == 'SN':
+                continue  # template entry
+            for port, contacts in ports.items():
+                for contact, state in contacts.items():
+                    store.record_state(SN, port.split('_')[-1], int(contact.split('_')[-1]), state, timestamp=timestamp)
+                    imported['states'] += 1
+
+    waveform_times = {}  # (port, contact, polarity) -> times of the pulses imported with their waveform
+    for waveform in load_waveforms(find_waveform_files(os.path.join(directory, 'data'))):
+        store.record_pulse(
+            waveform.get('SN'), waveform['port'], waveform['contact'], waveform['polarity'], waveform['voltage'],
+            waveform['data'], waveform['SF'], timestamp=waveform['time']
+        )
+        waveform_times.setdefault((waveform['port'], waveform['contact'], waveform['polarity']), []).append(waveform['time'])
+        imported['waveforms'] += 1
+
+    for times in waveform_times.values():
+        times.sort()
+
+    pulse_file = os.path.join(directory, 'pulse_logging.txt')
+    if os.path.isfile(pulse_file):
+        with open(pulse_file) as file:
+            for line in file:
+                try:
+                    pulse = _parse_pulse_line(line)
+                except (IndexError, ValueError):
+                    continue
+                if pulse['warning']:
+                    store.record_fault(None, 'low_current', f"Port:{pulse['port']}-{pulse['contact']}", timestamp=pulse['time'])
+                times = waveform_times.get((pulse['port'], pulse['contact'], pulse['polarity']), [])
+                index = bisect.bisect_left(times, pulse['time'] - MIGRATION_TIME_TOLERANCE_S)
+                if index < len(times) and times[index] <= pulse['time'] + MIGRATION_TIME_TOLERANCE_S:
+                    continue  # already imported with its waveform
+                store.record_pulse(
+                    None, pulse['port'], pulse['contact'], pulse['polarity'], None, None, None,
+                    timestamp=pulse['time'], max_current=pulse['max_current']
+                )
+                imported['pulses'] += 1
+
+    history_file = os.path.join(directory, 'history.json')
+    if os.path.isfile(history_file):
+        try:
+            with open(history_file) as file:
+                history = json.load(file)
+        except ValueError:
+            history = {}  # empty or corrupted history
+        for direction, entries in history.items():
+            for entry in entries:
+                store.record_command(direction, entry['data'], timestamp=entry['date'])
+                imported['commands'] += 1
+
+    store.flush()
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='CryoSwitch event store utilities')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='import the existing log files into the event store')
+    migrate_parser.add_argument('directory', help='directory holding states.json, pulse_logging.txt and the data folder')
+    migrate_parser.add_argument('--db', default=None, help='event store file, defaults to <directory>/events.sqlite')
+    args = parser.parse_args()
+
+    with EventStore(args.db or os.path.join(args.directory, 'events.sqlite')) as event_store:
+        print(migrate(event_store, args.directory))
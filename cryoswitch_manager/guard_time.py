@@ -0,0 +1,94 @@
+"""Guard time between the disconnect and connect pulses of a switch.
+
+Instead of a fixed one second sleep, the guard time is derived from the disconnect
+pulse that was just captured: once the coil current is back to baseline only a
+per-model minimum is kept, otherwise the remaining decay is extrapolated from the
+end of the capture. Without a usable capture the pulse duration is used as bound.
+"""
+import numpy as np
+
+MIN_GUARD_TIME_S = {
+    'R583423141': 0.05,
+    'R577433007': 0.05,
+}
+DEFAULT_MIN_GUARD_TIME_S = 0.1
+
+
+def settle_time_s(current_profile, sampling_freq, baseline_fraction=0.05):
+    """Time still needed after the end of a capture for the coil current to go back to baseline.
+
+    Args:
+        current_profile (array_like): captured current profile in mA.
+        sampling_freq (float): sampling frequency in Hz.
+        baseline_fraction (float, optional): fraction of the peak current considered as baseline. Defaults to 0.05.
+
+    Returns:
+        float: remaining settle time in seconds, 0 if the current is already back to baseline, None if it
+            can't be estimated because the coil is still driven at the end of the capture.
+    """
+    profile = np.asarray(current_profile, dtype=float)
+    if not profile.size:
+        return None
+    peak_index = profile.argmax()
+    peak = profile[peak_index]
+    if peak <= 0:
+        return 0.0
+
+    baseline = baseline_fraction * peak
+    tail = profile[peak_index:]
+    if (tail <= baseline).any():
+        return 0.0
+
+    # still decaying at the end of the capture, extrapolate the exponential decay of the last ~1 ms
+    n_samples = min(tail.size, max(4, int(1e-3 * sampling_freq)))
+    first, last = tail[-n_samples], tail[-1]
+    if not first > last > 0:
+        return None
+    tau = (n_samples - 1) / sampling_freq / np.log(first / last)
+    return float(tau * np.log(last / baseline))
+
+
+class GuardTimePolicy:
+    def __init__(self, min_guard_time_s=None, margin=2.0, max_guard_time_s=1.0, baseline_fraction=0.05):
+        """Policy computing the guard time of a switch reconfiguration.
+
+        Args:
+            min_guard_time_s (dict, optional): minimum guard time per switch model, merged over `MIN_GUARD_TIME_S`.
+                Defaults to None.
+            margin (float, optional): safety factor applied to the estimated settle time. Defaults to 2.0.
+            max_guard_time_s (float, optional): upper bound of the guard time. Defaults to 1.0, the former fixed delay.
+            baseline_fraction (float, optional): see `settle_time_s`. Defaults to 0.05.
+        """
+        self.min_guard_time_s = dict(MIN_GUARD_TIME_S)
+        if min_guard_time_s:
+            self.min_guard_time_s.update(min_guard_time_s)
+        self.margin = margin
+        self.max_guard_time_s = max_guard_time_s
+        self.baseline_fraction = baseline_fraction
+
+    def guard_time_s(self, switch_model, pulse_duration_ms, current_profile=None, sampling_freq=None):
+        """Guard time to respect after a disconnect pulse.
+
+        Args:
+            switch_model (str): model of the switch.
+            pulse_duration_ms (float): configured pulse duration.
+            current_profile (array_like, optional): captured disconnect pulse. Defaults to None.
+            sampling_freq (float, optional): sampling frequency of the capture in Hz. Defaults to the
+                capture's own `sampling_freq`.
+
+        Returns:
+            float: guard time in seconds.
+        """
+        min_guard_time = self.min_guard_time_s.get(switch_model, DEFAULT_MIN_GUARD_TIME_S)
+        settle_time = None
+        if current_profile is not None and len(current_profile):
+            if sampling_freq is None:
+                sampling_freq = current_profile.sampling_freq
+            settle_time = settle_time_s(current_profile, sampling_freq, self.baseline_fraction)
+        if settle_time is None:
+            settle_time = pulse_duration_ms / 1000
+
+        return min(self.max_guard_time_s, max(min_guard_time, self.margin * settle_time))
+
+
+DEFAULT_GUARD_TIME_POLICY = GuardTimePolicy()
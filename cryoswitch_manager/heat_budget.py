@@ -0,0 +1,155 @@
+"""Heat budget pacing of switch pulses.
+
+Every pulse dissipates energy in the fridge. `HeatBudgetScheduler` keeps a token
+bucket of energy: the bucket refills at the configured cooling rate and each pulse
+takes its energy out of it, waiting first if the bucket doesn't hold enough. Pulses
+thus run back to back while the budget allows and are spaced out only as much as
+needed to keep the average heat load below the cooling rate.
+
+Every pulse of a controller goes through the scheduler, `Cryoswitch.select_and_pulse`
+calls it. Before a pulse its energy is estimated from the previous pulses of the same
+switch model at the same settings, or bounded by output voltage x OCP limit x pulse duration
+when nothing was measured yet. After the pulse the budget is corrected with the
+energy computed from the captured current profile.
+"""
+import threading
+import time
+
+import numpy as np
+
+
+def pulse_energy_mJ(current_profile, voltage, sampling_freq=None):
+    """Energy delivered during a captured pulse, voltage x integrated current.
+
+    Args:
+        current_profile (array_like): captured current profile in mA.
+        voltage (float): output voltage in V.
+        sampling_freq (float, optional): sampling frequency in Hz. Defaults to the capture's own `sampling_freq`.
+
+    Returns:
+        float: energy in mJ.
+    """
+    if sampling_freq is None:
+        sampling_freq = current_profile.sampling_freq
+    return float(voltage * np.sum(current_profile) / sampling_freq)
+
+
+def max_pulse_energy_mJ(voltage, ocp_mA, pulse_duration_ms):
+    """Upper bound of the energy of a pulse, with the current at the OCP limit for the whole pulse."""
+    return voltage * ocp_mA * pulse_duration_ms / 1000
+
+
+class HeatBudget:
+    def __init__(self, capacity_mJ, cooling_rate_mW):
+        """Token bucket of energy.
+
+        Args:
+            capacity_mJ (float): energy that can be dissipated in a burst.
+            cooling_rate_mW (float): rate at which the budget refills, i.e. the sustained heat load.
+        """
+        if capacity_mJ is None or capacity_mJ <= 0:
+            raise ValueError(f"The heat budget must be positive, got {capacity_mJ} mJ")
+        if cooling_rate_mW is None or cooling_rate_mW <= 0:
+            raise ValueError(f"A heat budget needs a positive cooling rate, got {cooling_rate_mW} mW")
+        self.capacity_mJ = capacity_mJ
+        self.cooling_rate_mW = cooling_rate_mW
+        self._tokens = capacity_mJ
+        self._last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity_mJ, self._tokens + (now - self._last_update) * self.cooling_rate_mW)
+        self._last_update = now
+
+    @property
+    def available_mJ(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def wait_time_s(self, energy_mJ) -> float:
+        """Time until `energy_mJ` can be taken from the budget. A pulse larger than the capacity waits for a full bucket."""
+        with self._lock:
+            self._refill()
+            missing = min(energy_mJ, self.capacity_mJ) - self._tokens
+        return max(0.0, missing / self.cooling_rate_mW)
+
+    def acquire(self, energy_mJ) -> float:
+        """Wait until the budget allows `energy_mJ` and take it.
+
+        Returns:
+            float: time waited in seconds.
+        """
+        waited = 0.0
+        while True:
+            # the check and the take are one critical section, so that concurrent pulses can't overdraw
+            with self._lock:
+                self._refill()
+                missing = min(energy_mJ, self.capacity_mJ) - self._tokens
+                if missing <= 0:
+                    self._tokens -= energy_mJ
+                    return waited
+            wait_time = missing / self.cooling_rate_mW
+            time.sleep(wait_time)
+            waited += wait_time
+
+    def settle(self, estimated_mJ, actual_mJ):
+        """Correct the budget once the actual energy of a pulse is known."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity_mJ, self._tokens + estimated_mJ - actual_mJ)
+
+
+class HeatBudgetScheduler:
+    def __init__(self, capacity_mJ, cooling_rate_mW, smoothing=0.3):
+        """Paces the pulses of controllers against a `HeatBudget`.
+
+        Args:
+            capacity_mJ (float): energy that can be dissipated in a burst.
+            cooling_rate_mW (float): sustained heat load the fridge can absorb.
+            smoothing (float, optional): weight of the last measured pulse in the energy estimate. Defaults to 0.3.
+        """
+        self.budget = HeatBudget(capacity_mJ, cooling_rate_mW)
+        self.smoothing = smoothing
+        self.measured_energy_mJ = {}
+        self.total_energy_mJ = 0.0
+        self.total_wait_s = 0.0
+        self.pulses = 0
+
+    @staticmethod
+    def _settings(controller):
+        return controller.current_switch_model, controller.converter_voltage, controller.pulse_duration_ms
+
+    def estimate_mJ(self, controller) -> float:
+        """Energy of the next pulse of a controller, before sending it."""
+        settings = self._settings(controller)
+        if settings in self.measured_energy_mJ:
+            return self.measured_energy_mJ[settings]
+        ocp_mA = controller.OCP_mA or controller.OCP_range[1]
+        return max_pulse_energy_mJ(controller.converter_voltage, ocp_mA, controller.pulse_duration_ms)
+
+    def before_pulse(self, controller) -> float:
+        """Wait for the budget to allow the next pulse of `controller`.
+
+        Returns:
+            float: the energy estimate to pass to `after_pulse`.
+        """
+        estimate = self.estimate_mJ(controller)
+        self.total_wait_s += self.budget.acquire(estimate)
+        return estimate
+
+    def after_pulse(self, controller, estimate, current_profile):
+        """Correct the budget and the estimates with the captured pulse, empty if no pulse was sent."""
+        if current_profile is None or not len(current_profile):
+            self.budget.settle(estimate, 0.0)
+            return
+        voltage = controller.MEASURED_converter_voltage or controller.converter_voltage
+        energy = pulse_energy_mJ(current_profile, voltage, getattr(current_profile, 'sampling_freq', controller.sampling_freq))
+        self.budget.settle(estimate, energy)
+
+        settings = self._settings(controller)
+        previous = self.measured_energy_mJ.get(settings, energy)
+        self.measured_energy_mJ[settings] = (1 - self.smoothing) * previous + self.smoothing * energy
+        self.total_energy_mJ += energy
+        self.pulses += 1
@@ -0,0 +1,183 @@
+"""Write-ahead journal of switch actuations.
+
+Every actuation is appended to the journal (and synced to disk) before the pulse is
+sent, and its outcome is appended after the pulse. If the process dies before the
+tracked state is rewritten, the journal tells on the next start which contacts were
+actually switched and which actuations were interrupted, so only those have to be
+pulsed again instead of re-initializing every switch.
+
+The journal has a single writer: the first process opening the journal of a controller
+holds a lock on `<journal>.lock` until it closes it, other processes (GUI, scripts next to
+the daemon) get a `JournalLocked` error and run without journal.
+"""
+import json
+import os
+import time
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _try_lock(fd):
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def _unlock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _try_lock(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class JournalLocked(RuntimeError):
+    """The journal is open for writing in another process."""
+
+
+class StateJournal:
+    def __init__(self, filename, fsync=True):
+        """Append-only journal stored as one JSON record per line.
+
+        Args:
+            filename (str): journal file, created if it doesn't exist.
+            fsync (bool, optional): sync every record to disk. Defaults to True.
+
+        Raises:
+            JournalLocked: Error is raised when another process has the journal open.
+        """
+        self.filename = filename
+        self.fsync = fsync
+        self._lock_fd = os.open(filename + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        if not _try_lock(self._lock_fd):
+            os.close(self._lock_fd)
+            raise JournalLocked(f'{filename} is open in another process')
+        self.seq = 0
+        self.n_records = 0
+        self._pending = {}
+
+        for record in self.records():
+            self.seq = max(self.seq, record['seq'])
+            self.n_records += 1
+            if record['op'] == 'intent':
+                self._pending[record['seq']] = record
+            else:
+                self._pending.pop(record['seq'], None)
+
+        self._file = open(self.filename, 'a')
+
+    def records(self):
+        """Records of the journal file in order. A truncated last line, left by a crash while writing, is ignored."""
+        if not os.path.isfile(self.filename):
+            return []
+        records = []
+        with open(self.filename) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.n_records += 1
+
+    def begin(self, SN, port, contact, polarity, settings=None):
+        """Record an intended actuation, must be called before the pulse.
+
+        Args:
+            settings (dict, optional): pulse settings ('model', 'voltage', 'pulse_duration_ms') to replay
+                the actuation with. Defaults to None.
+
+        Returns:
+            int: sequence number to pass to `commit`.
+        """
+        self.seq += 1
+        record = {'seq': self.seq, 'op': 'intent', 'SN': SN, 'port': port, 'contact': contact,
+                  'polarity': polarity, 'time': time.time(), **(settings or {})}
+        self._write(record)
+        self._pending[self.seq] = record
+        return self.seq
+
+    def commit(self, seq, success):
+        """Record the outcome of the actuation `seq`."""
+        self._write({'seq': seq, 'op': 'done', 'success': bool(success), 'time': time.time()})
+        self._pending.pop(seq, None)
+
+    def mark_unknown(self, SN, port, contact):
+        """Record that the state of a contact is unknown, e.g. after an actuation that couldn't be verified."""
+        self.seq += 1
+        self._write({'seq': self.seq, 'op': 'unknown', 'SN': SN, 'port': port, 'contact': contact, 'time': time.time()})
+
+    @property
+    def pending(self):
+        """Intents without outcome, in order."""
+        return [self._pending[seq] for seq in sorted(self._pending)]
+
+    def recover(self):
+        """Final outcome of every contact found in the journal.
+
+        Returns:
+            tuple[dict, list]: `committed` maps (port, contact) to the last successfully applied polarity,
+                None for the contacts marked unknown, `pending` lists the interrupted intents that were not superseded by a later actuation of the same contact.
+        """
+        done = {}     # (port, contact) -> last applied record
+        pending = {}  # (port, contact) -> last intent without outcome
+        intents = {}
+        for record in self.records():
+            if record['op'] == 'intent':
+                intents[record['seq']] = record
+                pending[(record['port'], record['contact'])] = record
+            elif record['op'] == 'unknown':
+                key = (record['port'], record['contact'])
+                done[key] = dict(record, polarity=None)
+                pending.pop(key, None)
+            else:
+                intent = intents.get(record['seq'])
+                if intent is None:
+                    continue
+                key = (intent['port'], intent['contact'])
+                if pending.get(key) is intent:
+                    # a failed actuation was not sent, the contact keeps its last applied state
+                    del pending[key]
+                    if record['success']:
+                        done[key] = intent
+
+        committed = {key: record['polarity'] for key, record in done.items() if key not in pending}
+        return committed, sorted(pending.values(), key=lambda record: record['seq'])
+
+    def checkpoint(self):
+        """Drop every resolved record once the tracked state has been persisted. Pending intents are kept."""
+        tmp_filename = self.filename + '.tmp'
+        pending = self.pending
+        with open(tmp_filename, 'w') as outfile:
+            for record in pending:
+                outfile.write(json.dumps(record) + '\n')
+            outfile.flush()
+            if self.fsync:
+                os.fsync(outfile.fileno())
+        self._file.close()
+        os.replace(tmp_filename, self.filename)
+        self._file = open(self.filename, 'a')
+        self.n_records = len(pending)
+
+    def close(self):
+        self._file.close()
+        if self._lock_fd is not None:
+            _unlock(self._lock_fd)
+            os.close(self._lock_fd)
+            self._lock_fd = None
@@ -1,17 +1,41 @@
 import serial
-import serial.tools.list_ports
 import time
 import json
 import socket
 import numpy as np
-import subprocess
 import os
 import logging
 
+# 'sim://' ports are served by the simulator, see protocol_sim.py
+if __package__ and __package__ not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append(__package__)
+
+# Commands that leave the board in the same state when they are sent twice: reads and register
+# writes. After a reconnection they are sent again, the others (pulses, resets, upgrades) are not.
+IDEMPOTENT_COMMANDS = {
+    '0': 'AS', '1': 'ABCDEFGHI', '2': 'ABCDEFG', '4': 'BCGIST', '5': 'BST', '6': 'OSU', '8': 'BST',
+    'W': 'CGST', 'Q': 'DGLR', **{port: 'CD' for port in 'ABCDEFGH'},
+}
+# Configuration registers, restored when the board was reset while the link was down
+CONFIGURATION_REGISTERS = {'0': 'AS', '1': 'ABCDEFG', '4': 'T', '5': 'ST', '6': 'OSU', '8': 'ST', 'W': 'T'}
+# Commands whose reply is the bare value, the others echo 'W:<module>:<cmd>:'
+PLAIN_REPLY_COMMANDS = {'2': 'ABDEF'}
+# Registers that are 0 after a reset, they aren't written again when their last value was 0
+ZERO_AFTER_RESET = ('1:', '4:T', '5:T', '8:T', 'W:T')
+
+
+class LabphoxTimeout(Exception):
+    pass
+
+
+class ConnectionLost(Exception):
+    pass
+
+
 class Labphox:
     _logger = logging.getLogger("libphox")
 
-    def __init__(self, port=None, debug=False, IP=None, cmd_logging=False, SN=None, HW_val=False):
+    def __init__(self, port=None, debug=False, IP=None, cmd_logging=False, SN=None, HW_val=False, TCP=False):
         self.debug = debug
         self.time_out = 5
 
@@ -31,17 +55,46 @@ class Labphox:
         self.N_channel = 0
 
         self.COM_port = None
+        self.PID = None
 
         self.ETH_HOST = None  # The server's IP address
         self.ETH_PORT = 7  # The port used by the server
         self.ETH_buff_size = 1024
+        # persistent connection of the TCP transport and the bytes received after the last reply
+        self.TCP_socket = None
+        self.TCP_buffer = b''
+        # UDP transport: idempotent commands are sent again when their reply doesn't come within the
+        # retransmission timeout, estimated from the round trip times as in TCP (RFC 6298)
+        self.UDP_socket = None
+        self.UDP_initial_rto_s = 0.25
+        self.UDP_min_rto_s = 0.005
+        self.UDP_max_rto_s = 2
+        self.UDP_rto_s = self.UDP_initial_rto_s
+        self.UDP_srtt_s = None
+        self.UDP_rttvar_s = None
+        self.UDP_statistics = {'sent': 0, 'retransmissions': 0, 'stale_replies': 0, 'timeouts': 0}
 
         self.communication_handler_sleep_time = 0
         self.packet_handler_sleep_time = 0
+
+        # a dropped link is reopened with exponential backoff, see reconnect()
+        self.auto_reconnect = True
+        self.reconnect_backoff_s = 0.05
+        self.reconnect_max_backoff_s = 2
+        self.reconnect_time_out = 30
+        self.reconnect_probe_time_out = 0.5
+        self.reconnect_hooks = []
+        self.reconnections = 0
+        self._reconnecting = False
+        # last value written to each configuration register, in write order
+        self.shadow = {}
         if IP:
-            self.USB_or_ETH = 2  # 1 for USB, 2 for ETH
+            self.USB_or_ETH = 3 if TCP else 2  # 1 for USB, 2 for ETH, 3 for ETH over TCP
             self.ETH_HOST = IP  # The server's IP address
             self.ETH_PORT = 7  # The port used by the server
+            if ':' in IP:
+                self.ETH_HOST, ETH_PORT = IP.rsplit(':', 1)
+                self.ETH_PORT = int(ETH_PORT)
             self.ETH_buff_size = 1024
         else:
             self.USB_or_ETH = 1  # 1 for USB, 2 for ETH
@@ -56,7 +109,8 @@ class Labphox:
                 # TODO
                 pass
             elif self.board_SN:
-                for device in serial.tools.list_ports.comports():
+                from serial.tools import list_ports
+                for device in list_ports.comports():
                     if device.pid == 1812:
                         try:
                             self.serial_com = serial.Serial(device.device)
@@ -71,7 +125,8 @@ class Labphox:
                             # print('Port' + str(device.device) + ' is already in use:', error)
 
             else:
-                for device in serial.tools.list_ports.comports():
+                from serial.tools import list_ports
+                for device in list_ports.comports():
                     if device.pid == 1812:
                         self.PID = device.pid
                         self.COM_port = device.device
@@ -80,7 +135,7 @@ class Labphox:
                                 print(i)
 
             try:
-                self.serial_com = serial.Serial(self.COM_port)
+                self.serial_com = serial.serial_for_url(self.COM_port)
 
                 self.board_info = ''
                 self.name = ''
@@ -92,9 +147,7 @@ class Labphox:
             except:
                 print('ERROR: Couldn\'t connect via serial')
 
-        elif self.USB_or_ETH == 2:
-            socket.setdefaulttimeout(self.time_out)
-
+        elif self.USB_or_ETH in (2, 3):
             self.board_info = ''
             self.name = ''
             self.board_SN = None
@@ -110,11 +163,130 @@ class Labphox:
             print("Board Firmware version and Software version are not up to date, Board FW=" + str(
                 self.board_FW) + " while SW=" + str(self.SW_version))
 
+    def candidate_ports(self):
+        # a board re-enumerated after a reset may come back on another port
+        ports = [self.COM_port]
+        if '://' not in str(self.COM_port):
+            from serial.tools import list_ports
+            ports += [device.device for device in list_ports.comports()
+                      if device.pid == 1812 and device.device != self.COM_port]
+        return ports
+
+    def reopen(self):
+        """Reopen the link and check that the board answering is the one with serial number board_SN.
+
+        Returns:
+            bool: True if the board was found.
+        """
+        time_out, self.time_out = self.time_out, self.reconnect_probe_time_out
+        try:
+            if self.USB_or_ETH != 1:
+                if self.USB_or_ETH == 3:
+                    self.TCP_disconnect()
+                return self.communication_handler('W:2:E:;', standard=False) == self.board_SN
+
+            for port in self.candidate_ports():
+                try:
+                    self.serial_com.close()
+                except (serial.SerialException, OSError, AttributeError):
+                    pass
+                try:
+                    self.serial_com = serial.serial_for_url(port)
+                    if self.USB_communication_handler(b'W:2:E:;') == self.board_SN:
+                        self.COM_port = port
+                        return True
+                except (LabphoxTimeout, OSError):
+                    continue
+            return False
+        finally:
+            self.time_out = time_out
+
+    def reconnect(self, error=None):
+        """Reopen a dropped link to the same board, retrying with exponential backoff.
+
+        The delay between attempts starts at reconnect_backoff_s and doubles up to
+        reconnect_max_backoff_s, ConnectionLost is raised after reconnect_time_out seconds. Once
+        the board answers, the reconnect_hooks are called to resume the session.
+
+        Returns:
+            int: number of attempts.
+        """
+        delay = self.reconnect_backoff_s
+        deadline = time.time() + self.reconnect_time_out
+        attempt = 0
+        self._reconnecting = True
+        try:
+            while True:
+                attempt += 1
+                try:
+                    if self.reopen():
+                        for hook in self.reconnect_hooks:
+                            hook()
+                        self.reconnections += 1
+                        return attempt
+                except (LabphoxTimeout, OSError) as reconnect_error:
+                    error = reconnect_error
+                if time.time() + delay > deadline:
+                    raise ConnectionLost(
+                        f'Couldn\'t reconnect to LabPhox SN {self.board_SN} after {attempt} attempts') from error
+                time.sleep(delay)
+                delay = min(2 * delay, self.reconnect_max_backoff_s)
+        finally:
+            self._reconnecting = False
+
+    def is_idempotent(self, encoded_cmd):
+        fields = encoded_cmd.decode().split(':')
+        return len(fields) > 2 and fields[2] in IDEMPOTENT_COMMANDS.get(fields[1], '')
+
+    def transaction(self, handler, encoded_cmd, *args):
+        # one command and its reply, the link is reopened when it drops and the command is sent
+        # again if that is safe
+        try:
+            return handler(encoded_cmd, *args)
+        except (LabphoxTimeout, OSError) as error:
+            if not self.auto_reconnect or self._reconnecting or not self.board_SN:
+                raise
+            print(f'WARNING: Link to LabPhox SN {self.board_SN} lost ({error}), reconnecting...')
+            self.reconnect(error)
+            if not self.is_idempotent(encoded_cmd):
+                raise ConnectionLost(
+                    f'{encoded_cmd.decode()} was interrupted by a reconnection and was not sent again') from error
+            return handler(encoded_cmd, *args)
+
+    def record_shadow(self, encoded_cmd):
+        fields = encoded_cmd.decode().strip(';').split(':')
+        if len(fields) == 4 and fields[2] in CONFIGURATION_REGISTERS.get(fields[1], ''):
+            register = fields[1] + ':' + fields[2]
+            self.shadow.pop(register, None)
+            self.shadow[register] = fields[3]
+
+    def restore_shadow(self, settle_s=None):
+        """Write the configuration registers of the shadow again, after the board was reset.
+
+        Args:
+            settle_s (dict, optional): seconds to wait after a register is written with a non-zero value,
+                keyed by register ('1:F'), e.g. for a supply to settle. Defaults to None.
+
+        Returns:
+            int: number of registers written.
+        """
+        restored = 0
+        for register, value in list(self.shadow.items()):
+            if value in ('', '0') and register.startswith(ZERO_AFTER_RESET):
+                continue
+            self.communication_handler('W:' + register + ':' + value + ';')
+            restored += 1
+            if settle_s and value not in ('', '0') and register in settle_s:
+                time.sleep(settle_s[register])
+        return restored
+
     def disconnect(self):
         if self.USB_or_ETH == 1:
             self.serial_com.close()
         elif self.USB_or_ETH == 2:
-            pass
+            self.UDP_close()
+        elif self.USB_or_ETH == 3:
+            self.TCP_disconnect()
 
     def input_buffer(self):
         return self.serial_com.inWaiting()
@@ -232,7 +404,7 @@ class Labphox:
                 end = True
 
             elif (time.time() - initial_time) > self.time_out:
-                raise Exception("LABPHOX time out exceeded", self.time_out, 's')
+                raise LabphoxTimeout("LABPHOX time out exceeded", self.time_out, 's')
 
         reply = reply.split(';')[0]
         response = {'reply': reply, 'command': reply.split(':')[:-2], 'value': reply.split(':')[-1]}
@@ -242,40 +414,172 @@ class Labphox:
 
         return response
 
+    def TCP_connect(self):
+        self.TCP_disconnect()
+        self.TCP_socket = socket.create_connection((self.ETH_HOST, self.ETH_PORT), timeout=self.time_out)
+        # commands are short and every one waits for its reply, don't let Nagle's algorithm hold them back
+        self.TCP_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def TCP_disconnect(self):
+        if self.TCP_socket is not None:
+            try:
+                self.TCP_socket.close()
+            finally:
+                self.TCP_socket = None
+        self.TCP_buffer = b''
+
+    def TCP_read_until(self, terminator):
+        # the stream carries no message boundaries, a reply ends at its terminator
+        initial_time = time.time()
+        while terminator not in self.TCP_buffer:
+            remaining = self.time_out - (time.time() - initial_time)
+            if remaining <= 0:
+                raise LabphoxTimeout("LABPHOX time out exceeded", self.time_out, 's')
+            self.TCP_socket.settimeout(remaining)
+            try:
+                packet = self.TCP_socket.recv(self.ETH_buff_size)
+            except socket.timeout:
+                raise LabphoxTimeout("LABPHOX time out exceeded", self.time_out, 's')
+            if not packet:
+                raise ConnectionResetError('LabPhox closed the TCP connection')
+            self.TCP_buffer += packet
+        end = self.TCP_buffer.index(terminator) + len(terminator)
+        frame, self.TCP_buffer = self.TCP_buffer[:end], self.TCP_buffer[end:]
+        return frame
+
+    def TCP_transaction(self, encoded_cmd, terminator):
+        if self.TCP_socket is None:
+            self.TCP_connect()
+        # bytes received after the previous terminator are kept, TCP_read_until looks at them first
+        try:
+            self.TCP_socket.sendall(encoded_cmd)
+            return self.TCP_read_until(terminator)
+        except (LabphoxTimeout, OSError):
+            # the position in the stream is unknown, the next command opens a new connection
+            self.TCP_disconnect()
+            raise
+
     def TCP_communication_handler(self, encoded_cmd=None):
+        frame = self.TCP_transaction(encoded_cmd, b';')
         reply = ''
-        with socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM) as TCP_connection:
-            TCP_connection.connect((self.ETH_HOST, self.ETH_PORT))
-            TCP_connection.sendall(encoded_cmd)
-            packet = TCP_connection.recv(self.ETH_buff_size)
-
         try:
-            reply += packet.decode()
-        except:
-            print('Invalid packet character', packet)
+            reply += frame[:-1].decode()
+        except UnicodeDecodeError:
+            print('Invalid packet character', frame)
 
-        reply = reply.split(';')[0]
         return reply
 
+    def UDP_open(self):
+        if self.UDP_socket is None:
+            self.UDP_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            # only datagrams from the board are received
+            self.UDP_socket.connect((self.ETH_HOST, self.ETH_PORT))
+        return self.UDP_socket
+
+    def UDP_close(self):
+        if self.UDP_socket is not None:
+            try:
+                self.UDP_socket.close()
+            finally:
+                self.UDP_socket = None
+
+    def UDP_flush(self):
+        # replies that arrived after their command gave up
+        self.UDP_socket.setblocking(False)
+        try:
+            while True:
+                self.UDP_socket.recv(self.ETH_buff_size)
+                self.UDP_statistics['stale_replies'] += 1
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.UDP_socket.setblocking(True)
+
+    def UDP_update_rto(self, rtt):
+        if self.UDP_srtt_s is None:
+            self.UDP_srtt_s, self.UDP_rttvar_s = rtt, rtt / 2
+        else:
+            self.UDP_rttvar_s = 0.75 * self.UDP_rttvar_s + 0.25 * abs(self.UDP_srtt_s - rtt)
+            self.UDP_srtt_s = 0.875 * self.UDP_srtt_s + 0.125 * rtt
+        self.UDP_rto_s = min(max(self.UDP_srtt_s + 4 * self.UDP_rttvar_s, self.UDP_min_rto_s), self.UDP_max_rto_s)
+
+    def reply_echo(self, encoded_cmd):
+        fields = encoded_cmd.split(b':')
+        if len(fields) < 4 or fields[2].decode() in PLAIN_REPLY_COMMANDS.get(fields[1].decode(), ''):
+            return None
+        return b':'.join(fields[:3]) + b':'
+
     def UDP_communication_handler(self, encoded_cmd=None):
-        reply = ''
-        with socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM) as UDP_connection:
-            UDP_connection.sendto(encoded_cmd, (self.ETH_HOST, self.ETH_PORT))
-            end = False
-            while not end:
-                # time.sleep(self.communication_handler_sleep_time)
-                packet = UDP_connection.recvfrom(self.ETH_buff_size)[0]
-                if b';' in packet:
-                    reply += packet.split(b';')[0].decode()
-                    end = True
+        """Send a command over UDP and wait for its reply.
+
+        Replies that don't echo the command are late replies to earlier commands and are dropped,
+        the board doesn't number its replies.
+        Idempotent commands are sent again when no reply came within the retransmission timeout,
+        which doubles with every retransmission. Only the replies to commands sent once update the
+        round trip time estimate (Karn's algorithm). LabphoxTimeout is raised after time_out seconds.
+        """
+        connection = self.UDP_open()
+        self.UDP_flush()
+        echo = self.reply_echo(encoded_cmd)
+        retransmit = self.is_idempotent(encoded_cmd)
+        rto = self.UDP_rto_s
+
+        sent_time = time.time()
+        deadline = sent_time + self.time_out
+        connection.send(encoded_cmd)
+        self.UDP_statistics['sent'] += 1
+        retransmissions = 0
+        received = b''
+        while True:
+            now = time.time()
+            if now >= deadline:
+                self.UDP_statistics['timeouts'] += 1
+                raise LabphoxTimeout("LABPHOX time out exceeded", self.time_out, 's')
+            next_retransmission = sent_time + rto if retransmit else deadline
+            if now >= next_retransmission:
+                rto = min(2 * rto, self.UDP_max_rto_s)
+                connection.send(encoded_cmd)
+                sent_time = time.time()
+                retransmissions += 1
+                self.UDP_statistics['sent'] += 1
+                self.UDP_statistics['retransmissions'] += 1
+                received = b''
+                continue
+
+            connection.settimeout(min(next_retransmission, deadline) - now)
+            try:
+                received += connection.recv(self.ETH_buff_size)
+            except socket.timeout:
+                continue
+            while b';' in received:
+                frame, received = received.split(b';', 1)
+                # replies of plain commands carry no echo, but the echoed replies of other commands are stale
+                if echo is not None:
+                    stale = not frame.startswith(echo)
                 else:
-                    try:
-                        reply += packet.decode()
-                    except:
-                        print('Invalid packet character', packet)
-                        break
-
-            return reply
+                    stale = frame.startswith(b'W:')
+                if stale:
+                    self.UDP_statistics['stale_replies'] += 1
+                    continue
+                if not retransmissions:
+                    self.UDP_update_rto(time.time() - sent_time)
+                try:
+                    return frame.decode()
+                except UnicodeDecodeError:
+                    print('Invalid packet character', frame)
+                    return ''
+
+    def link_statistics(self):
+        """Counters of the UDP transport and its round trip time estimate.
+
+        Returns:
+            dict: 'sent', 'retransmissions', 'stale_replies', 'timeouts', 'loss' (fraction of the sent
+                datagrams that had to be sent again), 'srtt_s', 'rto_s' and 'reconnections'.
+        """
+        statistics = dict(self.UDP_statistics)
+        statistics['loss'] = statistics['retransmissions'] / statistics['sent'] if statistics['sent'] else 0.0
+        statistics.update(srtt_s=self.UDP_srtt_s, rto_s=self.UDP_rto_s, reconnections=self.reconnections)
+        return statistics
 
     def USB_communication_handler(self, encoded_cmd=None):
         reply = ''
@@ -292,7 +596,7 @@ class Labphox:
                 end = True
 
             elif (time.time() - initial_time) > self.time_out:
-                raise Exception("LABPHOX time out exceeded", self.time_out, 's')
+                raise LabphoxTimeout("LABPHOX time out exceeded", self.time_out, 's')
 
         reply = reply.split(';')[0]
         return reply
@@ -312,13 +616,14 @@ class Labphox:
             encoded_cmd = cmd.encode()
 
         if self.USB_or_ETH == 1:
-            reply = self.USB_communication_handler(encoded_cmd)
+            reply = self.transaction(self.USB_communication_handler, encoded_cmd)
         elif self.USB_or_ETH == 2:
-            reply = self.UDP_communication_handler(encoded_cmd)
+            reply = self.transaction(self.UDP_communication_handler, encoded_cmd)
         elif self.USB_or_ETH == 3:
-            reply = self.TCP_communication_handler(encoded_cmd)
+            reply = self.transaction(self.TCP_communication_handler, encoded_cmd)
         else:
             raise Exception("Invalid communication options USB_or_ETH=", self.USB_or_ETH)
+        self.record_shadow(encoded_cmd)
 
         try:
             if standard:
@@ -362,35 +667,57 @@ class Labphox:
                 end = True
 
             elif (time.time() - initial_time) > self.time_out:
-                raise Exception("LABPHOX time out exceeded", self.time_out, 's')
+                raise LabphoxTimeout("LABPHOX time out exceeded", self.time_out, 's')
 
         reply = reply.replace(end_sequence, b'').replace(encoded_cmd, b'')
         return reply
 
     def UDP_packet_handler(self, encoded_cmd, end_sequence):
+        # a capture isn't idempotent, it is sent once and its datagrams are collected until the end sequence
+        connection = self.UDP_open()
+        self.UDP_flush()
+        deadline = time.time() + self.time_out
+        connection.send(encoded_cmd)
+        self.UDP_statistics['sent'] += 1
         reply = b''
-        with socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM) as s:
-            s.sendto(encoded_cmd, (self.ETH_HOST, self.ETH_PORT))
-            end = False
-            while not end:
-                time.sleep(self.packet_handler_sleep_time)
-                packet = s.recvfrom(self.ETH_buff_size)[0]
-                reply += packet
-                if end_sequence in reply[-5:]:
-                    end = True
+        end = False
+        while not end:
+            time.sleep(self.packet_handler_sleep_time)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.UDP_statistics['timeouts'] += 1
+                raise LabphoxTimeout("LABPHOX time out exceeded", self.time_out, 's')
+            connection.settimeout(remaining)
+            try:
+                packet = connection.recv(self.ETH_buff_size)
+            except socket.timeout:
+                continue
+            reply += packet
+            if end_sequence in reply[-5:]:
+                end = True
 
         reply = reply.replace(end_sequence, b'').replace(encoded_cmd, b'')
         return reply[7:]
 
+    def TCP_packet_handler(self, encoded_cmd, end_sequence):
+        reply = self.TCP_transaction(encoded_cmd, end_sequence)[:-len(end_sequence)]
+        if reply.startswith(encoded_cmd):
+            reply = reply[len(encoded_cmd):]
+        return reply
+
     def packet_handler(self, cmd, end_sequence=b'\x00\xff\x00\xff'):
         encoded_cmd = cmd.encode()
 
         if self.USB_or_ETH == 1:
-            reply = self.USB_packet_handler(encoded_cmd, end_sequence)
+            reply = self.transaction(self.USB_packet_handler, encoded_cmd, end_sequence)
             return reply
 
         elif self.USB_or_ETH == 2:
-            reply = self.UDP_packet_handler(encoded_cmd, end_sequence)
+            reply = self.transaction(self.UDP_packet_handler, encoded_cmd, end_sequence)
+            return reply
+
+        elif self.USB_or_ETH == 3:
+            reply = self.transaction(self.TCP_packet_handler, encoded_cmd, end_sequence)
             return reply
 
     def raise_value_mismatch(self, cmd, response):
@@ -465,7 +792,7 @@ class Labphox:
             ##self.serial_com.flushInput()
             ##response = self.communication_handler('W:3:T:' + str(value) + ';', standard=False)
             response = self.packet_handler('W:3:T:' + str(value) + ';')
-            return np.fromstring(response, dtype=np.uint8)
+            return np.frombuffer(response, dtype=np.uint8)
 
         elif self.compare_cmd(cmd, 'acquire'):
             response = self.communication_handler('W:3:Q:' + str(value) + ';')
@@ -674,6 +1001,8 @@ class Labphox:
         return response
 
     def FLASH_utils(self, path=None):
+        import subprocess
+
         DFU_name = '0483:df11'
         found = False
         process = subprocess.Popen(['.\Firmware\dfu-util', '-l'], shell=True,
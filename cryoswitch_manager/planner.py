@@ -0,0 +1,158 @@
+"""Bulk reconfiguration of several switches.
+
+A `PulsePlan` holds the minimal list of pulses bringing a set of switches from their
+known positions to target positions. The pulses are ordered so that:
+
+- all disconnect pulses of the 6x1 switches come first, followed by the pulses of the
+  2x2 switches, which need no guard time, and the 6x1 connect pulses come last, so that
+  the guard time of each 6x1 elapses while the other switches are pulsed;
+- within each group, pulses are grouped by controller, switch model and port, so that the
+  controller's switch model selection changes as little as possible.
+"""
+import time
+
+
+class PulseStep:
+    __slots__ = ('switch', 'contact', 'polarity', 'after_guard', 'last')
+
+    def __init__(self, switch, contact, polarity, after_guard=False, last=False):
+        """A single pulse of a plan.
+
+        Args:
+            switch (CryoSwitchConfig): switch to pulse.
+            contact (int): contact of the controller port to pulse.
+            polarity (int): 1 to connect, 0 to disconnect.
+            after_guard (bool, optional): the pulse must wait for the guard time of the switch's previous
+                disconnect pulse. Defaults to False.
+            last (bool, optional): last pulse of the switch, its position is reached afterwards. Defaults to False.
+        """
+        self.switch = switch
+        self.contact = contact
+        self.polarity = polarity
+        self.after_guard = after_guard
+        self.last = last
+
+    def __repr__(self):
+        action = 'connect' if self.polarity else 'disconnect'
+        return f'PulseStep({self.switch.name}: {action} {self.switch.controller_port[0]}-{self.contact})'
+
+
+def _group_key(step):
+    switch = step.switch
+    return (id(switch.controller), switch.switch_model, switch.controller_port[0], step.contact)
+
+
+def order_steps(steps):
+    """Order pulses to overlap guard times and group them by controller, model and port."""
+    unguarded = [step for step in steps if not step.after_guard]
+    guarded = [step for step in steps if step.after_guard]
+    # the disconnects of switches needing a guard time go first, then the switches without one
+    guard_switches = {id(step.switch) for step in guarded}
+    unguarded.sort(key=lambda step: (id(step.switch) not in guard_switches, _group_key(step)))
+    guarded.sort(key=_group_key)
+    return unguarded + guarded
+
+
+class PulsePlan:
+    def __init__(self, steps, targets, order=True):
+        """Pulses bringing switches to target positions.
+
+        Args:
+            steps (list[PulseStep]): pulses to send.
+            targets (dict): target position of every switch of the plan, keyed by switch.
+            order (bool, optional): reorder the steps with `order_steps`. Defaults to True.
+        """
+        self.steps = order_steps(steps) if order else list(steps)
+        self.targets = targets
+
+    @classmethod
+    def from_targets(cls, targets):
+        """Plan the minimal pulses bringing every switch to its target position.
+
+        Args:
+            targets (dict): target position keyed by switch (`CryoSwitchConfig`).
+
+        Returns:
+            PulsePlan: the ordered plan.
+        """
+        steps = []
+        for switch, position in targets.items():
+            steps.extend(switch.actuation_steps(position))
+        return cls(steps, targets)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return f'PulsePlan({len(self.steps)} pulses for {len(self.targets)} switches)'
+
+    def execute(self) -> dict:
+        """Send the pulses of the plan.
+
+        Returns:
+            dict: 'switches' maps each switch name to its report (initial and target position, number of pulses,
+                success), 'pulses' is the total number of pulses, 'model_changes' the number of switch model
+                selections and 'wall_time_s' the total duration.
+        """
+        start_time = time.monotonic()
+        report = {
+            switch.name: {'from': switch._position, 'to': position, 'pulses': 0, 'success': True}
+            for switch, position in self.targets.items()
+        }
+        disconnected = {}
+        failed = set()
+        model_changes = 0
+
+        for step in self.steps:
+            switch = step.switch
+            if switch in failed:
+                continue
+
+            switch.prepare_controller()
+            if switch.select_controller_model():
+                model_changes += 1
+
+            if step.after_guard and switch in disconnected:
+                switch.wait_guard_time(*disconnected[switch])
+
+            if step.polarity:
+                current_profile = switch.connect(step.contact)
+            else:
+                current_profile = switch.disconnect(step.contact)
+                disconnected[switch] = (current_profile, time.monotonic())
+            # verified actuations may have been retried
+            report[switch.name]['pulses'] += getattr(current_profile, 'metadata', {}).get('attempts', 1)
+
+            if not switch.actuated(current_profile):
+                failed.add(switch)
+                switch._position = None
+                report[switch.name]['success'] = False
+            elif step.last:
+                switch._position = self.targets[switch]
+
+        return {
+            'switches': report,
+            'pulses': sum(switch_report['pulses'] for switch_report in report.values()),
+            'model_changes': model_changes,
+            'wall_time_s': time.monotonic() - start_time,
+        }
+
+
+def merge_reports(reports, wall_time_s=None) -> dict:
+    """Combine the reports of plans executed in parallel, see `PulsePlan.execute`.
+
+    Args:
+        reports (list[dict]): reports of the plans.
+        wall_time_s (float, optional): total duration. Defaults to None, the duration of the longest plan.
+    """
+    if wall_time_s is None:
+        wall_time_s = max((report['wall_time_s'] for report in reports), default=0.0)
+    switches = {}
+    for report in reports:
+        switches.update(report['switches'])
+    return {
+        'switches': switches,
+        'pulses': sum(report['pulses'] for report in reports),
+        'model_changes': sum(report['model_changes'] for report in reports),
+        'wall_time_s': wall_time_s,
+    }
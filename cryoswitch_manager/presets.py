@@ -0,0 +1,106 @@
+"""Named routing presets compiled into cached pulse plans.
+
+A `RoutingPreset` is a named set of target positions. When compiled, the ordered
+`PulsePlan` reaching the preset is computed for every combination of starting
+positions of its switches (unknown included), so that activating the preset only
+looks up the plan matching the current positions. The switches of each controller
+get their own plans, which run independently of the other controllers. Controllers
+with more starting states than `MAX_COMPILED_PLANS` are compiled on first use of each
+starting state instead.
+"""
+import itertools
+
+from .planner import PulsePlan
+
+MAX_COMPILED_PLANS = 4096
+
+
+class RoutingPreset:
+    def __init__(self, name: str, targets: dict):
+        """Named target positions of a set of switches.
+
+        Args:
+            name (str): name of the preset, e.g. 'qubit_A_readout'.
+            targets (dict): target position keyed by switch (`CryoSwitchConfig`).
+        """
+        self.name = name
+        self.targets = dict(targets)
+        self._groups = {}
+        for switch in self.targets:
+            self._groups.setdefault(switch.controller, []).append(switch)
+        self._plans = {}
+        self._version = None
+        self._compiled = False
+
+    def __repr__(self):
+        targets = ', '.join(f'{switch.name}={position}' for switch, position in self.targets.items())
+        return f'RoutingPreset({self.name}: {targets})'
+
+    @property
+    def compiled(self) -> bool:
+        return self._compiled
+
+    @property
+    def controllers(self) -> list:
+        """Controllers of the preset's switches."""
+        return list(self._groups)
+
+    def start_state(self, controller) -> tuple:
+        """Current positions of the preset's switches on `controller`, the key of its compiled plans."""
+        return tuple(switch._position for switch in self._groups[controller])
+
+    def _build(self, controller, start_state) -> PulsePlan:
+        steps = []
+        switches = self._groups[controller]
+        for switch, start in zip(switches, start_state):
+            steps.extend(switch.plan_steps(start, self.targets[switch]))
+        return PulsePlan(steps, {switch: self.targets[switch] for switch in switches})
+
+    def compile(self, version=None, max_plans: int = MAX_COMPILED_PLANS) -> int:
+        """Compile the plans reaching the preset from every starting state.
+
+        Args:
+            version (optional): version of the switch list the preset is compiled against. Defaults to None.
+            max_plans (int, optional): compile a controller lazily when it has more starting states.
+                Defaults to MAX_COMPILED_PLANS.
+
+        Returns:
+            int: number of compiled plans.
+        """
+        for switch, position in self.targets.items():
+            switch.validate_position(position)
+        self._plans = {}
+        for controller, switches in self._groups.items():
+            start_states = [tuple(switch.positions) + (None,) for switch in switches]
+            n_plans = 1
+            for states in start_states:
+                n_plans *= len(states)
+            if n_plans <= max_plans:
+                for start_state in itertools.product(*start_states):
+                    self._plans[controller, start_state] = self._build(controller, start_state)
+        self._version = version
+        self._compiled = True
+        return len(self._plans)
+
+    def invalidate(self):
+        self._plans = {}
+        self._compiled = False
+
+    def plan(self, controller, version=None) -> PulsePlan:
+        """Compiled plan of a controller's switches reaching the preset from their current positions.
+
+        Args:
+            controller (Cryoswitch): controller of the switches.
+            version (optional): current version of the switch list, recompiles when it changed. Defaults to None.
+        """
+        if not self._compiled or self._version != version:
+            self.compile(version)
+        key = controller, self.start_state(controller)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = self._build(*key)
+        return plan
+
+    def plans(self, version=None) -> list[PulsePlan]:
+        """Compiled plans of every controller, see `plan`."""
+        return [self.plan(controller, version) for controller in self._groups]
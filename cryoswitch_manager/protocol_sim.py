@@ -0,0 +1,8 @@
+"""pyserial URL handler for 'sim://' ports, see `simulator.py`.
+
+pyserial looks the handler of a '<scheme>://' URL up as the module `protocol_<scheme>` of
+the packages in `serial.protocol_handler_packages`, `libphox` registers this package.
+"""
+from .simulator import SimulatorSerial as Serial
+
+__all__ = ['Serial']
@@ -0,0 +1,279 @@
+"""Batch analytics for archived pulse current profiles.
+
+The waveform log written by `Cryoswitch.log_waveform` keeps one JSON file per pulse.
+The functions in this module load many of those captures at once, align their rising
+edges and compute the pulse health metrics for all of them with vectorized NumPy, so
+that slowly degrading switches can be spotted from a per-switch trend table.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+METRICS = ('peak', 'rise_time_ms', 'plateau', 'charge_mC', 'dip_depth', 'dip_time_ms')
+
+
+def stack_profiles(profiles):
+    """Stack ragged current profiles into a zero padded 2D array.
+
+    Args:
+        profiles (list): current profiles in mA, one per pulse.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the (N, max_length) stacked profiles and the length of each profile.
+    """
+    lengths = np.fromiter((len(profile) for profile in profiles), dtype=np.intp, count=len(profiles))
+    width = int(lengths.max()) if len(lengths) else 0
+    stacked = np.zeros((len(profiles), width))
+    if width:
+        mask = np.arange(width) < lengths[:, None]
+        stacked[mask] = np.concatenate([np.asarray(profile, dtype=float) for profile in profiles])
+    return stacked, lengths
+
+
+def align_edges(stacked, lengths, threshold=0):
+    """Shift every profile so that its rising edge is at sample 0.
+
+    This is the vectorized version of the `np.argmax(current_profile > 0)` alignment
+    used by `Cryoswitch.plotting_function`.
+
+    Args:
+        stacked (np.ndarray): profiles as returned by `stack_profiles`.
+        lengths (np.ndarray): length of each profile.
+        threshold (float, optional): current in mA above which the pulse is considered started. Defaults to 0.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the aligned profiles and their remaining lengths.
+    """
+    n_profiles, width = stacked.shape
+    if not width:
+        return stacked.copy(), lengths.copy()
+    above = stacked > threshold
+    edges = np.where(above.any(axis=1), above.argmax(axis=1), 0)
+    index = edges[:, None] + np.arange(width)
+    aligned = np.take_along_axis(stacked, np.minimum(index, width - 1), axis=1)
+    aligned[index >= lengths[:, None]] = 0
+    return aligned, lengths - edges
+
+
+def pulse_metrics(aligned, sampling_freq, threshold=0):
+    """Compute the health metrics of edge aligned current profiles.
+
+    Args:
+        aligned (np.ndarray): (N, M) edge aligned profiles in mA.
+        sampling_freq (float | np.ndarray): sampling frequency in Hz, scalar or one per profile.
+        threshold (float, optional): current in mA above which the coil is considered driven. Defaults to 0.
+
+    Returns:
+        dict[str, np.ndarray]: one array of N values per entry of `METRICS`:
+            peak (mA), rise_time_ms (10-90% of peak), plateau (mA, level before the falling edge),
+            charge_mC (integrated current), dip_depth (mA, armature-motion dip below the running maximum)
+            and dip_time_ms (time of the deepest dip).
+    """
+    n_profiles, width = aligned.shape
+    sampling_freq = np.broadcast_to(np.asarray(sampling_freq, dtype=float), (n_profiles,))
+    if not width:
+        return {metric: np.zeros(n_profiles) for metric in METRICS}
+
+    columns = np.arange(width)
+    peak = aligned.max(axis=1)
+
+    i10 = np.argmax(aligned >= 0.1 * peak[:, None], axis=1)
+    i90 = np.argmax(aligned >= 0.9 * peak[:, None], axis=1)
+    rise_time_ms = (i90 - i10) / sampling_freq * 1000
+
+    # the last driven sample bounds the window where the plateau is measured
+    above = aligned > threshold
+    end = np.where(above.any(axis=1), width - 1 - np.argmax(above[:, ::-1], axis=1), 0)
+    window = (columns >= (0.6 * end)[:, None]) & (columns <= (0.85 * end)[:, None])
+    counts = window.sum(axis=1)
+    plateau = np.where(counts > 0, (aligned * window).sum(axis=1) / np.maximum(counts, 1), peak)
+
+    charge_mC = aligned.sum(axis=1) / sampling_freq
+
+    # the armature motion shows up as a dip below the running maximum before the falling edge
+    falling = width - 1 - np.argmax((aligned >= 0.9 * plateau[:, None])[:, ::-1], axis=1)
+    drawdown = np.maximum.accumulate(aligned, axis=1) - aligned
+    drawdown[columns >= falling[:, None]] = 0
+    dip_index = drawdown.argmax(axis=1)
+    dip_depth = drawdown[np.arange(n_profiles), dip_index]
+    dip_time_ms = dip_index / sampling_freq * 1000
+
+    return {
+        'peak': peak,
+        'rise_time_ms': rise_time_ms,
+        'plateau': plateau,
+        'charge_mC': charge_mC,
+        'dip_depth': dip_depth,
+        'dip_time_ms': dip_time_ms,
+    }
+
+
+def analyze_profiles(profiles, sampling_freq, threshold=0):
+    """Stack, align and compute the metrics of many current profiles at once.
+
+    Args:
+        profiles (list): current profiles in mA.
+        sampling_freq (float | np.ndarray): sampling frequency in Hz, scalar or one per profile.
+        threshold (float, optional): edge detection threshold in mA. Defaults to 0.
+
+    Returns:
+        dict[str, np.ndarray]: see `pulse_metrics`.
+    """
+    stacked, lengths = stack_profiles(profiles)
+    aligned, _ = align_edges(stacked, lengths, threshold=threshold)
+    return pulse_metrics(aligned, sampling_freq, threshold=threshold)
+
+
+def find_waveform_files(directory):
+    """List every waveform log file below `directory`, sorted by path."""
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith('.json'))
+    return sorted(paths)
+
+
+def load_waveforms(paths):
+    """Load waveform log files, skipping the ones that can't be parsed."""
+    waveforms = []
+    for path in paths:
+        try:
+            with open(path) as file:
+                waveform = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if waveform.get('data'):
+            waveforms.append(waveform)
+    return waveforms
+
+
+def _analyze_chunk(paths):
+    waveforms = load_waveforms(paths)
+    if not waveforms:
+        return []
+    sampling_freq = np.array([waveform['SF'] for waveform in waveforms], dtype=float)
+    metrics = analyze_profiles([waveform['data'] for waveform in waveforms], sampling_freq)
+
+    records = []
+    for idx, waveform in enumerate(waveforms):
+        record = {
+            'time': waveform['time'],
+            'SN': waveform.get('SN'),
+            'port': waveform['port'],
+            'contact': waveform['contact'],
+            'polarity': waveform['polarity'],
+            'voltage': waveform['voltage'],
+        }
+        for metric in METRICS:
+            record[metric] = float(metrics[metric][idx])
+        records.append(record)
+    return records
+
+
+def analyze_archive(directory, processes=None, chunk_size=2000):
+    """Compute the pulse metrics of every capture in a waveform log directory.
+
+    Large archives are split in chunks of `chunk_size` files that are analyzed in a
+    process pool. On Windows the calling script must be protected by an
+    `if __name__ == "__main__":` guard for the pool to start.
+
+    Args:
+        directory (str): waveform log directory, e.g. `Cryoswitch.log_wav_dir`.
+        processes (int, optional): number of worker processes, 1 disables the pool. Defaults to the CPU count.
+        chunk_size (int, optional): number of files per worker task. Defaults to 2000.
+
+    Returns:
+        list[dict]: one record per pulse, sorted by time, with the pulse metadata and metrics.
+    """
+    paths = find_waveform_files(directory)
+    chunks = [paths[idx:idx + chunk_size] for idx in range(0, len(paths), chunk_size)]
+
+    records = []
+    if processes == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            records.extend(_analyze_chunk(chunk))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for chunk_records in pool.map(_analyze_chunk, chunks):
+                records.extend(chunk_records)
+
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+def trend_table(records, window=20, degradation_threshold=0.1):
+    """Summarize pulse metrics per switch contact and flag degrading ones.
+
+    The first and last `window` pulses of every (SN, port, contact, polarity) are
+    compared, a drop of the peak current or of the armature dip larger than
+    `degradation_threshold` marks the contact as degrading.
+
+    Args:
+        records (list[dict]): records as returned by `analyze_archive`.
+        window (int, optional): number of pulses used for the baseline and recent medians. Defaults to 20.
+        degradation_threshold (float, optional): relative drop considered as degradation. Defaults to 0.1.
+
+    Returns:
+        list[dict]: one row per switch contact, degrading contacts first.
+    """
+    groups = {}
+    for record in records:
+        key = (record['SN'], record['port'], record['contact'], record['polarity'])
+        groups.setdefault(key, []).append(record)
+
+    rows = []
+    for (SN, port, contact, polarity), group in groups.items():
+        group.sort(key=lambda record: record['time'])
+        times = np.array([record['time'] for record in group])
+        peak = np.array([record['peak'] for record in group])
+        dip = np.array([record['dip_depth'] for record in group])
+        rise = np.array([record['rise_time_ms'] for record in group])
+
+        peak_change = _relative_change(peak, window)
+        dip_change = _relative_change(dip, window)
+        if len(group) > 1 and times[-1] > times[0]:
+            peak_slope = np.polyfit((times - times[0]) / 86400, peak, 1)[0]
+        else:
+            peak_slope = 0.0
+
+        rows.append({
+            'SN': SN,
+            'port': port,
+            'contact': contact,
+            'polarity': polarity,
+            'pulses': len(group),
+            'first': float(times[0]),
+            'last': float(times[-1]),
+            'peak': float(np.median(peak[-window:])),
+            'peak_change': peak_change,
+            'peak_slope_per_day': float(peak_slope),
+            'rise_time_ms': float(np.median(rise[-window:])),
+            'dip_depth': float(np.median(dip[-window:])),
+            'dip_change': dip_change,
+            'degrading': peak_change < -degradation_threshold or dip_change < -degradation_threshold,
+        })
+
+    rows.sort(key=lambda row: (not row['degrading'], row['peak_change']))
+    return rows
+
+
+def _relative_change(values, window):
+    baseline = np.median(values[:window])
+    if len(values) <= window or baseline == 0:
+        return 0.0
+    return float(np.median(values[-window:]) / baseline - 1)
+
+
+def print_trend_table(rows):
+    """Print a trend table as returned by `trend_table`."""
+    print(f"{'SN':>12} {'Switch':>8} {'Pulses':>7} {'Last pulse':>17} {'Peak mA':>8} {'dPeak':>7} {'Dip mA':>7} {'dDip':>7}")
+    for row in rows:
+        direction = 'C' if row['polarity'] else 'D'
+        switch = f"{row['port']}-{row['contact']}{direction}"
+        last = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['last']))
+        warning = '  *Warnings: Degrading!' if row['degrading'] else ''
+        print(f"{str(row['SN']):>12} {switch:>8} {row['pulses']:>7} {last:>17} {row['peak']:>8.1f} "
+              f"{row['peak_change']:>+7.1%} {row['dip_depth']:>7.1f} {row['dip_change']:>+7.1%}{warning}")
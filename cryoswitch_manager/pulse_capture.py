@@ -0,0 +1,133 @@
+"""Compact representation of a captured pulse current profile.
+
+The controller samples the coil current with an 8 bit ADC. `PulseCapture` keeps that
+raw uint8 buffer together with the ADC to mA gain and only produces the scaled
+values when they are asked for, which keeps long sessions 8x smaller than storing
+float64 arrays. It behaves like a NumPy array of mA values, so `capture.max()`,
+`capture / 1000`, `capture > 0`, `capture[edge:]` or `plt.plot(capture)` keep working.
+"""
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+
+class PulseCapture(NDArrayOperatorsMixin):
+    __slots__ = ('raw', 'gain', 'sampling_freq', 'metadata', 'cache_enabled', '_cache')
+
+    def __init__(self, raw, gain, sampling_freq, metadata=None, cache=False):
+        """Captured pulse.
+
+        Args:
+            raw (np.ndarray | bytes): raw ADC samples.
+            gain (float): mA per ADC code, see `Cryoswitch.get_current_gain`.
+            sampling_freq (float): sampling frequency in Hz.
+            metadata (dict, optional): information about the pulse (time, SN, port, contact, ...). Defaults to None.
+            cache (bool, optional): keep the scaled mA values once computed. Defaults to False.
+        """
+        if isinstance(raw, (bytes, bytearray, memoryview)):
+            raw = np.frombuffer(raw, dtype=np.uint8)
+        self.raw = np.asarray(raw, dtype=np.uint8)
+        self.gain = gain
+        self.sampling_freq = sampling_freq
+        self.metadata = metadata if metadata is not None else {}
+        self.cache_enabled = cache
+        self._cache = None
+
+    @property
+    def mA(self) -> np.ndarray:
+        """Current profile in mA."""
+        if self._cache is not None:
+            return self._cache
+        values = self.raw * self.gain
+        if self.cache_enabled:
+            values.flags.writeable = False
+            self._cache = values
+        return values
+
+    @property
+    def A(self) -> np.ndarray:
+        """Current profile in A."""
+        return self.mA / 1000
+
+    def cache(self, enabled=True):
+        """Enable or disable keeping the scaled values in memory."""
+        self.cache_enabled = enabled
+        if not enabled:
+            self._cache = None
+
+    def time_axis(self) -> np.ndarray:
+        """Sample times in seconds."""
+        return np.arange(self.raw.size) / self.sampling_freq
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.mA
+        if dtype is not None:
+            values = values.astype(dtype, copy=False)
+        if copy:
+            values = values.copy()
+        return values
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(value.mA if isinstance(value, PulseCapture) else value for value in inputs)
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(value.mA if isinstance(value, PulseCapture) else value for value in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __len__(self):
+        return self.raw.size
+
+    def __getitem__(self, key):
+        return np.multiply(self.raw[key], self.gain)
+
+    def __iter__(self):
+        return iter(self.mA)
+
+    def __repr__(self):
+        return f'PulseCapture({self.raw.size} samples, gain={self.gain:.4g} mA/code, SF={self.sampling_freq}Hz)'
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def size(self):
+        return self.raw.size
+
+    @property
+    def dtype(self):
+        return np.dtype(float)
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes
+
+    # reductions are computed on the raw codes when called without NumPy's optional arguments
+    def max(self, *args, **kwargs):
+        if args or any(value is not None for value in kwargs.values()):
+            return self.mA.max(*args, **kwargs)
+        return float(self.raw.max() * self.gain) if self.raw.size else 0.0
+
+    def min(self, *args, **kwargs):
+        if args or any(value is not None for value in kwargs.values()):
+            return self.mA.min(*args, **kwargs)
+        return float(self.raw.min() * self.gain) if self.raw.size else 0.0
+
+    def argmax(self, *args, **kwargs):
+        if args or any(value is not None for value in kwargs.values()):
+            return self.mA.argmax(*args, **kwargs)
+        return int(self.raw.argmax())
+
+    def sum(self, *args, **kwargs):
+        if args or any(value is not None for value in kwargs.values()):
+            return self.mA.sum(*args, **kwargs)
+        return float(self.raw.sum(dtype=np.int64) * self.gain)
+
+    def mean(self, *args, **kwargs):
+        if args or any(value is not None for value in kwargs.values()):
+            return self.mA.mean(*args, **kwargs)
+        return float(self.raw.mean() * self.gain)
+
+    def tolist(self):
+        return self.mA.tolist()
+
+    def to_bytes(self):
+        return self.raw.tobytes()
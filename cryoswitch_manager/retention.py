@@ -0,0 +1,303 @@
+"""Retention policies for the waveform and pulse logs.
+
+Waveform captures are stored sharded by controller SN and date
+(`data/<SN>/<YYYY-MM-DD>/<timestamp>_...json`). A `LogCompactor` thread applies the
+`RetentionPolicy` in the background: old captures are decimated unless they were
+flagged as anomalous, captures past the maximum age are deleted and the oldest ones
+are evicted once the directory exceeds its size budget. The pulse log is trimmed the
+same way. Compaction is only ever requested by the pulse path, never waited for.
+
+Retention deletes and decimates data for good, so it is opt-in
+(`Cryoswitch.enable_log_retention`). Controllers sharing a log directory share one
+compactor and one pulse log lock (`shared_compactor`, `pulse_log_lock`). These are
+shared within a process only: several processes may prune the same waveform directory,
+a file already deleted by another one is skipped, but the pulse log should be trimmed
+by a single process, as a line appended by another process while the trimmed log is
+swapped in is lost.
+
+A decimated waveform keeps the mean of each block in 'data', so that the charge
+integrated from it is unchanged, and the maximum of each block in 'peak'.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+ANOMALOUS_SUFFIX = '_anomalous'
+
+# one lock per pulse log and one compactor per log directory, shared by the controllers of the process
+_pulse_log_locks = {}
+_compactors = {}
+_shared_guard = threading.Lock()
+
+
+def pulse_log_lock(filename):
+    """Lock held while appending to a pulse log, the same one for every controller logging to the file."""
+    with _shared_guard:
+        return _pulse_log_locks.setdefault(os.path.abspath(filename), threading.Lock())
+
+
+class RetentionPolicy:
+    def __init__(
+        self, max_size_MB=1000, max_age_days=None, full_resolution_days=30, decimation=8,
+        max_pulse_log_MB=50, max_pulse_log_age_days=None, min_interval_s=60
+    ):
+        """Limits applied to the logs by the `LogCompactor`.
+
+        Args:
+            max_size_MB (float, optional): size budget of the waveform directory, None for unbounded. Defaults to 1000.
+            max_age_days (float, optional): waveforms older than this are deleted, None to keep them. Defaults to None.
+            full_resolution_days (float, optional): non-anomalous waveforms older than this are decimated,
+                None to keep everything at full resolution. Defaults to 30.
+            decimation (int, optional): decimation factor of old waveforms. Defaults to 8.
+            max_pulse_log_MB (float, optional): size budget of the pulse log, None for unbounded. Defaults to 50.
+            max_pulse_log_age_days (float, optional): pulse log entries older than this are dropped. Defaults to None.
+            min_interval_s (float, optional): minimum time between two compaction runs. Defaults to 60.
+        """
+        self.max_size_MB = max_size_MB
+        self.max_age_days = max_age_days
+        self.full_resolution_days = full_resolution_days
+        self.decimation = decimation
+        self.max_pulse_log_MB = max_pulse_log_MB
+        self.max_pulse_log_age_days = max_pulse_log_age_days
+        self.min_interval_s = min_interval_s
+
+
+def waveform_path(log_wav_dir, SN, timestamp, name):
+    """Sharded location of a waveform file, the shard directory is created if needed."""
+    shard = os.path.join(log_wav_dir, str(SN), time.strftime('%Y-%m-%d', time.localtime(timestamp)))
+    os.makedirs(shard, exist_ok=True)
+    return os.path.join(shard, name)
+
+
+def decimate_peak(data, factor):
+    """Decimate a profile keeping the maximum of each block, so that peaks survive."""
+    return [max(data[idx:idx + factor]) for idx in range(0, len(data), factor)]
+
+
+def decimate_mean(data, factor):
+    """Decimate a profile keeping the mean of each block, so that its integral survives.
+
+    A shorter last block is divided by the factor too, its samples keep their share of the integral.
+    """
+    return [sum(data[idx:idx + factor]) / factor for idx in range(0, len(data), factor)]
+
+
+def _scan_waveforms(log_wav_dir):
+    entries = []
+    for root, _, files in os.walk(log_wav_dir):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                timestamp = int(name.split('_')[0])
+                size = os.path.getsize(path)
+            except (ValueError, OSError):
+                continue
+            entries.append([timestamp, path, size, name.endswith(ANOMALOUS_SUFFIX + '.json')])
+    return entries
+
+
+def _decimate_file(path, factor):
+    with open(path) as file:
+        waveform = json.load(file)
+    if waveform.get('decimation', 1) > 1 or not waveform.get('data'):
+        return os.path.getsize(path)
+
+    waveform['peak'] = decimate_peak(waveform['data'], factor)
+    waveform['data'] = decimate_mean(waveform['data'], factor)
+    waveform['SF'] = waveform['SF'] / factor
+    waveform['decimation'] = factor
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as outfile:
+        json.dump(waveform, outfile, sort_keys=True)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def compact_waveforms(log_wav_dir, policy, now=None):
+    """Apply a retention policy to a waveform directory.
+
+    Returns:
+        dict: number of decimated and deleted files and the remaining size in bytes.
+    """
+    if now is None:
+        now = time.time()
+    entries = _scan_waveforms(log_wav_dir)
+    decimated = 0
+    deleted = 0
+
+    if policy.max_age_days is not None:
+        cutoff = now - policy.max_age_days * 86400
+        for entry in [entry for entry in entries if entry[0] < cutoff]:
+            with contextlib.suppress(FileNotFoundError):  # pruned by another process
+                os.remove(entry[1])
+            entries.remove(entry)
+            deleted += 1
+
+    if policy.full_resolution_days is not None and policy.decimation > 1:
+        cutoff = now - policy.full_resolution_days * 86400
+        for entry in entries:
+            if entry[0] < cutoff and not entry[3]:
+                try:
+                    new_size = _decimate_file(entry[1], policy.decimation)
+                except (OSError, ValueError):
+                    continue
+                if new_size != entry[2]:
+                    entry[2] = new_size
+                    decimated += 1
+
+    total_size = sum(entry[2] for entry in entries)
+    if policy.max_size_MB is not None:
+        budget = policy.max_size_MB * 1e6
+        # evict the oldest regular captures first, anomalous ones only when nothing else is left
+        for entry in sorted(entries, key=lambda entry: (entry[3], entry[0])):
+            if total_size <= budget:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry[1])
+            total_size -= entry[2]
+            deleted += 1
+
+    if deleted:
+        from .waveform_index import prune_indexes
+        prune_indexes(log_wav_dir)
+    _remove_empty_shards(log_wav_dir)
+    return {'decimated': decimated, 'deleted': deleted, 'size': total_size}
+
+
+def _remove_empty_shards(log_wav_dir):
+    for root, dirs, files in os.walk(log_wav_dir, topdown=False):
+        if root != log_wav_dir and not dirs and not files:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+
+def _pulse_timestamp(line):
+    try:
+        return int(line.split('Timestamp:')[1].split('*')[0].strip())
+    except (IndexError, ValueError):
+        return None
+
+
+def compact_pulse_log(filename, policy, lock, now=None):
+    """Trim the pulse log to the policy's age and size limits.
+
+    `lock` must be the lock held by the writer of the log while appending, it is only
+    taken to pick up the lines appended during the trim and swap the file.
+    """
+    if now is None:
+        now = time.time()
+    if not os.path.isfile(filename):
+        return 0
+    with open(filename, 'rb') as logging_file:
+        content = logging_file.read()
+    lines = content.splitlines(keepends=True)
+    n_lines = len(lines)
+
+    if policy.max_pulse_log_age_days is not None:
+        cutoff = now - policy.max_pulse_log_age_days * 86400
+        lines = [line for line in lines if (_pulse_timestamp(line.decode(errors='replace')) or now) >= cutoff]
+
+    if policy.max_pulse_log_MB is not None:
+        budget = int(policy.max_pulse_log_MB * 1e6)
+        size = sum(len(line) for line in lines)
+        start = 0
+        while size > budget and start < len(lines):
+            size -= len(lines[start])
+            start += 1
+        lines = lines[start:]
+
+    dropped = n_lines - len(lines)
+    if not dropped:
+        return 0
+
+    tmp_filename = filename + '.tmp'
+    with lock:
+        with open(filename, 'rb') as logging_file:
+            logging_file.seek(len(content))
+            appended = logging_file.read()
+        with open(tmp_filename, 'wb') as outfile:
+            outfile.writelines(lines)
+            outfile.write(appended)
+        os.replace(tmp_filename, filename)
+    return dropped
+
+
+class LogCompactor(threading.Thread):
+    def __init__(self, log_wav_dir, pulse_logging_filename, policy, pulse_logging_lock):
+        """Background thread applying a `RetentionPolicy` to the waveform and pulse logs.
+
+        Args:
+            log_wav_dir (str): waveform directory, None if waveforms are not logged.
+            pulse_logging_filename (str): pulse log file, None if pulses are not logged.
+            policy (RetentionPolicy): limits to apply.
+            pulse_logging_lock (threading.Lock): lock held while appending to the pulse log.
+        """
+        super().__init__(name='LogCompactor', daemon=True)
+        self.log_wav_dir = log_wav_dir
+        self.pulse_logging_filename = pulse_logging_filename
+        self.policy = policy
+        self.pulse_logging_lock = pulse_logging_lock
+        self.last_run = 0
+        self.last_result = None
+        self._requested = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self):
+        """Request a compaction run, returns immediately."""
+        self._requested.set()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def stop(self):
+        self._stopped.set()
+        self._requested.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._requested.wait()
+            wait_time = self.last_run + self.policy.min_interval_s - time.time()
+            if wait_time > 0 and self._stopped.wait(wait_time):
+                break
+            self._requested.clear()
+            self.last_run = time.time()
+            try:
+                self.compact()
+            except Exception as error:
+                print(f'WARNING: Log compaction failed: {error}')
+
+    def compact(self):
+        result = {}
+        if self.log_wav_dir and os.path.isdir(self.log_wav_dir):
+            result = compact_waveforms(self.log_wav_dir, self.policy)
+        if self.pulse_logging_filename:
+            result['pulse_log_dropped'] = compact_pulse_log(
+                self.pulse_logging_filename, self.policy, self.pulse_logging_lock
+            )
+        self.last_result = result
+        return result
+
+
+def shared_compactor(log_wav_dir, pulse_logging_filename, policy):
+    """The running compactor of a waveform directory and pulse log, started if there is none.
+
+    Compactors of the same logs would race on deletes, decimation and the pulse log swap, so the
+    controllers sharing them share one compactor, applying the policy of the first one.
+    """
+    key = tuple(os.path.abspath(path) if path else None for path in (log_wav_dir, pulse_logging_filename))
+    with _shared_guard:
+        compactor = _compactors.get(key)
+        if compactor is None or compactor.stopped:
+            lock = _pulse_log_locks.setdefault(key[1], threading.Lock()) if key[1] else None
+            compactor = _compactors[key] = LogCompactor(log_wav_dir, pulse_logging_filename, policy, lock)
+            compactor.start()
+    compactor.notify()
+    return compactor
@@ -0,0 +1,182 @@
+"""Signal paths through cascaded switches.
+
+The terminals of the switches ('<switch>:<terminal>', e.g. 'switch_A_6x1:C') are the
+nodes of a graph. Cables between terminals are declared once as links, and every
+switch connects pairs of its own terminals depending on its position. Following
+links and switch connections from a terminal gives the signal path it is part of.
+
+`RoutingGraph` keeps the signal path of every terminal in an index that is updated
+when a switch changes position, only for the paths going through that switch, so
+that `path_of` is a dictionary lookup. `route` finds the switch positions connecting
+two terminals with the fewest pulses.
+"""
+import heapq
+import itertools
+import threading
+
+
+class RoutingGraph:
+    def __init__(self, switches, links=(), endpoints=None):
+        """Connectivity graph over the terminals of a set of switches.
+
+        Args:
+            switches (list[CryoSwitchConfig]): switches of the graph.
+            links (list[tuple[str, str]], optional): cables between terminals, e.g.
+                [('switch_A_6x1:C', 'input_switch_A_2x2:1')]. Defaults to ().
+            endpoints (dict, optional): names of the terminals where instruments or devices are connected, e.g.
+                {'VNA_out': 'input_switch_A_2x2:2', 'qubit_A': 'switch_A_6x1:3'}. Defaults to None.
+
+        Raises:
+            ValueError: Error is raised when a terminal is unknown or linked twice.
+        """
+        self.switches = {switch.name: switch for switch in switches}
+        self.endpoints = dict(endpoints or {})
+        self._aliases = {terminal: name for name, terminal in self.endpoints.items()}
+        self._external = {}
+        for link in links:
+            a, b = (self.terminal(terminal) for terminal in link)
+            for terminal in (a, b):
+                if terminal in self._external:
+                    raise ValueError(f"Terminal {terminal} is linked more than once.")
+            self._external[a] = b
+            self._external[b] = a
+
+        self._internal = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+        for switch in switches:
+            self._connect_switch(switch)
+        for terminal in self.terminals():
+            if terminal not in self._paths:
+                self._index_path(terminal)
+
+    def terminals(self):
+        for switch in self.switches.values():
+            for terminal in switch.terminals:
+                yield f'{switch.name}:{terminal}'
+
+    def terminal(self, name: str) -> str:
+        """Resolve an endpoint name or a '<switch>:<terminal>' string to a terminal.
+
+        Raises:
+            ValueError: Error is raised when the terminal is unknown.
+        """
+        terminal = self.endpoints.get(name, name)
+        switch_name, _, switch_terminal = terminal.rpartition(':')
+        switch = self.switches.get(switch_name)
+        if switch is None or switch_terminal not in switch.terminals:
+            raise ValueError(f"Unknown terminal {name}.")
+        return terminal
+
+    def _connect_switch(self, switch):
+        for terminal in switch.terminals:
+            self._internal.pop(f'{switch.name}:{terminal}', None)
+        if switch._position is not None:
+            for a, b in switch.internal_links(switch._position):
+                self._internal[f'{switch.name}:{a}'] = f'{switch.name}:{b}'
+                self._internal[f'{switch.name}:{b}'] = f'{switch.name}:{a}'
+
+    def _neighbors(self, terminal):
+        return [node for node in (self._internal.get(terminal), self._external.get(terminal)) if node is not None]
+
+    def _index_path(self, terminal):
+        # every terminal has at most one cable and one switch connection, so paths are chains:
+        # walk to one end, then collect the chain from there
+        previous, end = None, terminal
+        while True:
+            following = [node for node in self._neighbors(end) if node != previous]
+            if not following or following[0] == terminal:
+                break
+            previous, end = end, following[0]
+        path, previous = [end], None
+        while True:
+            following = [node for node in self._neighbors(path[-1]) if node != previous]
+            if not following or following[0] == path[0]:
+                break
+            previous = path[-1]
+            path.append(following[0])
+        path = tuple(path)
+        for node in path:
+            self._paths[node] = path
+
+    def update(self, switch):
+        """Update the index after `switch` changed position, re-walking only the paths through it."""
+        with self._lock:
+            affected = set()
+            for terminal in switch.terminals:
+                affected.update(self._paths.get(f'{switch.name}:{terminal}', ()))
+            self._connect_switch(switch)
+            for terminal in affected:
+                self._paths.pop(terminal, None)
+            for terminal in affected:
+                if terminal not in self._paths:
+                    self._index_path(terminal)
+
+    def path_of(self, name: str) -> tuple:
+        """Signal path `name` is part of with the current switch positions, starting from `name` when it's an end.
+
+        Args:
+            name (str): endpoint name or '<switch>:<terminal>'.
+
+        Returns:
+            tuple[str]: terminals of the path, endpoint names replacing their terminal.
+        """
+        terminal = self.terminal(name)
+        with self._lock:
+            path = self._paths[terminal]
+        if path[-1] == terminal:
+            path = path[::-1]
+        return tuple(self._aliases.get(node, node) for node in path)
+
+    def route(self, src: str, dst: str) -> dict:
+        """Switch positions connecting two terminals with the fewest pulses.
+
+        Args:
+            src (str): endpoint name or '<switch>:<terminal>'.
+            dst (str): endpoint name or '<switch>:<terminal>'.
+
+        Returns:
+            dict: 'positions' maps the name of every switch on the path to its required position, 'pulses' is
+                the number of pulses needed from the current positions and 'path' the terminals of the route.
+
+        Raises:
+            ValueError: Error is raised when the terminals can't be connected.
+        """
+        src, dst = self.terminal(src), self.terminal(dst)
+        counter = itertools.count()
+        # entries: (pulses, hops, tie breaker, terminal, next hop is external, positions, path)
+        queue = [(0, 0, next(counter), src, None, (), (src,))]
+        settled = set()
+        while queue:
+            pulses, hops, _, terminal, external, positions, path = heapq.heappop(queue)
+            if terminal == dst:
+                return {
+                    'positions': dict(positions),
+                    'pulses': pulses,
+                    'path': tuple(self._aliases.get(node, node) for node in path),
+                }
+            used = frozenset(name for name, _ in positions)
+            key = (terminal, external, used)
+            if key in settled:
+                continue
+            settled.add(key)
+
+            if external is not False and terminal in self._external:
+                following = self._external[terminal]
+                if following.rpartition(':')[0] not in used:
+                    heapq.heappush(queue, (pulses, hops + 1, next(counter), following, False, positions,
+                                           path + (following,)))
+            if external is not True:
+                switch_name, _, switch_terminal = terminal.rpartition(':')
+                if switch_name in used:
+                    continue
+                switch = self.switches[switch_name]
+                for position in switch.positions:
+                    for a, b in switch.internal_links(position):
+                        if switch_terminal not in (a, b):
+                            continue
+                        following = f'{switch_name}:{b if switch_terminal == a else a}'
+                        cost = len(switch.plan_steps(switch._position, position))
+                        heapq.heappush(queue, (pulses + cost, hops + 1, next(counter), following, True,
+                                               positions + ((switch_name, position),), path + (following,)))
+        raise ValueError(f"No route between {src} and {dst}.")
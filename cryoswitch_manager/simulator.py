@@ -0,0 +1,370 @@
+"""Simulated Labphox board behind a serial port.
+
+`SimulatedLabphox` answers the Labphox command protocol ('W:<module>:<cmd>:<value>;')
+with a simple model of the board: DAC codes set the converter output, the ADC channels
+read it back, the IO expander replies with the channel validation IDs and pulses return
+a coil current profile with the armature motion dip when a contact changes state.
+
+It is registered as a pyserial URL handler (see `protocol_sim.py`), so a controller runs
+against it by passing a 'sim://' port, without hardware:
+
+    Cryoswitch(COM_port='sim://SIM0001?hw=3&channels=4')
+
+It can also be served over TCP or UDP, for the Ethernet transports, optionally with
+datagram loss and delay to model a lossy network:
+
+    python -m cryoswitch_manager.simulator --tcp 127.0.0.1:7007
+    Cryoswitch(IP='127.0.0.1:7007', TCP=True)
+
+    python -m cryoswitch_manager.simulator --udp 127.0.0.1:7007 --loss 0.05
+    Cryoswitch(IP='127.0.0.1:7007')
+"""
+import argparse
+import json
+import os
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import serial
+
+END_SEQUENCE = b'\x00\xff\x00\xff'
+
+
+class SimulatedLabphox:
+    def __init__(self, SN='SIM0001', hw=3, channels=4, fw=3, coil_resistance=60.0, constants_file=None):
+        """Model of a Labphox board.
+
+        Args:
+            SN (str, optional): serial number. Defaults to 'SIM0001'.
+            hw (int, optional): hardware revision, its entry of constants.json is used. Defaults to 3.
+            channels (int, optional): number of ports. Defaults to 4.
+            fw (int, optional): firmware version. Defaults to 3.
+            coil_resistance (float, optional): resistance of the switch coils in Ohm. Defaults to 60.
+            constants_file (str, optional): hardware constants. Defaults to the package's constants.json.
+        """
+        self.SN = SN
+        self.hw = hw
+        self.channels = channels
+        self.fw = fw
+        self.coil_resistance = coil_resistance
+        if constants_file is None:
+            constants_file = os.path.join(os.path.dirname(__file__), 'constants.json')
+        with open(constants_file) as file:
+            self.constants = json.load(file)[f'HW_Ver. {hw}']
+        self.adc_ref = 3.3
+        self.temperature = 30.0
+        # latching switches keep their contacts through a reset of the board
+        self.contacts = {}
+        self.unplugged_until = 0
+        self.reset()
+
+    def reset(self):
+        """Power-on state of the board."""
+        self.gpio = {}
+        self.DAC = {5: {'on': 0, 'code': 0}, 8: {'on': 0, 'code': 0}}
+        self.ADC_channel = 0
+        self.ADC3_channel = 0
+        self.sampling_divider = 3000  # 84000 / 28kHz
+        self.duration_code = 1500
+        self.switch_model = 1
+        self.selected = None
+
+    def unplug(self, duration_s):
+        """Drop the link for duration_s seconds, as when the USB cable is pulled."""
+        self.unplugged_until = time.time() + duration_s
+
+    @property
+    def unplugged(self):
+        return time.time() < self.unplugged_until
+
+    # analog model
+    def converter_voltage(self):
+        c = self.constants
+        if not (self.gpio.get('E') and self.gpio.get('F') and self.DAC[5]['on']):
+            return 0.0
+        v_dac = self.DAC[5]['code'] * self.adc_ref / c['ADC_12B_res']
+        v_out = c['converter_VREF'] * (1 + c['converter_R1'] / c['converter_R2']) + \
+            (c['converter_VREF'] - v_dac) * c['converter_R1'] / c['converter_Rf']
+        return v_out * c['converter_correction_codes'][0] + c['converter_correction_codes'][1]
+
+    def bias_voltage(self):
+        return -5.0 if self.gpio.get('C') else 0.0
+
+    def OCP_mA(self):
+        c = self.constants
+        return self.DAC[8]['code'] * c['OCP_gain'] * 1000 * self.adc_ref / (
+            c['current_sense_R'] * c['current_gain'] * c['ADC_12B_res'])
+
+    def ADC_code(self, channel):
+        c = self.constants
+        if channel == c['converter_ADC']:
+            value = self.converter_voltage() / (self.adc_ref * c['converter_divider'] / c['ADC_12B_res'])
+        elif channel == c['bv_ADC']:
+            gain = self.adc_ref * ((c['bv_R2'] + c['bv_R1']) / c['bv_R1']) / c['ADC_12B_res']
+            offset = self.adc_ref * c['bv_R2'] / c['bv_R1']
+            value = (self.bias_voltage() + offset) / gain
+        elif channel == 16:
+            value = (0.76 + (self.temperature - 25) * 0.0025) * c['ADC_12B_res'] / self.adc_ref
+        else:
+            value = 0
+        return int(round(min(max(value, 0), c['ADC_12B_res'])))
+
+    def pulse(self):
+        c = self.constants
+        sampling_freq = 84000 / self.sampling_divider * 1000
+        duration_s = self.duration_code / 100 / 1000
+        t = np.arange(int(sampling_freq * (duration_s + 0.004))) / sampling_freq
+        peak = min(self.converter_voltage() / self.coil_resistance * 1000, self.OCP_mA() or np.inf)
+        current = peak * (1 - np.exp(-t / 0.001))
+        if self.selected is not None:
+            port, contact, polarity = self.selected
+            if self.contacts.get((port, contact)) != polarity:
+                # the armature travels while the coil charges
+                current -= np.where((t > 0.003) & (t < 0.006), 0.2 * peak * np.sin((t - 0.003) / 0.003 * np.pi), 0)
+            self.contacts[port, contact] = polarity
+        after = t > duration_s
+        current[after] = current[~after][-1] * np.exp(-(t[after] - duration_s) / 0.0005)
+        current = np.r_[np.zeros(20), current[:-20]]
+        gain = 1000 * self.adc_ref / (c['current_sense_R'] * c['current_gain'] * c['ADC_8B_res'])
+        # 255 is kept out of the data so that it never looks like the end sequence
+        return np.clip(np.round(current / gain), 0, 254).astype(np.uint8).tobytes()
+
+    # protocol
+    def handle(self, command: bytes) -> bytes:
+        """Reply to one ';' terminated command."""
+        text = command.decode().strip(';')
+        fields = text.split(':')
+        if len(fields) < 4:
+            return b'ERR;'
+        _, module, cmd, value = fields[:4]
+        if module == '3' and cmd == 'T':
+            self.selected, data = None, self.pulse()
+            return command + data + END_SEQUENCE
+        reply = self.reply(module, cmd, value)
+        if module == '2' and cmd in 'ABDEF':
+            return f'{reply};'.encode()
+        return f'W:{module}:{cmd}:{reply};'.encode()
+
+    def reply(self, module, cmd, value):
+        if module == '2':
+            return {
+                'A': 'LabPhox', 'B': f'FW_Ver.{self.fw}', 'D': f'HW_Ver. {self.hw}', 'E': self.SN,
+                'F': f'Channels: {self.channels}', 'C': 1, 'G': 0,
+            }.get(cmd, value)
+        if module == '1':
+            if cmd == 'H':
+                return int(bool(self.gpio.get('E') and self.gpio.get('F')))
+            if cmd == 'I':
+                return 0
+            self.gpio[cmd] = int(value or 0)
+            return value
+        if module in ('5', '8'):
+            DAC = self.DAC[int(module)]
+            if cmd == 'T':
+                DAC['on'] = int(value)
+            elif cmd == 'S':
+                DAC['code'] = int(value)
+            return value
+        if module == '4':
+            if cmd == 'S':
+                self.ADC_channel = int(value)
+            elif cmd == 'G':
+                return self.ADC_code(self.ADC_channel)
+            return value
+        if module == 'W':
+            if cmd == 'S':
+                self.ADC3_channel = int(value)
+            elif cmd == 'G':
+                return int(round(2.5 * self.constants['ADC_12B_res'] / self.adc_ref))
+            return value
+        if module == '0':
+            if cmd == 'A':
+                self.duration_code = int(value)
+            elif cmd == 'S':
+                self.sampling_divider = int(value)
+            return value
+        if module == '7':
+            if cmd == 'R':
+                self.reset()
+            return value
+        if module == '6':
+            if cmd == 'S':
+                self.switch_model = int(value)
+            elif cmd == 'O':
+                return 0
+            return value
+        if module in 'ABCDEFGH'[:self.channels] and cmd in ('C', 'D'):
+            number, polarity = int(value), int(cmd == 'C')
+            self.selected = (module, number + 1, polarity)
+            if self.switch_model == 1:
+                shift_byte, offset = (0b0110, 0) if polarity else (0b1001, 0)
+            else:
+                shift_byte, offset = (0b10, 4096) if polarity else (0b01, 8192)
+            validation_id = (shift_byte << 2 * number) + offset
+            return (validation_id & 255) | (validation_id >> 8)
+        return value or 0
+
+
+def simulated_board(SN='SIM0001', **kwargs):
+    """The simulated board with a serial number, created with kwargs (see `SimulatedLabphox`) if it doesn't exist."""
+    with SimulatorSerial.boards_lock:
+        board = SimulatorSerial.boards.get(SN)
+        if board is None:
+            board = SimulatorSerial.boards[SN] = SimulatedLabphox(SN, **kwargs)
+        return board
+
+
+class SimulatorSerial(serial.SerialBase):
+    """pyserial port connected to a `SimulatedLabphox`, opened with serial.serial_for_url('sim://<SN>?hw=3')."""
+
+    # one board per serial number, so that reopening the port finds the same state
+    boards = {}
+    boards_lock = threading.Lock()
+
+    def open(self):
+        if self._port is None:
+            raise serial.SerialException('Port must be configured before it can be used.')
+        url = urllib.parse.urlparse(self._port)
+        if url.scheme != 'sim':
+            raise serial.SerialException(f'Expected a sim:// URL, got {self._port}')
+        options = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        self.board = simulated_board(
+            url.netloc or 'SIM0001', hw=int(options.get('hw', 3)), channels=int(options.get('channels', 4)),
+            coil_resistance=float(options.get('coil', 60.0)),
+        )
+        self.check_link()
+        self._input = bytearray()
+        self._output = bytearray()
+        self.is_open = True
+
+    def check_link(self):
+        if self.board.unplugged:
+            raise serial.SerialException(f'{self.board.SN} is disconnected')
+
+    def close(self):
+        self.is_open = False
+
+    def _reconfigure_port(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        self.check_link()
+        return len(self._input)
+
+    def read(self, size=1):
+        data = bytes(self._input[:size])
+        del self._input[:size]
+        return data
+
+    def write(self, data):
+        self.check_link()
+        self._output += data
+        while b';' in self._output:
+            index = self._output.index(b';') + 1
+            command, self._output = bytes(self._output[:index]), self._output[index:]
+            with self.boards_lock:
+                self._input += self.board.handle(command)
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._input.clear()
+
+    def reset_output_buffer(self):
+        self._output.clear()
+
+
+class SimulatorTCPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        board = self.server.board
+        pending = b''
+        while not board.unplugged:
+            data = self.request.recv(1024)
+            if not data or board.unplugged:
+                break
+            pending += data
+            while b';' in pending:
+                index = pending.index(b';') + 1
+                command, pending = pending[:index], pending[index:]
+                with SimulatorSerial.boards_lock:
+                    reply = board.handle(command)
+                self.request.sendall(reply)
+
+
+class SimulatorTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, board):
+        """TCP server of a simulated board, each connection is a stream of commands and replies.
+
+        Args:
+            address (tuple): (host, port) to listen on.
+            board (SimulatedLabphox): the board answering.
+        """
+        self.board = board
+        super().__init__(address, SimulatorTCPHandler)
+
+
+class SimulatorUDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        data, connection = self.request
+        if server.board.unplugged or random.random() < server.loss:
+            return
+        with SimulatorSerial.boards_lock:
+            reply = b''.join(server.board.handle(command + b';') for command in data.split(b';')[:-1])
+        if server.delay_s:
+            time.sleep(server.delay_s)
+        # replies longer than a datagram, i.e. pulse captures, are split
+        for start in range(0, len(reply), server.datagram_size):
+            if random.random() >= server.loss:
+                connection.sendto(reply[start:start + server.datagram_size], self.client_address)
+
+
+class SimulatorUDPServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, board, loss=0.0, delay_s=0.0, datagram_size=1024):
+        """UDP server of a simulated board, each datagram holds commands and each reply is sent back.
+
+        Args:
+            address (tuple): (host, port) to listen on.
+            board (SimulatedLabphox): the board answering.
+            loss (float, optional): probability that a datagram, in either direction, is lost. Defaults to 0.
+            delay_s (float, optional): delay before replying. Defaults to 0.
+            datagram_size (int, optional): largest datagram sent. Defaults to 1024.
+        """
+        self.board = board
+        self.loss = loss
+        self.delay_s = delay_s
+        self.datagram_size = datagram_size
+        super().__init__(address, SimulatorUDPHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Simulated LabPhox board')
+    parser.add_argument('--tcp', help='host:port to serve the board on over TCP')
+    parser.add_argument('--udp', help='host:port to serve the board on over UDP')
+    parser.add_argument('--loss', type=float, default=0.0, help='UDP datagram loss probability')
+    parser.add_argument('--delay', type=float, default=0.0, help='UDP reply delay in s')
+    parser.add_argument('--SN', default='SIM0001')
+    parser.add_argument('--hw', type=int, default=3)
+    parser.add_argument('--channels', type=int, default=4)
+    args = parser.parse_args()
+
+    board = simulated_board(args.SN, hw=args.hw, channels=args.channels)
+    if args.udp:
+        host, port = args.udp.rsplit(':', 1)
+        server = SimulatorUDPServer((host, int(port)), board, loss=args.loss, delay_s=args.delay)
+        print(f'Simulated LabPhox {args.SN} on udp://{host}:{port}')
+    else:
+        host, port = (args.tcp or '127.0.0.1:7007').rsplit(':', 1)
+        server = SimulatorTCPServer((host, int(port)), board)
+        print(f'Simulated LabPhox {args.SN} on tcp://{host}:{port}')
+    server.serve_forever()
@@ -0,0 +1,270 @@
+"""Switch states shared between processes through a memory-mapped table.
+
+The GUI, the controller daemon and scripts all read the tracked switch states. Parsing
+`states.json` on every query is slow, and rewriting it from several processes loses
+updates. The states are therefore kept in a fixed-layout table, `states.table` next to
+`states.json`, mapped in memory by every process:
+
+    header   magic, version, number of slots, slot size
+    slot     serial number, mask of the ports present, then one row per port
+    row      sequence number, the states of contacts 1-6 (-1 unknown, 0 or 1)
+
+Each row is a seqlock. A writer takes a byte-range lock on its row only, makes the
+sequence number odd, writes the states and makes it even again. Readers take no lock:
+they retry while the sequence number is odd or changed during the read, and after
+`READ_RETRIES` read under the row lock, so that a row left odd by a writer that died
+is still readable. The next write of such a row makes its sequence number even again.
+Slots are allocated under a lock on the header and never freed.
+
+`states.json` stays the persistent format read by the other tools. The table is seeded
+from it when the table file is created only: from then on the table takes precedence, and
+edits of `states.json` are ignored (delete `states.table` to seed it again). Changes are
+written back to `states.json` by `schedule_export`, at most every `EXPORT_DELAY_S`, and at exit.
+"""
+import atexit
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_range(fd, offset, length):
+        os.lseek(fd, offset, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, length)
+
+    def _unlock_range(fd, offset, length):
+        os.lseek(fd, offset, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, length)
+else:
+    import fcntl
+
+    def _lock_range(fd, offset, length):
+        fcntl.lockf(fd, fcntl.LOCK_EX, length, offset)
+
+    def _unlock_range(fd, offset, length):
+        fcntl.lockf(fd, fcntl.LOCK_UN, length, offset)
+
+MAGIC = b'CSST'
+VERSION = 1
+PORTS = 'ABCDEFGH'
+CONTACTS = 6
+N_SLOTS = 64
+UNKNOWN = -1
+EXPORT_DELAY_S = 1.0
+READ_RETRIES = 1000
+
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<32sB7x')
+ROW = struct.Struct('<Q6b2x')
+SLOT_SIZE = SLOT_HEADER.size + len(PORTS) * ROW.size
+TABLE_SIZE = HEADER_SIZE + N_SLOTS * SLOT_SIZE
+
+
+class StateTable:
+    # one mapping per file and process: POSIX record locks belong to the process, closing a
+    # second descriptor of the file would release the locks held through the first one
+    _tables = {}
+    _tables_guard = threading.Lock()
+
+    @classmethod
+    def open(cls, filename, seed_file=None):
+        """Shared table of a file, created and seeded from a `states.json` file if it doesn't exist.
+
+        Args:
+            filename (str): table file, e.g. `<abs_path>/states.table`.
+            seed_file (str, optional): `states.json` file to seed a new table from. Defaults to None.
+
+        Returns:
+            StateTable: the table, the same instance for every call with the same file.
+        """
+        with cls._tables_guard:
+            key = os.path.abspath(filename)
+            table = cls._tables.get(key)
+            if table is None:
+                table = cls._tables[key] = cls(filename, seed_file)
+            return table
+
+    def __init__(self, filename, seed_file=None):
+        self.filename = filename
+        self.lock = threading.RLock()  # rows are read under their lock while exporting under the header lock
+        self._slots = {}
+        self._pending_exports = set()
+        self._export_timer = None
+        self._export_guard = threading.Lock()
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        with self._locked(0, HEADER_SIZE):
+            created = os.fstat(self.fd).st_size < TABLE_SIZE
+            if created:
+                os.ftruncate(self.fd, TABLE_SIZE)
+            self.map = mmap.mmap(self.fd, TABLE_SIZE)
+            if created:
+                HEADER.pack_into(self.map, 0, MAGIC, VERSION, N_SLOTS, SLOT_SIZE)
+                if seed_file and os.path.isfile(seed_file):
+                    with open(seed_file) as file:
+                        for SN, states in json.load(file).items():
+                            self._allocate(SN, states)
+            elif HEADER.unpack_from(self.map, 0) != (MAGIC, VERSION, N_SLOTS, SLOT_SIZE):
+                raise ValueError(f'{filename} is not a version {VERSION} state table')
+        atexit.register(self.export_pending)
+
+    @contextmanager
+    def _locked(self, offset, length):
+        with self.lock:
+            _lock_range(self.fd, offset, length)
+            try:
+                yield
+            finally:
+                _unlock_range(self.fd, offset, length)
+
+    @staticmethod
+    def _slot_offset(index):
+        return HEADER_SIZE + index * SLOT_SIZE
+
+    @staticmethod
+    def _row_offset(slot, port):
+        return slot + SLOT_HEADER.size + PORTS.index(port) * ROW.size
+
+    def _find(self, SN):
+        index = self._slots.get(SN)
+        if index is not None:
+            return self._slot_offset(index)
+        name = str(SN).encode()
+        for index in range(N_SLOTS):
+            slot_name = SLOT_HEADER.unpack_from(self.map, self._slot_offset(index))[0].rstrip(b'\0')
+            if slot_name == name:
+                self._slots[SN] = index
+                return self._slot_offset(index)
+            if not slot_name:
+                break
+        return None
+
+    def _allocate(self, SN, states):
+        # called with the header locked, the name is written last so that readers never see a
+        # slot whose rows aren't written yet
+        slot = self._find(SN)
+        if slot is not None:
+            return slot
+        for index in range(N_SLOTS):
+            slot = self._slot_offset(index)
+            if not SLOT_HEADER.unpack_from(self.map, slot)[0].rstrip(b'\0'):
+                break
+        else:
+            raise ValueError(f'The state table {self.filename} is full ({N_SLOTS} controllers)')
+        mask = 0
+        for number, port in enumerate(PORTS):
+            contacts = states.get('port_' + port)
+            if contacts is not None:
+                mask |= 1 << number
+                row = [contacts.get('contact_' + str(contact)) for contact in range(1, CONTACTS + 1)]
+                ROW.pack_into(self.map, self._row_offset(slot, port), 0, *(UNKNOWN if state is None else state for state in row))
+        SLOT_HEADER.pack_into(self.map, slot, b'', mask)
+        self.map[slot:slot + 32] = str(SN).encode().ljust(32, b'\0')
+        self._slots[SN] = index
+        return slot
+
+    def add(self, SN, template='SN'):
+        """Add a controller with the states of the `template` entry (all unknown), if it isn't in the table."""
+        if self._find(SN) is None:
+            with self._locked(0, HEADER_SIZE):
+                self._allocate(SN, self.states(template) or {'port_' + port: {} for port in PORTS[:4]})
+
+    def __contains__(self, SN):
+        return self._find(SN) is not None
+
+    def serial_numbers(self) -> list:
+        names = []
+        for index in range(N_SLOTS):
+            name = SLOT_HEADER.unpack_from(self.map, self._slot_offset(index))[0].rstrip(b'\0')
+            if not name:
+                break
+            names.append(name.decode())
+        return names
+
+    def _read_row(self, row_offset):
+        for _ in range(READ_RETRIES):
+            seq, *states = ROW.unpack_from(self.map, row_offset)
+            if not seq & 1 and ROW.unpack_from(self.map, row_offset)[0] == seq:
+                break
+        else:
+            # a writer is slow or died while updating the row, wait for the row lock
+            with self._locked(row_offset, ROW.size):
+                seq, *states = ROW.unpack_from(self.map, row_offset)
+        return {'contact_' + str(contact): None if state == UNKNOWN else state
+                for contact, state in enumerate(states, start=1)}
+
+    def port_states(self, SN, port) -> dict:
+        """States of the contacts of a port, without locking.
+
+        Returns:
+            dict: {'contact_1': state, ...} with 0, 1 or None, None if the controller or the port isn't in the table.
+        """
+        slot = self._find(SN)
+        if slot is None or port not in PORTS:
+            return None
+        if not SLOT_HEADER.unpack_from(self.map, slot)[1] >> PORTS.index(port) & 1:
+            return None
+        return self._read_row(self._row_offset(slot, port))
+
+    def states(self, SN) -> dict:
+        """States of every port of a controller, in the layout of a `states.json` entry, None if it isn't in the table."""
+        slot = self._find(SN)
+        if slot is None:
+            return None
+        mask = SLOT_HEADER.unpack_from(self.map, slot)[1]
+        return {'port_' + port: self._read_row(self._row_offset(slot, port))
+                for number, port in enumerate(PORTS) if mask >> number & 1}
+
+    def set_state(self, SN, port, contact, state):
+        """Update the state of one contact, locking only the row of its port.
+
+        Returns:
+            int: the new sequence number of the row, None if the controller or the port isn't in the table.
+        """
+        slot = self._find(SN)
+        if slot is None or port not in PORTS or not SLOT_HEADER.unpack_from(self.map, slot)[1] >> PORTS.index(port) & 1:
+            return None
+        row_offset = self._row_offset(slot, port)
+        with self._locked(row_offset, ROW.size):
+            seq, *states = ROW.unpack_from(self.map, row_offset)
+            states[contact - 1] = UNKNOWN if state is None else state
+            # odd while updating whatever the parity left by a writer that died mid-update
+            seq |= 1
+            struct.pack_into('<Q', self.map, row_offset, seq)
+            ROW.pack_into(self.map, row_offset, seq, *states)
+            struct.pack_into('<Q', self.map, row_offset, seq + 1)
+        return seq + 1
+
+    def export(self, filename):
+        """Write the table to a `states.json` file, atomically."""
+        with self._locked(0, HEADER_SIZE):
+            states = {SN: self.states(SN) for SN in self.serial_numbers()}
+            tmp_file = f'{filename}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w') as outfile:
+                json.dump(states, outfile, indent=4, sort_keys=True)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(tmp_file, filename)
+
+    def schedule_export(self, filename, delay_s=EXPORT_DELAY_S):
+        """Export the table to a `states.json` file within `delay_s`, several changes are written at once."""
+        with self._export_guard:
+            self._pending_exports.add(filename)
+            if self._export_timer is None:
+                self._export_timer = threading.Timer(delay_s, self.export_pending)
+                self._export_timer.daemon = True
+                self._export_timer.start()
+
+    def export_pending(self):
+        """Write the scheduled exports now, called at exit."""
+        with self._export_guard:
+            filenames, self._pending_exports = self._pending_exports, set()
+            if self._export_timer is not None:
+                self._export_timer.cancel()
+                self._export_timer = None
+        for filename in filenames:
+            self.export(filename)
@@ -0,0 +1,91 @@
+"""Verification of switch actuations from their captured current profile.
+
+A pulse that actually drove the coil peaks above the polarization current of the
+output stage, and a pulse that moved the armature shows a dip in the coil current
+when the armature travels. `PulseSignature` checks a capture against those
+expectations and `RetryPolicy` gives the escalating pulse settings used to retry the
+actuations that failed the check.
+"""
+import numpy as np
+
+from .pulse_analytics import analyze_profiles
+
+
+class PulseSignature:
+    def __init__(self, min_coil_current_mA=5.0, min_dip_mA=2.0, threshold=0):
+        """Expected current signature of a successful actuation.
+
+        Args:
+            min_coil_current_mA (float, optional): margin by which the peak must exceed the polarization current.
+                Defaults to 5.0.
+            min_dip_mA (float, optional): minimum depth of the armature motion dip. Defaults to 2.0.
+            threshold (float, optional): edge detection threshold in mA. Defaults to 0.
+        """
+        self.min_coil_current_mA = min_coil_current_mA
+        self.min_dip_mA = min_dip_mA
+        self.threshold = threshold
+
+    def check(self, current_profile, polarization_current_mA, expect_motion=True, sampling_freq=None):
+        """Check a captured pulse.
+
+        Args:
+            current_profile (PulseCapture): captured current profile.
+            polarization_current_mA (float): polarization current at the pulse voltage,
+                see `Cryoswitch.calculate_polarization_current_mA`.
+            expect_motion (bool, optional): the armature was expected to move, so a dip must be present.
+                Defaults to True.
+            sampling_freq (float, optional): sampling frequency in Hz. Defaults to the capture's own `sampling_freq`.
+
+        Returns:
+            tuple[bool, str]: whether the pulse matches the signature, and the reason when it doesn't.
+        """
+        if current_profile is None or not len(current_profile):
+            return False, 'no current profile'
+        if sampling_freq is None:
+            sampling_freq = current_profile.sampling_freq
+        metrics = analyze_profiles([np.asarray(current_profile)], sampling_freq, threshold=self.threshold)
+
+        peak = metrics['peak'][0]
+        min_peak = polarization_current_mA + self.min_coil_current_mA
+        if peak < min_peak:
+            return False, f'peak {peak:.1f}mA below {min_peak:.1f}mA'
+
+        dip = metrics['dip_depth'][0]
+        if expect_motion and dip < self.min_dip_mA:
+            return False, f'no armature dip ({dip:.1f}mA)'
+        return True, ''
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=2, duration_step_ms=10, voltage_step=1.0, max_voltage=None):
+        """Escalation of the pulse settings when an actuation fails verification.
+
+        Args:
+            max_retries (int, optional): retries after the first attempt. Defaults to 2.
+            duration_step_ms (float, optional): pulse duration added at every retry. Defaults to 10.
+            voltage_step (float, optional): output voltage added at every retry. Defaults to 1.0.
+            max_voltage (float, optional): upper bound of the escalated voltage. Defaults to None, the
+                controller's converter range.
+        """
+        self.max_retries = max_retries
+        self.duration_step_ms = duration_step_ms
+        self.voltage_step = voltage_step
+        self.max_voltage = max_voltage
+
+    def settings(self, attempt, pulse_duration_ms, voltage, duration_range, voltage_range):
+        """Pulse duration and output voltage of a retry.
+
+        Args:
+            attempt (int): retry number, starting at 1.
+            pulse_duration_ms (float): pulse duration of the first attempt.
+            voltage (float): output voltage of the first attempt.
+            duration_range (list): allowed pulse duration range.
+            voltage_range (list): allowed output voltage range.
+
+        Returns:
+            tuple[float, float]: the escalated pulse duration and output voltage.
+        """
+        max_voltage = voltage_range[1] if self.max_voltage is None else min(self.max_voltage, voltage_range[1])
+        duration = max(pulse_duration_ms, min(duration_range[1], pulse_duration_ms + attempt * self.duration_step_ms))
+        voltage = max(voltage, min(max_voltage, voltage + attempt * self.voltage_step))
+        return duration, voltage
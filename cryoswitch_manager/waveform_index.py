@@ -0,0 +1,151 @@
+"""Index of the waveform log.
+
+`Cryoswitch.log_waveform` writes one JSON file per pulse. Listing past pulses from
+those files means opening every one of them, so every logged waveform also gets a
+line in `<log_wav_dir>/<SN>/index.jsonl` with its time, port, contact, polarity and
+path. Listing a history only reads the index, and captures are loaded one by one when
+they are needed. Entries whose file was deleted by the retention policy are skipped
+when loaded and dropped by `prune`.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from .retention import ANOMALOUS_SUFFIX
+
+INDEX_NAME = 'index.jsonl'
+
+
+class WaveformIndex:
+    # instances of the same index, e.g. the controller's and the log compactor's, share its lock
+    _locks = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, log_wav_dir, SN):
+        """Index of the waveforms of one controller.
+
+        Args:
+            log_wav_dir (str): waveform log directory, e.g. `Cryoswitch.log_wav_dir`.
+            SN (str): serial number of the controller.
+        """
+        self.log_wav_dir = log_wav_dir
+        self.SN = SN
+        self.directory = os.path.join(log_wav_dir, str(SN))
+        self.filename = os.path.join(self.directory, INDEX_NAME)
+        with self._locks_guard:
+            self.lock = self._locks.setdefault(os.path.abspath(self.filename), threading.Lock())
+
+    def append(self, timestamp, port, contact, polarity, voltage, path):
+        entry = {
+            'time': timestamp, 'port': port, 'contact': contact, 'polarity': polarity, 'voltage': voltage,
+            'path': os.path.relpath(path, self.directory), 'anomalous': path.endswith(ANOMALOUS_SUFFIX + '.json'),
+        }
+        with self.lock:
+            if not os.path.isfile(self.filename):
+                # first indexed waveform, the older ones (and this one) are indexed from their file names
+                self._rebuild()
+                return
+            with open(self.filename, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
+
+    def entries(self, port=None, contact=None) -> list:
+        """Indexed waveforms, oldest first, rebuilt from the file names if there is no index yet.
+
+        Args:
+            port (str, optional): only the waveforms of this port. Defaults to None.
+            contact (int, optional): only the waveforms of this contact. Defaults to None.
+
+        Returns:
+            list[dict]: entries with 'time', 'port', 'contact', 'polarity', 'voltage', 'path' and 'anomalous'.
+        """
+        with self.lock:
+            if not os.path.isfile(self.filename):
+                self._rebuild()
+            entries = []
+            with open(self.filename) as file:
+                for line in file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        if port is not None:
+            entries = [entry for entry in entries if entry['port'] == port]
+        if contact is not None:
+            entries = [entry for entry in entries if entry['contact'] == contact]
+        entries.sort(key=lambda entry: entry['time'])
+        return entries
+
+    def _rebuild(self):
+        # log files are named <timestamp>_<voltage>V_<port><contact>_<polarity>[_anomalous].json
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    timestamp, voltage, port_contact, polarity = name[:-len('.json')].split('_')[:4]
+                    entry = {
+                        'time': int(timestamp), 'port': port_contact[0], 'contact': int(port_contact[1:]),
+                        'polarity': int(polarity), 'voltage': float(voltage[:-1]) if voltage[:-1] != 'None' else None,
+                    }
+                except ValueError:
+                    continue
+                path = os.path.join(root, name)
+                entry['path'] = os.path.relpath(path, self.directory)
+                entry['anomalous'] = name.endswith(ANOMALOUS_SUFFIX + '.json')
+                entries.append(entry)
+        entries.sort(key=lambda entry: entry['time'])
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.filename, 'w') as file:
+            for entry in entries:
+                file.write(json.dumps(entry) + '\n')
+
+    def load(self, entry):
+        """Load the capture of an index entry.
+
+        Returns:
+            tuple[np.ndarray, float]: the current profile in mA and its sampling frequency in Hz,
+                None if the file was deleted or can't be parsed.
+        """
+        try:
+            with open(os.path.join(self.directory, entry['path'])) as file:
+                waveform = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return np.asarray(waveform['data'], dtype=float), waveform['SF']
+
+    def prune(self) -> int:
+        """Drop the entries whose file no longer exists.
+
+        Returns:
+            int: number of dropped entries.
+        """
+        with self.lock:
+            if not os.path.isfile(self.filename):
+                return 0
+            with open(self.filename) as file:
+                lines = file.readlines()
+            kept = []
+            for line in lines:
+                try:
+                    path = json.loads(line)['path']
+                except (ValueError, KeyError):
+                    continue
+                if os.path.isfile(os.path.join(self.directory, path)):
+                    kept.append(line)
+            tmp_filename = self.filename + '.tmp'
+            with open(tmp_filename, 'w') as file:
+                file.writelines(kept)
+            os.replace(tmp_filename, self.filename)
+        return len(lines) - len(kept)
+
+
+def prune_indexes(log_wav_dir) -> int:
+    """Prune the index of every controller below a waveform log directory, see `WaveformIndex.prune`."""
+    dropped = 0
+    for SN in os.listdir(log_wav_dir):
+        if os.path.isfile(os.path.join(log_wav_dir, SN, INDEX_NAME)):
+            dropped += WaveformIndex(log_wav_dir, SN).prune()
+    return dropped
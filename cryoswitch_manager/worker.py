@@ -0,0 +1,85 @@
+"""Background execution of switch operations.
+
+Every controller gets one `ControllerWorker`, a single thread executing the submitted
+operations in submission order, so that hardware operations on a controller never
+interleave while the caller keeps running. Operations are returned as
+`concurrent.futures.Future`s: they can be cancelled until they start, and awaited
+from asyncio code with `asyncio.wrap_future`. Operations spanning several controllers are
+split into one operation per worker and gathered into a single future.
+"""
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+
+class ControllerWorker:
+    def __init__(self, controller):
+        """Single thread executing the operations of one controller in order.
+
+        Args:
+            controller (Cryoswitch): controller the operations run on. Its `lock` is held during each
+                operation, so synchronous calls from other threads are serialized with the queued ones.
+        """
+        self.controller = controller
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'cryoswitch-{controller.SN}')
+
+    def _run(self, function, args, kwargs):
+        with self.controller.lock:
+            return function(*args, **kwargs)
+
+    def submit(self, function, *args, **kwargs):
+        """Queue `function(*args, **kwargs)` after the operations already submitted.
+
+        Returns:
+            concurrent.futures.Future: the result of the operation.
+        """
+        return self._executor.submit(self._run, function, args, kwargs)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop the worker once the queued operations are done, or cancel the ones not started yet."""
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def gather_futures(futures, combine) -> Future:
+    """Single future resolving once all `futures` are done.
+
+    Cancelling it cancels the futures not started yet. If one of the futures fails, its exception is
+    raised by the gathered future.
+
+    Args:
+        futures (list[concurrent.futures.Future]): futures to wait for.
+        combine (callable): called with the list of results, its return value is the gathered result.
+
+    Returns:
+        concurrent.futures.Future: the gathered future.
+    """
+    gathered = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def cancel_pending(future):
+        if future.cancelled():
+            for part in futures:
+                part.cancel()
+
+    def part_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        if not gathered.set_running_or_notify_cancel():
+            return
+        if any(part.cancelled() for part in futures):
+            gathered.set_exception(CancelledError())
+            return
+        for part in futures:
+            if part.exception() is not None:
+                gathered.set_exception(part.exception())
+                return
+        gathered.set_result(combine([part.result() for part in futures]))
+
+    gathered.add_done_callback(cancel_pending)
+    if not futures:
+        gathered.set_result(combine([]))
+    for future in futures:
+        future.add_done_callback(part_done)
+    return gathered
@@ -20,9 +20,9 @@ cryoswitch_config_dr1 = [
         "position": None
     },
     {
-        "name": "switch_A_6x1",
+        "name": "output_switch_A_2x2",
         "switch_model": "R577433007",
-        "controller_port": "C34",  # switch terminal 3 and 3 connected to port C line 3 and 4, respectively
+        "controller_port": "C34",  # switch terminal 3 and 4 connected to port C line 3 and 4, respectively
         "position": None
     },
 ]
@@ -0,0 +1,35 @@
+import threading
+
+from cryoswitch_manager.daemon import FairQueue
+
+
+def test_round_robin():
+    queue = FairQueue()
+    for i in range(3):
+        queue.put('a', ('a', i))
+    queue.put('b', ('b', 0))
+    queue.put('c', ('c', 0))
+
+    assert [queue.get() for _ in range(5)] == [('a', 0), ('b', 0), ('c', 0), ('a', 1), ('a', 2)]
+
+
+def test_remove_drops_requests_of_client():
+    queue = FairQueue()
+    queue.put('a', 1)
+    queue.put('b', 2)
+    queue.remove('a')
+
+    assert queue.get() == 2
+
+
+def test_close_wakes_waiting_getter():
+    queue = FairQueue()
+    result = []
+    getter = threading.Thread(target=lambda: result.append(queue.get()))
+    getter.start()
+
+    queue.close()
+    getter.join(timeout=5)
+
+    assert not getter.is_alive()
+    assert result == [None]
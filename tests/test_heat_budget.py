@@ -0,0 +1,29 @@
+import threading
+
+import pytest
+
+from cryoswitch_manager.heat_budget import HeatBudget
+
+
+@pytest.mark.parametrize('capacity_mJ, cooling_rate_mW', [(0, 10), (10, None), (10, 0), (None, 10)])
+def test_invalid_budget(capacity_mJ, cooling_rate_mW):
+    with pytest.raises(ValueError):
+        HeatBudget(capacity_mJ, cooling_rate_mW)
+
+
+def test_concurrent_acquire_does_not_overdraw():
+    budget = HeatBudget(10, 100)
+    lowest = []
+
+    def acquire():
+        budget.acquire(6)
+        with budget._lock:
+            lowest.append(budget._tokens)
+
+    threads = [threading.Thread(target=acquire) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert min(lowest) >= 0
@@ -0,0 +1,97 @@
+import subprocess
+import sys
+
+import pytest
+
+from cryoswitch_manager.journal import JournalLocked, StateJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = StateJournal(str(tmp_path / 'state_journal_SN.jsonl'), fsync=False)
+    yield journal
+    journal.close()
+
+
+def test_recover_committed_and_pending(journal):
+    journal.commit(journal.begin('SN', 'A', 1, 1), True)
+    seq = journal.begin('SN', 'B', 2, 1)
+
+    committed, pending = journal.recover()
+
+    assert committed == {('A', 1): 1}
+    assert [record['seq'] for record in pending] == [seq]
+
+
+def test_recover_failed_commit_is_resolved(journal):
+    journal.commit(journal.begin('SN', 'A', 1, 1), True)
+    journal.commit(journal.begin('SN', 'A', 1, 0), False)
+
+    committed, pending = journal.recover()
+
+    assert journal.pending == []
+    assert pending == []
+    assert committed == {('A', 1): 1}  # the failed actuation was not sent
+
+
+def test_recover_failed_commit_without_previous_state(journal):
+    journal.commit(journal.begin('SN', 'A', 1, 1), False)
+
+    assert journal.recover() == ({}, [])
+
+
+def test_recover_superseded_intent(journal):
+    first = journal.begin('SN', 'A', 1, 1)
+    second = journal.begin('SN', 'A', 1, 0)
+    journal.commit(first, False)
+
+    committed, pending = journal.recover()
+
+    assert committed == {}
+    assert [record['seq'] for record in pending] == [second]
+
+
+def test_recover_unknown(journal):
+    journal.commit(journal.begin('SN', 'A', 1, 1), True)
+    journal.mark_unknown('SN', 'A', 1)
+
+    assert journal.recover() == ({('A', 1): None}, [])
+
+
+def test_recover_ignores_truncated_line(journal):
+    seq = journal.begin('SN', 'A', 1, 1)
+    journal._file.write('{"seq": 2, "op": "do')
+    journal._file.flush()
+
+    committed, pending = journal.recover()
+
+    assert [record['seq'] for record in pending] == [seq]
+
+
+def test_checkpoint_keeps_pending(journal):
+    journal.commit(journal.begin('SN', 'A', 1, 1), True)
+    seq = journal.begin('SN', 'B', 2, 0, settings={'model': 'R583423141', 'voltage': 5})
+    journal.checkpoint()
+
+    records = journal.records()
+
+    assert [record['seq'] for record in records] == [seq]
+    assert records[0]['voltage'] == 5
+
+
+def test_single_writer(journal):
+    with pytest.raises(JournalLocked):
+        StateJournal(journal.filename)
+
+    code = (
+        'import sys\n'
+        'from cryoswitch_manager.journal import JournalLocked, StateJournal\n'
+        'try:\n'
+        f'    StateJournal({journal.filename!r})\n'
+        'except JournalLocked:\n'
+        '    sys.exit(3)\n'
+    )
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 3
+
+    journal.close()
+    StateJournal(journal.filename).close()
@@ -0,0 +1,81 @@
+import json
+import struct
+import threading
+
+import pytest
+
+from cryoswitch_manager import state_table
+from cryoswitch_manager.state_table import ROW, StateTable
+
+
+@pytest.fixture
+def table(tmp_path):
+    table = StateTable(str(tmp_path / 'states.table'))
+    table.add('SN1')
+    return table
+
+
+def row_offset(table, SN, port):
+    return table._row_offset(table._find(SN), port)
+
+
+def test_set_and_read(table):
+    table.set_state('SN1', 'A', 2, 1)
+    table.set_state('SN1', 'A', 3, 0)
+
+    assert table.port_states('SN1', 'A') == {
+        'contact_1': None, 'contact_2': 1, 'contact_3': 0, 'contact_4': None, 'contact_5': None, 'contact_6': None,
+    }
+    assert table.port_states('SN2', 'A') is None
+
+
+def test_sequence_numbers_stay_even(table):
+    for seq in (2, 4, 6):
+        assert table.set_state('SN1', 'B', 1, seq // 2 % 2) == seq
+
+
+def test_torn_row_is_read_under_lock(table, monkeypatch):
+    monkeypatch.setattr(state_table, 'READ_RETRIES', 10)
+    table.set_state('SN1', 'A', 1, 1)
+    offset = row_offset(table, 'SN1', 'A')
+    # a writer died between making the sequence number odd and even again
+    struct.pack_into('<Q', table.map, offset, 3)
+
+    assert table.port_states('SN1', 'A')['contact_1'] == 1
+
+
+def test_torn_row_heals_on_next_write(table):
+    offset = row_offset(table, 'SN1', 'A')
+    struct.pack_into('<Q', table.map, offset, 3)
+
+    seq = table.set_state('SN1', 'A', 2, 0)
+
+    assert seq % 2 == 0
+    assert ROW.unpack_from(table.map, offset)[0] == seq
+    assert table.set_state('SN1', 'A', 2, 1) == seq + 2
+
+
+def test_concurrent_writers_of_a_row_keep_every_update(table):
+    def write(contact):
+        for state in (0, 1) * 200:
+            table.set_state('SN1', 'C', contact, state)
+
+    writers = [threading.Thread(target=write, args=(contact,)) for contact in range(1, 7)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    assert set(table.port_states('SN1', 'C').values()) == {1}
+    assert ROW.unpack_from(table.map, row_offset(table, 'SN1', 'C'))[0] == 6 * 400 * 2
+
+
+def test_export(table, tmp_path):
+    table.set_state('SN1', 'A', 1, 1)
+    filename = str(tmp_path / 'states.json')
+
+    table.schedule_export(filename, delay_s=60)
+    table.export_pending()
+
+    with open(filename) as file:
+        assert json.load(file)['SN1']['port_A']['contact_1'] == 1